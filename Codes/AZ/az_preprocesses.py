@@ -8,14 +8,18 @@ from osgeo import gdal
 import rasterio as rio
 from rasterio.merge import merge
 from rasterio.enums import Resampling
+from rasterio.transform import Affine
 
 from os.path import dirname, abspath
 
 sys.path.insert(0, dirname(dirname(dirname(abspath(__file__)))))
 
 from Codes.utils.system_ops import makedirs
+from Codes.utils.raster_catalog import find_raster
 from Codes.utils.raster_ops import read_raster_arr_object, write_array_to_raster, \
-    clip_resample_reproject_raster, sum_rasters, mean_rasters, shapefile_to_raster
+    clip_resample_reproject_raster, sum_rasters, multi_stat_rasters, shapefile_to_raster, get_ref_grid, \
+    get_raster_creation_options, get_gdal_creation_options, finalize_raster_output, read_gdal_dataset_arr, \
+    get_compact_dtype, to_compact_arr, read_compact_raster_arr, write_compact_raster
 
 
 no_data_value = -9999
@@ -59,7 +63,8 @@ def mosaic_rasters_list(input_raster_list, output_dir, raster_name, ref_raster,
         resampling_method = Resampling.bilinear
 
     # reference raster
-    ref_arr, ref_file = read_raster_arr_object(ref_raster)
+    ref_file = get_ref_grid(ref_raster)
+    ref_arr = ref_file.arr
 
     # merging
     if resolution is None:  # will use first input raster's resolution
@@ -124,7 +129,7 @@ def merge_GEE_data_patches_IrrMapper_extents(year_list, input_dir_irrmapper, mer
                             mosaic_rasters_list(input_raster_list=total_raster_list, output_dir=interim_output_dir,
                                                 raster_name=merged_raster_name, ref_raster=ref_raster, dtype=None,
                                                 resampling_method='nearest', mosaicing_method='first',
-                                                resolution=None, nodata=no_data_value)
+                                                resolution=None, nodata=no_data_value, use_vrt=True)
 
                         clip_resample_reproject_raster(input_raster=merged_raster, input_shape=az_shape,
                                                        output_raster_dir=merged_output_dir,
@@ -149,7 +154,7 @@ def merge_GEE_data_patches_IrrMapper_extents(year_list, input_dir_irrmapper, mer
                         mosaic_rasters_list(input_raster_list=total_raster_list, output_dir=interim_output_dir,
                                             raster_name=merged_raster_name, ref_raster=ref_raster, dtype=None,
                                             resampling_method='nearest', mosaicing_method='first',
-                                            resolution=None, nodata=no_data_value)
+                                            resolution=None, nodata=no_data_value, use_vrt=True)
 
                     clip_resample_reproject_raster(input_raster=merged_raster, input_shape=az_shape,
                                                    output_raster_dir=merged_output_dir,
@@ -200,9 +205,8 @@ def classify_irrigated_cropland(irrigated_fraction_dir,
             # saving classified data
             output_irrigated_cropland_raster = os.path.join(irrigated_cropland_output_dir,
                                                             f'Irrigated_cropland_{year}.tif')
-            write_array_to_raster(raster_arr=irrigated_cropland, raster_file=irrig_file, transform=irrig_file.transform,
-                                  output_path=output_irrigated_cropland_raster,
-                                  dtype=np.int32)  # linux can't save data properly if dtype isn't np.int32 in this case
+            write_compact_raster(raster_arr=irrigated_cropland, raster_file=irrig_file, transform=irrig_file.transform,
+                                 output_path=output_irrigated_cropland_raster)  # uint8, 255 as nodata
     else:
         pass
 
@@ -240,19 +244,19 @@ def filter_irrigated_cropET_with_irrigated_cropland(irrigated_cropland_dir,
             print(f'Filtering irrigated cropET data for year {year}...')
 
             # pure irrigated cropland filtered by using irrigated fraction threshold (irrig frac > 0.02)
-            irrigated_cropland_data = glob(os.path.join(irrigated_cropland_dir, f'*{year}*.tif'))[0]
-            irrigated_cropland_arr = read_raster_arr_object(irrigated_cropland_data, get_file=False)
+            irrigated_cropland_data = find_raster(irrigated_cropland_dir, year=year)
+            irrigated_cropland_arr = read_compact_raster_arr(irrigated_cropland_data)
 
             for month in months_to_filter_cropET:
                 if year == 2023 and month == 12:         # OpenET data not available
                     continue
 
                 # # applying irrigated cropland filter to get cropET at purely irrigated pixels
-                irrigated_cropET_data = glob(os.path.join(irrigated_cropET_input_dir, f'*{year}_{month}*.tif'))[0]
+                irrigated_cropET_data = find_raster(irrigated_cropET_input_dir, year=year, month=month)
                 irrigated_cropET_arr, irrigated_cropET_file = read_raster_arr_object(irrigated_cropET_data)
 
                 # applying the filter
-                irrigated_cropET_arr[np.isnan(irrigated_cropland_arr)] = -9999
+                irrigated_cropET_arr[irrigated_cropland_arr != 1] = -9999
 
                 filtered_output_raster = os.path.join(irrigated_cropET_output_dir,
                                                       f'Irrigated_cropET_{year}_{month}.tif')
@@ -352,7 +356,8 @@ def convert_prism_data_to_tif(input_dir, output_dir, keyword='prism_tmax'):
         output_name = keyword + '_' + year_month + '.tif'
         output_file = os.path.join(output_dir, output_name)
         gdal.Translate(destName=output_file, srcDS=data, format='GTiff', outputType=gdal.GDT_Float32,
-                       outputSRS='EPSG:4269')
+                       outputSRS='EPSG:4269', creationOptions=get_gdal_creation_options(gdal.GDT_Float32))
+        finalize_raster_output(output_file)
 
 
 def process_prism_data(prism_bil_dir, prism_tif_dir, output_dir_prism_monthly, output_dir_prism_yearly=None,
@@ -469,7 +474,8 @@ def create_slope_raster(input_raster, output_dir, raster_name, skip_processing=F
     """
     if not skip_processing:
         dem_options = gdal.DEMProcessingOptions(format="GTiff", computeEdges=True, alg='ZevenbergenThorne',
-                                                slopeFormat='percent', scale=100000)
+                                                slopeFormat='percent', scale=100000,
+                                                creationOptions=get_gdal_creation_options(gdal.GDT_Float32))
 
         makedirs([output_dir])
         output_raster = os.path.join(output_dir, raster_name)
@@ -478,6 +484,7 @@ def create_slope_raster(input_raster, output_dir, raster_name, skip_processing=F
                                           options=dem_options)
 
         del slope_raster
+        finalize_raster_output(output_raster)
     else:
         pass
 
@@ -536,30 +543,30 @@ def extract_month_from_GrowSeason_data(GS_data_dir, skip_processing=False):
     if not skip_processing:
         print('Processing growing season data...')
 
-        # collecting GEE exported data files and making new directories for processing
+        # collecting GEE exported data files
         GS_data_files = glob(os.path.join(GS_data_dir, 'ee_exports', '*.tif'))
-        interim_dir = os.path.join(GS_data_dir, 'interim')
-        makedirs([interim_dir])
 
         # looping through each dataset, extracting start and end of the growing season months, saving as an array
         for data in GS_data_files:
             raster_name = os.path.basename(data)
             year = int(raster_name.split('_')[1].split('.')[0])
 
-            # clipping and resampling the growing season data with the Arizona reference raster
-            interim_raster = clip_resample_reproject_raster(input_raster=data,
-                                                            input_shape=AZ_shape,
-                                                            raster_name=raster_name,
-                                                            output_raster_dir=interim_dir,
-                                                            clip=False, resample=False, clip_and_resample=True,
-                                                            targetaligned=True, resample_algorithm='near',
-                                                            use_ref_width_height=False, ref_raster=None,
-                                                            crs='EPSG:26912',
-                                                            resolution=model_res)
+            # clipping and resampling the growing season data with the Arizona reference raster (kept in memory)
+            interim_ds = clip_resample_reproject_raster(input_raster=data,
+                                                        input_shape=AZ_shape,
+                                                        raster_name=raster_name,
+                                                        output_raster_dir=None,
+                                                        clip=False, resample=False, clip_and_resample=True,
+                                                        targetaligned=True, resample_algorithm='near',
+                                                        use_ref_width_height=False, ref_raster=None,
+                                                        crs='EPSG:26912',
+                                                        resolution=model_res, multithread=True)
 
             # reading the start and end DoY of the growing season
-            startDOY_arr, ras_file = read_raster_arr_object(interim_raster, band=1)
-            endDOY_arr = read_raster_arr_object(interim_raster, band=2, get_file=False)
+            startDOY_arr = read_gdal_dataset_arr(interim_ds, band=1)
+            endDOY_arr = read_gdal_dataset_arr(interim_ds, band=2)
+            interim_crs, interim_transform = interim_ds.GetProjection(), Affine.from_gdal(*interim_ds.GetGeoTransform())
+            del interim_ds
 
             # vectorizing the doy_to_month() function to apply on a numpy array
             vectorized_doy_to_date = np.vectorize(doy_to_month)
@@ -568,8 +575,9 @@ def extract_month_from_GrowSeason_data(GS_data_dir, skip_processing=False):
             start_months = vectorized_doy_to_date(year, startDOY_arr)
             end_months = vectorized_doy_to_date(year, endDOY_arr)
 
-            # stacking the arrays together (single tif with 2 bands)
-            GS_month_arr = np.stack((start_months, end_months), axis=0)
+            # stacking the arrays together (single tif with 2 bands). months are stored as uint8
+            month_dtype, month_nodata = get_compact_dtype('GrowSeason_months')
+            GS_month_arr = to_compact_arr(np.stack((start_months, end_months), axis=0), month_dtype, month_nodata)
 
             # saving the array
             output_raster = os.path.join(GS_data_dir, raster_name)
@@ -579,14 +587,17 @@ def extract_month_from_GrowSeason_data(GS_data_dir, skip_processing=False):
                     driver='GTiff',
                     height=GS_month_arr.shape[1],
                     width=GS_month_arr.shape[2],
-                    dtype=np.float32,
+                    dtype=month_dtype,
                     count=GS_month_arr.shape[0],
-                    crs=ras_file.crs,
-                    transform=ras_file.transform,
-                    nodata=-9999
+                    crs=interim_crs,
+                    transform=interim_transform,
+                    nodata=month_nodata,
+                    **get_raster_creation_options(month_dtype)
             ) as dst:
                 dst.write(GS_month_arr)
 
+            finalize_raster_output(output_raster)
+
 
 def dynamic_gs_sum_ET(year_list, growing_season_dir, monthly_input_dir,
                       gs_output_dir, sum_keyword, skip_processing=False):
@@ -627,7 +638,7 @@ def dynamic_gs_sum_ET(year_list, growing_season_dir, monthly_input_dir,
             arrs_stck = np.stack([read_raster_arr_object(i, get_file=False) for i in sorted_datasets], axis=0)
 
             # gathering, reading, and stacking growing season array
-            gs_data = glob(os.path.join(growing_season_dir, f'*{year}*.tif'))[0]
+            gs_data = find_raster(growing_season_dir, year=year)
             start_gs_arr, ras_file = read_raster_arr_object(gs_data, band=1, get_file=True)  # band 1
             end_gs_arr = read_raster_arr_object(gs_data, band=2, get_file=False)  # band 2
 
@@ -653,10 +664,13 @@ def dynamic_gs_sum_ET(year_list, growing_season_dir, monthly_input_dir,
                     count=1,
                     crs=ras_file.crs,
                     transform=ras_file.transform,
-                    nodata=-9999
+                    nodata=-9999,
+                    **get_raster_creation_options(np.float32)
             ) as dst:
                 dst.write(summed_arr, 1)
 
+            finalize_raster_output(output_path)
+
 
 def dynamic_gs_sum_peff_with_3m_SM_storage(year_list, growing_season_dir, monthly_input_dir,
                                            gs_output_dir, skip_processing=False):
@@ -707,7 +721,7 @@ def dynamic_gs_sum_peff_with_3m_SM_storage(year_list, growing_season_dir, monthl
                                          axis=0)
 
             # gathering, reading, and stacking growing season array
-            gs_data = glob(os.path.join(growing_season_dir, f'*{year}*.tif'))[0]
+            gs_data = find_raster(growing_season_dir, year=year)
             start_gs_arr, ras_file = read_raster_arr_object(gs_data, band=1, get_file=True)  # band 1
             end_gs_arr = read_raster_arr_object(gs_data, band=2, get_file=False)  # band 2
 
@@ -762,10 +776,13 @@ def dynamic_gs_sum_peff_with_3m_SM_storage(year_list, growing_season_dir, monthl
                     count=1,
                     crs=ras_file.crs,
                     transform=ras_file.transform,
-                    nodata=-9999
+                    nodata=-9999,
+                    **get_raster_creation_options(np.float32)
             ) as dst:
                 dst.write(summed_total_arr, 1)
 
+            finalize_raster_output(output_path)
+
 
 def accumulate_monthly_datasets_to_water_year(skip_processing=False):
     """
@@ -822,25 +839,19 @@ def accumulate_monthly_datasets_to_water_year(skip_processing=False):
                 data_name_extraction = os.path.basename(total_data_list[0]).split('_')[:-2]
                 data_name = '_'.join(data_name_extraction) + f'_{yr}' + '.tif'
 
-                # sum() or mean() accumulation
+                # sum() or mean() accumulation in a single pass over the monthly datasets. nan (nodata) values are
+                # skipped for mean, count and std, so the mean is based on the valid (not nan) month count of each
+                # pixel. nan is propagated to the sum, so a pixel missing any month is nodata (not a partial sum)
                 if var in ['GRIDMET_Precip', 'TERRACLIMATE_SR']:  # we perform both mean and sum
-                    sum_rasters(raster_dir=None, raster_list=total_data_list,
-                                output_raster=os.path.join(output_dir, 'sum', data_name),
-                                ref_raster=total_data_list[0], nodata=no_data_value)
-
-                    mean_rasters(raster_dir=None, raster_list=total_data_list,
-                                 output_raster=os.path.join(output_dir, 'mean', data_name),
-                                 ref_raster=total_data_list[0], nodata=no_data_value)
-
+                    # also saving the valid month count and standard deviation
+                    output_raster_dict = {stat: os.path.join(output_dir, stat, data_name)
+                                          for stat in ['sum', 'mean', 'count', 'std']}
                 else:
-                    if accum_by == 'sum':
-                        sum_rasters(raster_dir=None, raster_list=total_data_list,
-                                    output_raster=os.path.join(output_dir, data_name),
-                                    ref_raster=total_data_list[0], nodata=no_data_value)
-                    elif accum_by == 'mean':
-                        mean_rasters(raster_dir=None, raster_list=total_data_list,
-                                     output_raster=os.path.join(output_dir, data_name),
-                                     ref_raster=total_data_list[0], nodata=no_data_value)
+                    output_raster_dict = {accum_by: os.path.join(output_dir, data_name)}
+
+                multi_stat_rasters(input_rasters=total_data_list, output_raster_dict=output_raster_dict,
+                                   ref_raster=total_data_list[0], nodata=no_data_value, nan_policy='skip',
+                                   propagate_stats=('sum',))
     else:
         pass
 
@@ -866,8 +877,8 @@ def estimate_precip_intensity_water_yr(years_list, input_dir_precip, input_dir_r
             print(f'estimating water year precipitation intensity for year {year}...')
 
             # loading and reading datasets
-            precip_data = glob(os.path.join(input_dir_precip, f'*{year}*.tif'))[0]
-            rainy_data = glob(os.path.join(input_dir_rainy_day, f'*{year}*.tif'))[0]
+            precip_data = find_raster(input_dir_precip, year=year)
+            rainy_data = find_raster(input_dir_rainy_day, year=year)
 
             precip_arr, raster_file = read_raster_arr_object(precip_data)
             rainy_arr = read_raster_arr_object(rainy_data, get_file=False)
@@ -905,8 +916,8 @@ def estimate_PET_by_P_water_yr(years_list, input_dir_PET, input_dir_precip, outp
             print(f'estimating water year PET/P for year {year}...')
 
             # loading and reading datasets
-            pet_data = glob(os.path.join(input_dir_PET, f'*{year}*.tif'))[0]
-            precip_data = glob(os.path.join(input_dir_precip, f'*{year}*.tif'))[0]
+            pet_data = find_raster(input_dir_PET, year=year)
+            precip_data = find_raster(input_dir_precip, year=year)
 
             pet_arr = read_raster_arr_object(pet_data, get_file=False)
             precip_arr, raster_file = read_raster_arr_object(precip_data)
@@ -3,19 +3,19 @@ import sys
 import numpy as np
 import pandas as pd
 import seaborn as sns
-from glob import glob
 from osgeo import gdal
 import geopandas as gpd
 import matplotlib.pyplot as plt
 from rasterstats import zonal_stats
-from datetime import datetime, timedelta
 
 from os.path import dirname, abspath
 sys.path.insert(0, dirname(dirname(dirname(abspath(__file__)))))
 
 from Codes.utils.system_ops import makedirs
+from Codes.utils.raster_catalog import find_raster
 from Codes.utils.raster_ops import read_raster_arr_object, write_array_to_raster, clip_resample_reproject_raster,\
-    shapefile_to_raster
+    shapefile_to_raster, get_ref_grid
+from Codes.utils.datacube_ops import shift_month
 
 no_data_value = -9999
 model_res = 2000  # in m
@@ -66,18 +66,16 @@ def create_monthly_dataframes_for_eff_precip_prediction(years_list, month_range,
                         if var in datasets_to_include:
 
                             if var == 'GRIDMET_Precip':  # for including monthly and lagged monthly GRIDMET_precip in the dataframe
-                                current_precip_data = glob(os.path.join(monthly_data_path_dict[var], f'*{year}_{month}.tif*'))[0]
+                                current_precip_data = find_raster(monthly_data_path_dict[var], year=year, month=month)
 
-                                current_month_date = datetime(year, month, 1)
+                                # Collect previous (calendar) months' precip data
+                                prev_year, prev_month = shift_month(year, month, -1)
+                                prev_2_year, prev_2_month = shift_month(year, month, -2)
 
-                                # Collect previous month's precip data
-                                prev_month_date = current_month_date - timedelta(30)
-                                prev_2_month_date = current_month_date - timedelta(60)
-
-                                prev_month_precip_data = glob(os.path.join(monthly_data_path_dict[var],
-                                                                           f'*{prev_month_date.year}_{prev_month_date.month}.tif*'))[0]
-                                prev_2_month_precip_data = glob(os.path.join(monthly_data_path_dict[var],
-                                                                             f'*{prev_2_month_date.year}_{prev_2_month_date.month}.tif*'))[0]
+                                prev_month_precip_data = find_raster(monthly_data_path_dict[var],
+                                                                     year=prev_year, month=prev_month)
+                                prev_2_month_precip_data = find_raster(monthly_data_path_dict[var],
+                                                                       year=prev_2_year, month=prev_2_month)
 
                                 # reading datasets
                                 current_precip_arr = read_raster_arr_object(current_precip_data, get_file=False).flatten()
@@ -95,7 +93,7 @@ def create_monthly_dataframes_for_eff_precip_prediction(years_list, month_range,
                                 variable_dict['GRIDMET_Precip_2_lag'] = list(prev_2_month_precip_arr)
 
                             else:
-                                monthly_data = glob(os.path.join(monthly_data_path_dict[var], f'*{year}_{month}.tif*'))[0]
+                                monthly_data = find_raster(monthly_data_path_dict[var], year=year, month=month)
                                 data_arr = read_raster_arr_object(monthly_data, get_file=False).flatten()
 
                                 data_arr[np.isnan(data_arr)] = 0  # setting nan-position values with 0
@@ -106,7 +104,7 @@ def create_monthly_dataframes_for_eff_precip_prediction(years_list, month_range,
                 if yearly_data_path_dict is not None:
                     for var in yearly_data_path_dict.keys():
                         if var in datasets_to_include:
-                            yearly_data = glob(os.path.join(yearly_data_path_dict[var], f'*{year}*.tif'))[0]
+                            yearly_data = find_raster(yearly_data_path_dict[var], year=year)
                             data_arr = read_raster_arr_object(yearly_data, get_file=False).flatten()
 
                             data_arr[np.isnan(data_arr)] = 0  # setting nan-position values with 0
@@ -116,7 +114,7 @@ def create_monthly_dataframes_for_eff_precip_prediction(years_list, month_range,
                 if static_data_path_dict is not None:
                     for var in static_data_path_dict.keys():
                         if var in datasets_to_include:
-                            static_data = glob(os.path.join(static_data_path_dict[var], '*.tif'))[0]
+                            static_data = find_raster(static_data_path_dict[var])
                             data_arr = read_raster_arr_object(static_data, get_file=False).flatten()
 
                             data_arr[np.isnan(data_arr)] = 0  # setting nan-position values with 0
@@ -170,21 +168,21 @@ def scale_monthy_peff_with_wateryr_peff_model(years_list, unscaled_peff_monthly_
 
                     # selecting the water year of total peff data based on month
                     if mn in range(10, 12 + 1):
-                        peff_unbound_wy = glob(os.path.join(unscaled_peff_water_yr_dir, f'*{yr + 1}*.tif'))[0]
+                        peff_unbound_wy = find_raster(unscaled_peff_water_yr_dir, year=yr + 1)
                         peff_unbound_wy_arr = read_raster_arr_object(peff_unbound_wy, get_file=False)
 
-                        peff_bound_wy = glob(os.path.join(scaled_peff_water_yr_dir, f'*{yr + 1}*.tif'))[0]
+                        peff_bound_wy = find_raster(scaled_peff_water_yr_dir, year=yr + 1)
                         peff_bound_wy_arr = read_raster_arr_object(peff_bound_wy, get_file=False)
 
                     elif mn in range(1, 9 + 1):
-                        peff_unbound_wy = glob(os.path.join(unscaled_peff_water_yr_dir, f'*{yr}*.tif'))[0]
+                        peff_unbound_wy = find_raster(unscaled_peff_water_yr_dir, year=yr)
                         peff_unbound_wy_arr = read_raster_arr_object(peff_unbound_wy, get_file=False)
 
-                        peff_bound_wy = glob(os.path.join(scaled_peff_water_yr_dir, f'*{yr}*.tif'))[0]
+                        peff_bound_wy = find_raster(scaled_peff_water_yr_dir, year=yr)
                         peff_bound_wy_arr = read_raster_arr_object(peff_bound_wy, get_file=False)
 
                     # selecting the monthly peff data
-                    unscaled_peff_monthly = glob(os.path.join(unscaled_peff_monthly_dir, f'*{yr}_{mn}*.tif'))[0]
+                    unscaled_peff_monthly = find_raster(unscaled_peff_monthly_dir, year=yr, month=mn)
                     unscaled_peff_monthly_arr, raster_file = read_raster_arr_object(unscaled_peff_monthly)
 
                     # scaling monthly peff with bounded peff total
@@ -216,7 +214,7 @@ def clip_netGW_Irr_frac_for_basin(years, basin_shp, netGW_input_dir, basin_netGW
         print(f'Clipping growing season netGW for {year}...')
 
         # netGW
-        netGW_raster = glob(os.path.join(netGW_input_dir, f'*{year}*.tif'))[0]
+        netGW_raster = find_raster(netGW_input_dir, year=year)
 
         clip_resample_reproject_raster(input_raster=netGW_raster, input_shape=basin_shp,
                                        output_raster_dir=basin_netGW_output_dir,
@@ -254,7 +252,7 @@ def compile_pixelwise_basin_df_for_netGW_pumping(years, basin_netGW_dir, output_
 
     # lopping through each year and storing data in a list
     for year in years:
-        netGW_data = glob(os.path.join(basin_netGW_dir, f'*{year}*.tif'))[0]
+        netGW_data = find_raster(basin_netGW_dir, year=year)
         netGW_arr = read_raster_arr_object(netGW_data, get_file=False).flatten()
 
         year_list = [year] * len(netGW_arr)
@@ -263,8 +261,8 @@ def compile_pixelwise_basin_df_for_netGW_pumping(years, basin_netGW_dir, output_
         extract_dict['netGW_mm'].extend(list(netGW_arr))
 
         if basin_pumping_AF_dir and basin_pumping_mm_dir:     # reading pumping data if directories are provided
-            pumping_mm_data = glob(os.path.join(basin_pumping_mm_dir, f'*{year}*.tif'))[0]
-            pumping_AF_data = glob(os.path.join(basin_pumping_AF_dir, f'*{year}*.tif'))[0]
+            pumping_mm_data = find_raster(basin_pumping_mm_dir, year=year)
+            pumping_AF_data = find_raster(basin_pumping_AF_dir, year=year)
 
             pump_mm_arr = read_raster_arr_object(pumping_mm_data, get_file=False).flatten()
             pump_AF_arr = read_raster_arr_object(pumping_AF_data, get_file=False).flatten()
@@ -481,7 +479,7 @@ def estimate_sw_mm_HUC12(years_list, HUC12_input_shapefile, irrigated_CropET_wit
             print(f'Extracting total irrigated cropET and number of pixels stats in HUC12s for {year}...')
 
             # irrigated cropET growing season with canal coverage for that year
-            irrig_cropET_with_canal = glob(os.path.join(irrigated_CropET_with_canal_coverage_dir, f'*{year}*.tif'))[0]
+            irrig_cropET_with_canal = find_raster(irrigated_CropET_with_canal_coverage_dir, year=year)
 
             for idx, row in HUC12_gdf.iterrows():  # looping through each HUC12 watershed and collecting data
                 huc12_geom = row['geometry']
@@ -552,13 +550,14 @@ def distribute_SW_consmp_use_to_pixels(years_list, HUC12_shapefile, HUC12_Irr_ef
         huc12_gdf.to_file(HUC12_processed)
 
         # reference raster
-        ref_arr, ref_file = read_raster_arr_object(ref_raster)
+        ref_file = get_ref_grid(ref_raster)
+        ref_arr = ref_file.arr
 
         for year in years_list:
             print(f'distributing surface water irrigation to pixels for {year}...')
 
             # getting growing season irrigated cropET raster
-            irrig_cropET_Huc12_tot = glob(os.path.join(irrigated_CropET_growing_season, f'*{year}*.tif'))[0]
+            irrig_cropET_Huc12_tot = find_raster(irrigated_CropET_growing_season, year=year)
 
             # converting total irrigated cropET of HUC12 to raster (HUC12 sum)
             total_irrig_cropET_ras = f'total_irrig_cropET_{year}.tif'
@@ -1,5 +1,4 @@
 import os
-import re
 import sys
 import shutil
 import datetime
@@ -7,6 +6,7 @@ import numpy as np
 from glob import glob
 from osgeo import gdal
 import rasterio as rio
+from rasterio.transform import Affine
 import geopandas as gpd
 
 from os.path import dirname, abspath
@@ -14,8 +14,14 @@ from os.path import dirname, abspath
 sys.path.insert(0, dirname(dirname(dirname(abspath(__file__)))))
 
 from Codes.utils.system_ops import makedirs
+from Codes.utils.raster_catalog import find_raster, list_rasters, list_water_year_rasters
+from Codes.utils.datacube_ops import is_datacube, get_datacube_variable, get_monthly_raster_source, \
+    list_water_year_sources
 from Codes.utils.raster_ops import read_raster_arr_object, write_array_to_raster, mosaic_rasters_list, \
-    clip_resample_reproject_raster, sum_rasters, mean_rasters, make_lat_lon_array_from_raster, shapefile_to_raster
+    clip_resample_reproject_raster, sum_rasters, multi_stat_rasters, make_lat_lon_array_from_raster, \
+    shapefile_to_raster, write_raster_by_blocks, get_ref_grid, get_raster_creation_options, \
+    get_gdal_creation_options, finalize_raster_output, read_gdal_dataset_arr, get_compact_dtype, to_compact_arr, \
+    read_compact_raster_arr, write_compact_raster
 from Codes.effective_precip.m00_eff_precip_utils import estimate_peff_precip_water_year_fraction
 
 no_data_value = -9999
@@ -129,7 +135,7 @@ def merge_GEE_data_patches_IrrMapper_LANID_extents(year_list, input_dir_irrmappe
                         mosaic_rasters_list(input_raster_list=total_raster_list, output_dir=merged_output_dir,
                                             raster_name=merged_raster_name, ref_raster=ref_raster, dtype=None,
                                             resampling_method='nearest', mosaicing_method='first',
-                                            resolution=model_res, nodata=no_data_value)
+                                            resolution=model_res, nodata=no_data_value, use_vrt=True)
 
                         print(f'{merge_keyword} data merged for year {year}, month {month}')
 
@@ -150,7 +156,7 @@ def merge_GEE_data_patches_IrrMapper_LANID_extents(year_list, input_dir_irrmappe
                     mosaic_rasters_list(input_raster_list=total_raster_list, output_dir=merged_output_dir,
                                         raster_name=merged_raster_name, ref_raster=ref_raster, dtype=None,
                                         resampling_method='nearest', mosaicing_method='first',
-                                        resolution=model_res, nodata=no_data_value)
+                                        resolution=model_res, nodata=no_data_value, use_vrt=True)
 
                     print(f'{merge_keyword} data merged for year {year}')
     else:
@@ -219,12 +225,10 @@ def classify_irrigated_rainfed_cropland(rainfed_fraction_dir, irrigated_fraction
             output_irrigated_cropland_raster = os.path.join(irrigated_cropland_output_dir,
                                                             f'Irrigated_cropland_{year}.tif')
 
-            write_array_to_raster(raster_arr=rainfed_cropland, raster_file=rain_file, transform=rain_file.transform,
-                                  output_path=output_rainfed_cropland_raster,
-                                  dtype=np.int32)  # linux can't save data properly if dtype isn't np.int32 in this case
-            write_array_to_raster(raster_arr=irrigated_cropland, raster_file=irrig_file, transform=irrig_file.transform,
-                                  output_path=output_irrigated_cropland_raster,
-                                  dtype=np.int32)  # linux can't save data properly if dtype isn't np.int32 in this case
+            write_compact_raster(raster_arr=rainfed_cropland, raster_file=rain_file, transform=rain_file.transform,
+                                 output_path=output_rainfed_cropland_raster)  # uint8, 255 as nodata
+            write_compact_raster(raster_arr=irrigated_cropland, raster_file=irrig_file, transform=irrig_file.transform,
+                                 output_path=output_irrigated_cropland_raster)  # uint8, 255 as nodata
 
         ############################
         # irrigated fraction data is also available for 2000-2007. Classifying those data to
@@ -244,9 +248,8 @@ def classify_irrigated_rainfed_cropland(rainfed_fraction_dir, irrigated_fraction
             # saving classified data
             output_irrigated_cropland_raster = os.path.join(irrigated_cropland_output_dir,
                                                             f'Irrigated_cropland_{year}.tif')
-            write_array_to_raster(raster_arr=irrigated_cropland, raster_file=irrig_file, transform=irrig_file.transform,
-                                  output_path=output_irrigated_cropland_raster,
-                                  dtype=np.int32)  # linux can't save data properly if dtype isn't np.int32 in this case
+            write_compact_raster(raster_arr=irrigated_cropland, raster_file=irrig_file, transform=irrig_file.transform,
+                                 output_path=output_irrigated_cropland_raster)  # uint8, 255 as nodata
     else:
         pass
 
@@ -290,16 +293,16 @@ def filter_rainfed_irrigated_cropET_with_rainfed_irrigated_cropland(rainfed_crop
             print(f'Filtering irrigated cropET data for year {year}...')
 
             # pure irrigated cropland filtered by using irrigated fraction threshold (irrig frac > 0.02)
-            irrigated_cropland_data = glob(os.path.join(irrigated_cropland_dir, f'*{year}*.tif'))[0]
-            irrigated_cropland_arr = read_raster_arr_object(irrigated_cropland_data, get_file=False)
+            irrigated_cropland_data = find_raster(irrigated_cropland_dir, year=year)
+            irrigated_cropland_arr = read_compact_raster_arr(irrigated_cropland_data)
 
             for month in months_to_filter_cropET:
                 # # applying irrigated cropland filter to get cropET at purely irrigated pixels
-                irrigated_cropET_data = glob(os.path.join(irrigated_cropET_input_dir, f'*{year}_{month}*.tif'))[0]
+                irrigated_cropET_data = find_raster(irrigated_cropET_input_dir, year=year, month=month)
                 irrigated_cropET_arr, irrigated_cropET_file = read_raster_arr_object(irrigated_cropET_data)
 
                 # applying the filter
-                irrigated_cropET_arr[np.isnan(irrigated_cropland_arr)] = -9999
+                irrigated_cropET_arr[irrigated_cropland_arr != 1] = -9999
 
                 filtered_output_raster = os.path.join(irrigated_cropET_output_dir,
                                                       f'Irrigated_cropET_{year}_{month}.tif')
@@ -311,16 +314,16 @@ def filter_rainfed_irrigated_cropET_with_rainfed_irrigated_cropland(rainfed_crop
 
             # pure rainfed cropland filtered using rainfed fraction threshold
             # (rainfed frac > 0.10). Tree cover is less than 6%
-            rainfed_cropland_data = glob(os.path.join(rainfed_cropland_dir, f'*{year}*.tif'))[0]
-            rainfed_cropland_arr = read_raster_arr_object(rainfed_cropland_data, get_file=False)
+            rainfed_cropland_data = find_raster(rainfed_cropland_dir, year=year)
+            rainfed_cropland_arr = read_compact_raster_arr(rainfed_cropland_data)
 
             for month in months_to_filter_cropET:
                 # # applying rainfed cropland filter to get cropET at purely rainfed pixels
-                rainfed_cropET_data = glob(os.path.join(rainfed_cropET_input_dir, f'*{year}_{month}*.tif'))[0]
+                rainfed_cropET_data = find_raster(rainfed_cropET_input_dir, year=year, month=month)
                 rainfed_cropET_arr, rainfed_cropET_file = read_raster_arr_object(rainfed_cropET_data)
 
                 # applying the filter
-                rainfed_cropET_arr[np.isnan(rainfed_cropland_arr)] = -9999
+                rainfed_cropET_arr[rainfed_cropland_arr != 1] = -9999
 
                 filtered_output_raster = os.path.join(rainfed_cropET_output_dir, f'Rainfed_cropET_{year}_{month}.tif')
                 write_array_to_raster(raster_arr=rainfed_cropET_arr, raster_file=rainfed_cropET_file,
@@ -349,7 +352,8 @@ def convert_prism_data_to_tif(input_dir, output_dir, keyword='prism_precip'):
         output_name = keyword + '_' + year_month + '.tif'
         output_file = os.path.join(output_dir, output_name)
         gdal.Translate(destName=output_file, srcDS=data, format='GTiff', outputType=gdal.GDT_Float32,
-                       outputSRS='EPSG:4269')
+                       outputSRS='EPSG:4269', creationOptions=get_gdal_creation_options(gdal.GDT_Float32))
+        finalize_raster_output(output_file)
 
 
 def process_prism_data(prism_bil_dir, prism_tif_dir, output_dir_prism_monthly, output_dir_prism_yearly=None,
@@ -380,12 +384,10 @@ def process_prism_data(prism_bil_dir, prism_tif_dir, output_dir_prism_monthly, o
     """
 
     if not skip_processing:
-        interim_dir_for_monthly_data = os.path.join(output_dir_prism_monthly, 'interim_dir_for_monthly_data')
-
         if output_dir_prism_yearly is not None:
-            makedirs([output_dir_prism_monthly, output_dir_prism_yearly, interim_dir_for_monthly_data])
+            makedirs([output_dir_prism_monthly, output_dir_prism_yearly])
         else:
-            makedirs([output_dir_prism_monthly, interim_dir_for_monthly_data])
+            makedirs([output_dir_prism_monthly])
 
         convert_prism_data_to_tif(input_dir=prism_bil_dir, output_dir=prism_tif_dir, keyword=keyword)
 
@@ -410,24 +412,18 @@ def process_prism_data(prism_bil_dir, prism_tif_dir, output_dir_prism_monthly, o
 
             # the prism datasets are at 4km native resolution and directly clipping and resampling them from 4km
             # resolution creates misalignment of pixels from reference raster. So, first we are resampling CONUS
-            # scale original datasets to 2km resolutions and then clipping them at reference raster (Western US) extent
-            interim_monthly_raster = clip_resample_reproject_raster(input_raster=data,
-                                                                    input_shape=west_US_shape,
-                                                                    raster_name=monthly_raster_name, keyword=' ',
-                                                                    output_raster_dir=interim_dir_for_monthly_data,
-                                                                    clip=False, resample=True, clip_and_resample=False,
-                                                                    targetaligned=True, resample_algorithm='near',
-                                                                    use_ref_width_height=False, ref_raster=None,
-                                                                    resolution=resolution)
-
-            clip_resample_reproject_raster(input_raster=interim_monthly_raster,
+            # scale original datasets to 2km resolutions and then clipping them at reference raster (Western US) extent.
+            # The resampled CONUS scale interim raster is kept in memory.
+            clip_resample_reproject_raster(input_raster=data,
                                            input_shape=west_US_shape,
                                            raster_name=monthly_raster_name, keyword=' ',
                                            output_raster_dir=output_dir_prism_monthly,
-                                           clip=False, resample=False, clip_and_resample=True,
                                            targetaligned=True, resample_algorithm='near',
                                            use_ref_width_height=False, ref_raster=ref_raster,
-                                           resolution=resolution)
+                                           resolution=resolution,
+                                           warp_steps=[{'resample': True, 'ref_raster': None},
+                                                       {'clip_and_resample': True}],
+                                           multithread=True)
         #########
         # # Code-block for summing monthly precipitation data for years_list
         #########
@@ -435,10 +431,9 @@ def process_prism_data(prism_bil_dir, prism_tif_dir, output_dir_prism_monthly, o
             print(f'Processing {keyword} data for {year}...')
 
             if 'precip' in keyword:
-                prism_datasets = glob(
-                    os.path.join(output_dir_prism_monthly, f'*{year}*.tif'))  # monthly prism datasets for each year
+                prism_datasets = list_rasters(output_dir_prism_monthly, year=year)  # monthly prism datasets for each year
 
-                # Summing raster for each year
+                # Summing raster for each year (streaming sum, one monthly dataset in memory at a time)
                 summed_output_for_year = os.path.join(output_dir_prism_yearly, f'prism_precip_{year}.tif')
                 sum_rasters(raster_list=prism_datasets, raster_dir=None, output_raster=summed_output_for_year,
                             ref_raster=prism_datasets[0])
@@ -576,9 +571,7 @@ def sum_cropET_water_yr(years_list, input_cropET_monthly_dir, output_dir_water_y
             print(f'summing monthly cropET for water year {yr}...')
 
             # summing rainfed/irrigated crop ET for water year (previous year's October to current year's september)
-            et_data_prev_years = glob(os.path.join(input_cropET_monthly_dir, f'*{yr - 1}_1[0-2].*tif'))
-            et_data_current_years = glob(os.path.join(input_cropET_monthly_dir, f'*{yr}_[1-9].*tif'))
-            et_water_yr_list = et_data_prev_years + et_data_current_years
+            et_water_yr_list = list_water_year_rasters(input_cropET_monthly_dir, year=yr)
             print(et_water_yr_list)
             sum_rasters(raster_list=et_water_yr_list, raster_dir=None,
                         output_raster=os.path.join(output_dir_water_yr, f'{save_keyword}_{yr}.tif'),
@@ -600,7 +593,8 @@ def create_slope_raster(input_raster, output_dir, raster_name, skip_processing=F
     """
     if not skip_processing:
         dem_options = gdal.DEMProcessingOptions(format="GTiff", computeEdges=True, alg='ZevenbergenThorne',
-                                                slopeFormat='percent', scale=100000)
+                                                slopeFormat='percent', scale=100000,
+                                                creationOptions=get_gdal_creation_options(gdal.GDT_Float32))
 
         makedirs([output_dir])
         output_raster = os.path.join(output_dir, raster_name)
@@ -609,6 +603,7 @@ def create_slope_raster(input_raster, output_dir, raster_name, skip_processing=F
                                           options=dem_options)
 
         del slope_raster
+        finalize_raster_output(output_raster)
     else:
         pass
 
@@ -664,11 +659,11 @@ def develop_excess_ET_filter(years_list, water_yr_precip_dir, water_yr_rainfed_E
             print(f'processing Excess_ET_filter data for year {yr}')
 
             # getting water year precip data
-            precip_data = glob(os.path.join(water_yr_precip_dir, f'*{yr}*.tif'))[0]
+            precip_data = find_raster(water_yr_precip_dir, year=yr)
             precip_arr = read_raster_arr_object(precip_data, get_file=False)
 
             # getting growing season et data
-            et_data = glob(os.path.join(water_yr_rainfed_ET_dir, f'*{yr}*.tif'))[0]
+            et_data = find_raster(water_yr_rainfed_ET_dir, year=yr)
             et_arr, file = read_raster_arr_object(et_data)
 
             # setting value 1 to pixels where water year's total precip is greater than this year's
@@ -677,8 +672,8 @@ def develop_excess_ET_filter(years_list, water_yr_precip_dir, water_yr_rainfed_E
             new_arr = np.where((precip_arr < et_arr) | np.isnan(et_arr), -9999, 1)
 
             output_raster = os.path.join(output_dir, f'Excess_ET_filter_{yr}.tif')
-            write_array_to_raster(raster_arr=new_arr, raster_file=file, transform=file.transform,
-                                  output_path=output_raster, dtype=np.float32)
+            write_compact_raster(raster_arr=new_arr, raster_file=file, transform=file.transform,
+                                 output_path=output_raster)  # uint8, 255 as nodata
     else:
         pass
 
@@ -713,29 +708,29 @@ def extract_month_from_GrowSeason_data(GS_data_dir, skip_processing=False):
     if not skip_processing:
         print('Processing growing season data...')
 
-        # collecting GEE exported data files and making new directories for processing
+        # collecting GEE exported data files
         GS_data_files = glob(os.path.join(GS_data_dir, 'ee_exports', '*.tif'))
-        interim_dir = os.path.join(GS_data_dir, 'interim')
-        makedirs([interim_dir])
 
         # looping through each dataset, extracting start and end of the growing season months, saving as an array
         for data in GS_data_files:
             raster_name = os.path.basename(data)
             year = int(raster_name.split('_')[1].split('.')[0])
 
-            # clipping and resampling the growing season data with the western US reference raster
-            interim_raster = clip_resample_reproject_raster(input_raster=data,
-                                                            input_shape=WestUS_shape,
-                                                            raster_name=raster_name,
-                                                            output_raster_dir=interim_dir,
-                                                            clip=False, resample=False, clip_and_resample=True,
-                                                            targetaligned=True, resample_algorithm='near',
-                                                            use_ref_width_height=False, ref_raster=None,
-                                                            resolution=model_res)
+            # clipping and resampling the growing season data with the western US reference raster (kept in memory)
+            interim_ds = clip_resample_reproject_raster(input_raster=data,
+                                                        input_shape=WestUS_shape,
+                                                        raster_name=raster_name,
+                                                        output_raster_dir=None,
+                                                        clip=False, resample=False, clip_and_resample=True,
+                                                        targetaligned=True, resample_algorithm='near',
+                                                        use_ref_width_height=False, ref_raster=None,
+                                                        resolution=model_res, multithread=True)
 
             # reading the start and end DoY of the growing season
-            startDOY_arr, ras_file = read_raster_arr_object(interim_raster, band=1)
-            endDOY_arr = read_raster_arr_object(interim_raster, band=2, get_file=False)
+            startDOY_arr = read_gdal_dataset_arr(interim_ds, band=1)
+            endDOY_arr = read_gdal_dataset_arr(interim_ds, band=2)
+            interim_crs, interim_transform = interim_ds.GetProjection(), Affine.from_gdal(*interim_ds.GetGeoTransform())
+            del interim_ds
 
             # vectorizing the doy_to_month() function to apply on a numpy array
             vectorized_doy_to_date = np.vectorize(doy_to_month)
@@ -744,8 +739,9 @@ def extract_month_from_GrowSeason_data(GS_data_dir, skip_processing=False):
             start_months = vectorized_doy_to_date(year, startDOY_arr)
             end_months = vectorized_doy_to_date(year, endDOY_arr)
 
-            # stacking the arrays together (single tif with 2 bands)
-            GS_month_arr = np.stack((start_months, end_months), axis=0)
+            # stacking the arrays together (single tif with 2 bands). months are stored as uint8
+            month_dtype, month_nodata = get_compact_dtype('GrowSeason_months')
+            GS_month_arr = to_compact_arr(np.stack((start_months, end_months), axis=0), month_dtype, month_nodata)
 
             # saving the array
             output_raster = os.path.join(GS_data_dir, raster_name)
@@ -755,14 +751,17 @@ def extract_month_from_GrowSeason_data(GS_data_dir, skip_processing=False):
                     driver='GTiff',
                     height=GS_month_arr.shape[1],
                     width=GS_month_arr.shape[2],
-                    dtype=np.float32,
+                    dtype=month_dtype,
                     count=GS_month_arr.shape[0],
-                    crs=ras_file.crs,
-                    transform=ras_file.transform,
-                    nodata=-9999
+                    crs=interim_crs,
+                    transform=interim_transform,
+                    nodata=month_nodata,
+                    **get_raster_creation_options(month_dtype)
             ) as dst:
                 dst.write(GS_month_arr)
 
+            finalize_raster_output(output_raster)
+
 
 def dynamic_gs_sum_ET(year_list, growing_season_dir, monthly_input_dir, gs_output_dir,
                       sum_keyword, skip_processing=False):
@@ -772,7 +771,8 @@ def dynamic_gs_sum_ET(year_list, growing_season_dir, monthly_input_dir, gs_outpu
 
     :param year_list: List of years_list to process the data for.
     :param growing_season_dir: Directory path for growing season datasets.
-    :param monthly_input_dir:  Directory path for monthly effective precipitation/irrigated crop ET datasets.
+    :param monthly_input_dir:  Directory path for monthly effective precipitation/irrigated crop ET datasets. Can also
+                               be a datacube (.zarr/.nc) of the monthly datasets.
     :param gs_output_dir:  Directory path (output) for summed growing season effective precipitation/irrigated crop ET
                            datasets.
     :param sum_keyword: Keyword str to add before the summed raster.
@@ -786,25 +786,10 @@ def dynamic_gs_sum_ET(year_list, growing_season_dir, monthly_input_dir, gs_outpu
 
         makedirs([gs_output_dir])
 
-        # The regex r'_([0-9]{1,2})\.tif' extracts the month (1 or 2 digits; e.g., '_1.tif', '_12.tif')
-        # from the filenames using the first group ([0-9]{1,2}).
-        # The extracted month is then (inside the for loop in the sorting block) converted to an integer with int(group(1))
-        # for proper sorting by month.
-        month_pattern = re.compile(r'_([0-9]{1,2})\.tif')
-
-        for year in year_list:
-            # gathering and sorting the peff datasets by month (from 1 to 12)
-            datasets = glob(os.path.join(monthly_input_dir, f'*{year}*.tif'))
-            sorted_datasets = sorted(datasets, key=lambda x: int(
-                month_pattern.search(x).group(1)))  # First capturing group (the month)
-
-            # peff/cropET monthly array stacked in a single numpy array
-            arrs_stck = np.stack([read_raster_arr_object(i, get_file=False) for i in sorted_datasets], axis=0)
-
-            # gathering, reading, and stacking growing season array
-            gs_data = glob(os.path.join(growing_season_dir, f'*{year}*.tif'))[0]
-            start_gs_arr, ras_file = read_raster_arr_object(gs_data, band=1, get_file=True)  # band 1
-            end_gs_arr = read_raster_arr_object(gs_data, band=2, get_file=False)  # band 2
+        def sum_gs_block(block_arrs):
+            # peff/cropET monthly block arrays stacked in a single numpy array
+            arrs_stck = np.stack(block_arrs[:12], axis=0)
+            start_gs_arr, end_gs_arr = block_arrs[12], block_arrs[13]  # growing season band 1 and band 2
 
             # We create a 1 pixel "kernel", representing months 1 to 12 (shape : 12, 1, 1).
             # Then it is broadcasted across the array and named as the kernel_mask.
@@ -813,24 +798,21 @@ def dynamic_gs_sum_ET(year_list, growing_season_dir, monthly_input_dir, gs_outpu
             kernel_mask = (kernel >= start_gs_arr) & (kernel <= end_gs_arr)
 
             # sum peff/cropET arrays over the valid months using the kernel_mask
-            summed_arr = np.sum(arrs_stck * kernel_mask, axis=0)
+            return np.sum(arrs_stck * kernel_mask, axis=0)
+
+        for year in year_list:
+            # gathering and sorting the peff datasets by month (from 1 to 12)
+            sorted_datasets = [get_monthly_raster_source(monthly_input_dir, year, month) for month in range(1, 13)]
+
+            gs_data = find_raster(growing_season_dir, year=year)
 
-            # saving the summed peff array
+            # summing block by block (monthly datasets + growing season start and end bands) and saving
+            # the summed peff array
             output_name = f'{sum_keyword}_{year}.tif'
             output_path = os.path.join(gs_output_dir, output_name)
-            with rio.open(
-                    output_path,
-                    'w',
-                    driver='GTiff',
-                    height=summed_arr.shape[0],
-                    width=summed_arr.shape[1],
-                    dtype=np.float32,
-                    count=1,
-                    crs=ras_file.crs,
-                    transform=ras_file.transform,
-                    nodata=-9999
-            ) as dst:
-                dst.write(summed_arr, 1)
+            write_raster_by_blocks(input_rasters=sorted_datasets + [(gs_data, 1), (gs_data, 2)],
+                                   output_rasters=output_path, block_function=sum_gs_block,
+                                   dtype=np.float32, nodata=-9999)
 
 
 def dynamic_gs_sum_peff_with_3m_SM_storage(year_list, growing_season_dir, monthly_input_dir,
@@ -841,7 +823,8 @@ def dynamic_gs_sum_peff_with_3m_SM_storage(year_list, growing_season_dir, monthl
 
     :param year_list: List of years_list to process the data for.
     :param growing_season_dir: Directory path for growing season datasets.
-    :param monthly_input_dir:  Directory path for monthly effective precipitation/irrigated crop ET datasets.
+    :param monthly_input_dir:  Directory path for monthly effective precipitation/irrigated crop ET datasets. Can also
+                               be a datacube (.zarr/.nc) of the monthly datasets.
     :param gs_output_dir:  Directory path (output) for summed growing season effective precipitation/irrigated crop ET
                            datasets.
     :param skip_processing: Set to True if want to skip processing this step.
@@ -851,40 +834,12 @@ def dynamic_gs_sum_peff_with_3m_SM_storage(year_list, growing_season_dir, monthl
     if not skip_processing:
         makedirs([gs_output_dir])
 
-        # The regex r'_([0-9]{1,2})\.tif' extracts the month (1 or 2 digits; e.g., '_1.tif', '_12.tif')
-        # from the filenames using the first group ([0-9]{1,2}).
-        # The extracted month is then (inside the for loop in the sorting block) converted to an integer with int(group(1))
-        # for proper sorting by month.
-        month_pattern_current_yr = re.compile(r'_([0-9]{1,2})\.tif')
-        month_pattern_prev_yr = re.compile(r'_([0-9]{1,2})\.tif')
-
-        for year in year_list:
-            print(f'Dynamically summing effective precipitation monthly datasets for growing season {year}...')
-
-            # current year: gathering and sorting the peff datasets by month for current year (from 1 to 12)
-            datasets_current_yr = glob(os.path.join(monthly_input_dir, f'*{year}*.tif'))
-            sorted_datasets_current_yr = sorted(datasets_current_yr, key=lambda x: int(
-                month_pattern_current_yr.search(x).group(1)))  # First capturing group (the month)
-
-            # current year: peff monthly array stacked in a single numpy array
-            arrs_stck_current_yr = np.stack(
-                [read_raster_arr_object(i, get_file=False) for i in sorted_datasets_current_yr], axis=0)
-
-            # previous year: gathering datasets for months 10-12 of the previous year
-            datasets_previous_year = glob(os.path.join(monthly_input_dir, f'*{year - 1}*.tif'))
-            datasets_prev_10_12 = [f for f in datasets_previous_year if
-                                   10 <= int(month_pattern_prev_yr.search(f).group(1)) <= 12]
-            sorted_datasets_prev_yr = sorted(datasets_prev_10_12,
-                                             key=lambda x: int(month_pattern_prev_yr.search(x).group(1)))
-
-            # previous year: peff monthly array stacked in a single numpy array
-            arrs_stck_prev_yr = np.stack([read_raster_arr_object(i, get_file=False) for i in sorted_datasets_prev_yr],
-                                         axis=0)
-
-            # gathering, reading, and stacking growing season array
-            gs_data = glob(os.path.join(growing_season_dir, f'*{year}*.tif'))[0]
-            start_gs_arr, ras_file = read_raster_arr_object(gs_data, band=1, get_file=True)  # band 1
-            end_gs_arr = read_raster_arr_object(gs_data, band=2, get_file=False)  # band 2
+        def sum_gs_block_with_SM_storage(block_arrs):
+            # peff monthly block arrays stacked in a single numpy array (current year months 1-12 and
+            # previous year months 10-12)
+            arrs_stck_current_yr = np.stack(block_arrs[:12], axis=0)
+            arrs_stck_prev_yr = np.stack(block_arrs[12:15], axis=0)
+            start_gs_arr, end_gs_arr = block_arrs[15], block_arrs[16]  # growing season band 1 and band 2
 
             # current year: deduct 3 months from start_gs_arr to consider the effect of  3 months' peff storage
             # then finalize the current year's start season array
@@ -922,24 +877,30 @@ def dynamic_gs_sum_peff_with_3m_SM_storage(year_list, growing_season_dir, monthl
             summed_arr_prev_yr = np.sum(arrs_stck_prev_yr * kernel_mask_prev_year, axis=0)
 
             # ****** Combine the results from the current year and previous year ******
-            summed_total_arr = np.sum([summed_arr_current_yr, summed_arr_prev_yr], axis=0)
+            return np.sum([summed_arr_current_yr, summed_arr_prev_yr], axis=0)
+
+        for year in year_list:
+            print(f'Dynamically summing effective precipitation monthly datasets for growing season {year}...')
+
+            # current year: gathering and sorting the peff datasets by month for current year (from 1 to 12)
+            sorted_datasets_current_yr = [get_monthly_raster_source(monthly_input_dir, year, month)
+                                          for month in range(1, 13)]
+
+            # previous year: gathering datasets for months 10-12 of the previous year
+            sorted_datasets_prev_yr = [get_monthly_raster_source(monthly_input_dir, year - 1, month)
+                                       for month in range(10, 13)]
 
-            # saving the summed peff array
+            # gathering growing season data
+            gs_data = find_raster(growing_season_dir, year=year)
+
+            # summing block by block (current year months, previous year months, growing season start and end bands)
+            # and saving the summed peff array
             output_name = f'effective_precip_{year}.tif'
             output_path = os.path.join(gs_output_dir, output_name)
-            with rio.open(
-                    output_path,
-                    'w',
-                    driver='GTiff',
-                    height=summed_total_arr.shape[0],
-                    width=summed_total_arr.shape[1],
-                    dtype=np.float32,
-                    count=1,
-                    crs=ras_file.crs,
-                    transform=ras_file.transform,
-                    nodata=-9999
-            ) as dst:
-                dst.write(summed_total_arr, 1)
+            write_raster_by_blocks(input_rasters=sorted_datasets_current_yr + sorted_datasets_prev_yr +
+                                                 [(gs_data, 1), (gs_data, 2)],
+                                   output_rasters=output_path, block_function=sum_gs_block_with_SM_storage,
+                                   dtype=np.float32, nodata=-9999)
 
 
 def filter_effective_precip_training_data(training_zone_shp, general_output_dir, refraster=WestUS_raster,
@@ -967,7 +928,7 @@ def filter_effective_precip_training_data(training_zone_shp, general_output_dir,
         training_zone_gdf = gpd.read_file(training_zone_shp)
 
         # reference raster
-        ref_arr, ref_file = read_raster_arr_object(refraster)
+        ref_file = get_ref_grid(refraster)
         total_bounds = ref_file.bounds
 
         # primary and secondary output directory creation
@@ -995,9 +956,11 @@ def filter_effective_precip_training_data(training_zone_shp, general_output_dir,
             zone_raster = os.path.join(shape_temp_output_dir, f'zone_raster_{id}.tif')
             raster_options = gdal.RasterizeOptions(format='Gtiff', outputBounds=list(total_bounds),
                                                    outputType=gdal.GDT_Float32, xRes=resolution, yRes=resolution,
-                                                   noData=no_data_value, burnValues=1, attribute=None, allTouched=True)
+                                                   noData=no_data_value, burnValues=1, attribute=None, allTouched=True,
+                                                   creationOptions=get_gdal_creation_options(gdal.GDT_Float32))
             gdal.Rasterize(destNameOrDestDS=zone_raster, srcDS=zone_shapefile, options=raster_options,
                            resolution=resolution)
+            finalize_raster_output(zone_raster)
 
         rainfed_cropET_dir = '../../Data_main/Raster_data/Rainfed_cropET/WestUS_monthly'
         rainfed_cropland_dir = '../../Data_main/Raster_data/Rainfed_cropland'
@@ -1028,22 +991,22 @@ def filter_effective_precip_training_data(training_zone_shp, general_output_dir,
             year = int(os.path.basename(cropET).split('_')[2])
             month = int(os.path.basename(cropET).split('_')[3].split('.')[0])
 
-            rainfed_cropland_data = glob(os.path.join(rainfed_cropland_dir, f'*{year}*.tif'))[0]
-            irrigated_cropland_data = glob(os.path.join(irrigated_cropland_dir, f'*{year}*.tif'))[0]
-            cdl_data = glob(os.path.join(usda_cdl_dir, f'*{year}*.tif'))[0]
+            rainfed_cropland_data = find_raster(rainfed_cropland_dir, year=year)
+            irrigated_cropland_data = find_raster(irrigated_cropland_dir, year=year)
+            cdl_data = find_raster(usda_cdl_dir, year=year)
             slope_data = glob(os.path.join(slope_dir, '*.tif'))[0]
 
             # selecting excess ET filter based on water year of the monthly rainfed cropland ET data
             if month in list(range(1, 10)):  # January-September, use excess ET filter of the same water year
-                excess_et_filter_data = glob(os.path.join(excess_ET_filter_dir, f'*{year}*.tif'))[0]
+                excess_et_filter_data = find_raster(excess_ET_filter_dir, year=year)
             elif month in list(
                     range(10, 13)) and year != 2020:  # October-December, use excess ET filter of the next water year
-                excess_et_filter_data = glob(os.path.join(excess_ET_filter_dir, f'*{year + 1}*.tif'))[0]
+                excess_et_filter_data = find_raster(excess_ET_filter_dir, year=year + 1)
 
-            rainfed_cropland_arr = read_raster_arr_object(rainfed_cropland_data, get_file=False)
-            irrigated_cropland_arr = read_raster_arr_object(irrigated_cropland_data, get_file=False)
-            cdl_arr = read_raster_arr_object(cdl_data, get_file=False)
-            excess_et_arr = read_raster_arr_object(excess_et_filter_data, get_file=False)
+            rainfed_cropland_arr = read_compact_raster_arr(rainfed_cropland_data)
+            irrigated_cropland_arr = read_compact_raster_arr(irrigated_cropland_data)
+            cdl_arr = read_compact_raster_arr(cdl_data)
+            excess_et_arr = read_compact_raster_arr(excess_et_filter_data)
             slope_arr = read_raster_arr_object(slope_data, get_file=False)
 
             # grass/pasture lands with rainfed croplands or any rainfed cropland with no overlapping with irrigated croplands,
@@ -1109,6 +1072,9 @@ def accumulate_monthly_datasets_to_water_year(skip_processing=False):
     """
     accumulates monthly datasets to water year by sum or mean.
 
+    *** a path in monthly_data_path_dict can be a directory of monthly rasters or a datacube (.zarr/.nc) created with
+    convert_monthly_rasters_to_datacube().
+
     :param skip_processing: Set to true to skip this processing step.
 
     :return: False.
@@ -1169,33 +1135,31 @@ def accumulate_monthly_datasets_to_water_year(skip_processing=False):
 
             for yr in years_to_run:
                 # collecting monthly datasets for the water year
-                data_prev_years = glob(os.path.join(path, f'*{yr - 1}_1[0-2].*tif'))
-                data_current_years = glob(os.path.join(path, f'*{yr}_[1-9].*tif'))
-                total_data_list = data_prev_years + data_current_years
+                total_data_list = list_water_year_sources(path, year=yr)
 
                 # data name extraction
-                data_name_extraction = os.path.basename(total_data_list[0]).split('_')[:-2]
-                data_name = '_'.join(data_name_extraction) + f'_{yr}' + '.tif'
+                # (a datacube doesn't have a raster file to take the grid from, the Western US reference raster is used)
+                if is_datacube(path):
+                    data_name = get_datacube_variable(path) + f'_{yr}' + '.tif'
+                    ref_raster = WestUS_raster
+                else:
+                    data_name_extraction = os.path.basename(total_data_list[0]).split('_')[:-2]
+                    data_name = '_'.join(data_name_extraction) + f'_{yr}' + '.tif'
+                    ref_raster = total_data_list[0]
 
-                # sum() or mean() accumulation
+                # sum() or mean() accumulation in a single pass over the monthly datasets. nan (nodata) values are
+                # skipped for mean, count and std, so the mean is based on the valid (not nan) month count of each
+                # pixel. nan is propagated to the sum, so a pixel missing any month is nodata (not a partial sum)
                 if var in ['GRIDMET_Precip', 'TERRACLIMATE_SR']:  # we perform both mean and sum
-                    sum_rasters(raster_dir=None, raster_list=total_data_list,
-                                output_raster=os.path.join(output_dir, 'sum', data_name),
-                                ref_raster=total_data_list[0], nodata=no_data_value)
-
-                    mean_rasters(raster_dir=None, raster_list=total_data_list,
-                                 output_raster=os.path.join(output_dir, 'mean', data_name),
-                                 ref_raster=total_data_list[0], nodata=no_data_value)
-
+                    # also saving the valid month count and standard deviation
+                    output_raster_dict = {stat: os.path.join(output_dir, stat, data_name)
+                                          for stat in ['sum', 'mean', 'count', 'std']}
                 else:
-                    if accum_by == 'sum':
-                        sum_rasters(raster_dir=None, raster_list=total_data_list,
-                                    output_raster=os.path.join(output_dir, data_name),
-                                    ref_raster=total_data_list[0], nodata=no_data_value)
-                    elif accum_by == 'mean':
-                        mean_rasters(raster_dir=None, raster_list=total_data_list,
-                                     output_raster=os.path.join(output_dir, data_name),
-                                     ref_raster=total_data_list[0], nodata=no_data_value)
+                    output_raster_dict = {accum_by: os.path.join(output_dir, data_name)}
+
+                multi_stat_rasters(input_rasters=total_data_list, output_raster_dict=output_raster_dict,
+                                   ref_raster=ref_raster, nodata=no_data_value, nan_policy='skip',
+                                   propagate_stats=('sum',))
     else:
         pass
 
@@ -1221,8 +1185,8 @@ def fraction_SR_precip_water_yr(years_list, input_dir_runoff, input_dir_precip,
             print(f'estimating water year runoff/precipitation fraction for year {year}...')
 
             # loading and reading datasets
-            sr_data = glob(os.path.join(input_dir_runoff, f'*{year}*.tif'))[0]
-            precip_data = glob(os.path.join(input_dir_precip, f'*{year}*.tif'))[0]
+            sr_data = find_raster(input_dir_runoff, year=year)
+            precip_data = find_raster(input_dir_precip, year=year)
 
             sr_arr, raster_file = read_raster_arr_object(sr_data)
             precip_arr = read_raster_arr_object(precip_data, get_file=False)
@@ -1259,8 +1223,8 @@ def estimate_precip_intensity_water_yr(years_list, input_dir_precip, input_dir_r
             print(f'estimating water year precipitation intensity for year {year}...')
 
             # loading and reading datasets
-            precip_data = glob(os.path.join(input_dir_precip, f'*{year}*.tif'))[0]
-            rainy_data = glob(os.path.join(input_dir_rainy_day, f'*{year}*.tif'))[0]
+            precip_data = find_raster(input_dir_precip, year=year)
+            rainy_data = find_raster(input_dir_rainy_day, year=year)
 
             precip_arr, raster_file = read_raster_arr_object(precip_data)
             rainy_arr = read_raster_arr_object(rainy_data, get_file=False)
@@ -1298,8 +1262,8 @@ def estimate_PET_by_P_water_yr(years_list, input_dir_PET, input_dir_precip, outp
             print(f'estimating water year PET/P for year {year}...')
 
             # loading and reading datasets
-            pet_data = glob(os.path.join(input_dir_PET, f'*{year}*.tif'))[0]
-            precip_data = glob(os.path.join(input_dir_precip, f'*{year}*.tif'))[0]
+            pet_data = find_raster(input_dir_PET, year=year)
+            precip_data = find_raster(input_dir_precip, year=year)
 
             pet_arr = read_raster_arr_object(pet_data, get_file=False)
             precip_arr, raster_file = read_raster_arr_object(precip_data)
@@ -1366,7 +1330,7 @@ def create_rel_infiltration_capacity_dataset(years_list, ksat_data, precip_inten
             print(f'creating relative infiltration capacity dataset for year {year}...')
 
             # loading and reading datasets
-            precip_intensity_data = glob(os.path.join(precip_intensity_dir, f'*{year}*.tif'))[0]
+            precip_intensity_data = find_raster(precip_intensity_dir, year=year)
             precip_intensity_arr = read_raster_arr_object(precip_intensity_data, get_file=False)
 
             ksat_arr, raster_file = read_raster_arr_object(ksat_data)
@@ -1399,37 +1363,37 @@ def develop_P_PET_correlation_dataset(monthly_precip_dir, monthly_pet_dir, outpu
         monthly_precip_data_list = glob(os.path.join(monthly_precip_dir, '*.tif'))
         monthly_pet_data_list = glob(os.path.join(monthly_pet_dir, '*.tif'))
 
-        # reading datasets as arrays
-        monthly_precip_arr_list = [read_raster_arr_object(i, get_file=False) for i in monthly_precip_data_list]
-        monthly_pet_arr_list = [read_raster_arr_object(i, get_file=False) for i in monthly_pet_data_list]
+        n_months = len(monthly_precip_data_list)
 
-        # stacking monthly datasets into a list
-        precip_stack = np.stack(monthly_precip_arr_list, axis=0)  # shape becomes - n_months, n_lat (height), n_lon(width)
-        pet_stack = np.stack(monthly_pet_arr_list, axis=0)  # shape becomes - n_months, n_lat (height), n_lon(width)
+        def correlation_block(block_arrs):
+            # stacking monthly block arrays. shape becomes - n_months, n_rows (block height), n_lon(width)
+            precip_stack = np.stack(block_arrs[:n_months], axis=0)
+            pet_stack = np.stack(block_arrs[n_months:], axis=0)
 
-        # Calculating mean along the time axis (i.e., across months) for each pixel
-        precip_mean = np.mean(precip_stack, axis=0)
-        pet_mean = np.mean(pet_stack, axis=0)
+            # Calculating mean along the time axis (i.e., across months) for each pixel
+            precip_mean = np.mean(precip_stack, axis=0)
+            pet_mean = np.mean(pet_stack, axis=0)
 
-        # estimating precip and pet anomalies
-        precip_anomalies = precip_stack - precip_mean
-        pet_anomalies = pet_stack - pet_mean
+            # estimating precip and pet anomalies
+            precip_anomalies = precip_stack - precip_mean
+            pet_anomalies = pet_stack - pet_mean
 
-        # getting numerator (covariance) for each pixel across time
-        numerator = np.sum(precip_anomalies * pet_anomalies, axis=0)
+            # getting numerator (covariance) for each pixel across time
+            numerator = np.sum(precip_anomalies * pet_anomalies, axis=0)
 
-        # getting denominator (sum of squares for both variables (this measures the total variation for each))
-        sum_of_squares_precip = np.sqrt(np.sum(precip_anomalies ** 2, axis=0))
-        sum_of_squares_pet = np.sqrt(np.sum(pet_anomalies ** 2, axis=0))
-        denominator = sum_of_squares_precip * sum_of_squares_pet
+            # getting denominator (sum of squares for both variables (this measures the total variation for each))
+            sum_of_squares_precip = np.sqrt(np.sum(precip_anomalies ** 2, axis=0))
+            sum_of_squares_pet = np.sqrt(np.sum(pet_anomalies ** 2, axis=0))
+            denominator = sum_of_squares_precip * sum_of_squares_pet
 
-        # calculating Pearson correlation for each pixel
-        with np.errstate(divide='ignore', invalid='ignore'):
-            correlation_arr = numerator / denominator
+            # calculating Pearson correlation for each pixel
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return numerator / denominator
 
+        # estimating correlation block by block (all months of a block are in memory at a time)
         output_raster = os.path.join(output_dir, 'PET_P_corr.tif')
-        _, ref_file = read_raster_arr_object(monthly_precip_data_list[0])
-        write_array_to_raster(correlation_arr, ref_file, ref_file.transform, output_raster)
+        write_raster_by_blocks(input_rasters=monthly_precip_data_list + monthly_pet_data_list,
+                               output_rasters=output_raster, block_function=correlation_block)
 
     else:
         pass
@@ -1693,7 +1657,7 @@ def run_all_preprocessing(skip_process_GrowSeason_data=False,
                      skip_processing=skip_process_AWC_data)
 
     # making a latitude longitude raster from reference raster
-    ref_arr, ref_file = read_raster_arr_object(ref_raster)
+    ref_file = get_ref_grid(ref_raster)
     lon_arr, lat_arr = make_lat_lon_array_from_raster(ref_raster)
 
     lon_dir = os.path.join('../../Data_main/Raster_data', 'Longitude/WestUS')
@@ -1,18 +1,24 @@
 import os
 import re
 import sys
-import pickle
+import threading
 import numpy as np
 import pandas as pd
 from glob import glob
-from datetime import datetime, timedelta
+from collections import namedtuple
 
 from os.path import dirname, abspath
 sys.path.insert(0, dirname(dirname(dirname(abspath(__file__)))))
 
 from Codes.utils.system_ops import makedirs
-from Codes.utils.ml_ops import reindex_df
-from Codes.utils.raster_ops import read_raster_arr_object, write_array_to_raster, create_multiband_raster, sum_rasters
+from Codes.utils.ml_ops import reindex_df, get_model_feature_names, predict_feature_matrix, \
+    predict_raster_by_blocks, get_prediction_workers, run_in_thread_pool
+from Codes.utils.raster_catalog import build_raster_catalog, find_raster, list_water_year_rasters
+from Codes.utils.raster_ops import read_raster_arr_object, write_array_to_raster, create_multiband_raster, \
+    sum_rasters, get_ref_grid, read_compact_raster_arr
+from Codes.utils.datacube_ops import shift_month, create_monthly_lag_buffer, add_monthly_lag_arr
+from Codes.utils.sparse_ops import get_valid_pixel_index, gather_pixels, scatter_pixels, get_mask_key, \
+    write_mask_store, get_mask_store_keys, read_mask
 
 no_data_value = -9999
 model_res = 0.01976293625031605786  # in deg, ~2 km
@@ -20,13 +26,141 @@ WestUS_shape = '../../Data_main/shapefiles/Western_US_ref_shapes/WestUS_states.s
 WestUS_raster = '../../Data_main/reference_rasters/Western_US_refraster_2km.tif'
 GEE_merging_refraster_large_grids = '../../Data_main/reference_rasters/GEE_merging_refraster_larger_grids.tif'
 
+# predictor cache for prediction assembly. Static predictors are read once and yearly predictors once per year, then
+# reused across months. Monthly predictors are kept in sliding windows (MonthlyLagBuffer) of the current and
+# previous months for the lagged features. Cached arrays are flattened (nan set to 0) and read-only, so they can be
+# shared by months processed in parallel (n_workers). Rasters are read outside the lock, so workers don't wait on
+# each other's I/O.
+# static: {variable: array}, yearly: {(variable, year): array} (latest n_workers + 1 years are kept),
+# monthly: {variable: MonthlyLagBuffer}
+PredictorCache = namedtuple('PredictorCache', ['static', 'yearly', 'monthly', 'lock', 'n_workers'])
+
+# number of previous months' GRIDMET precip used as lagged predictors (GRIDMET_Precip_1_lag, GRIDMET_Precip_2_lag)
+precip_max_lag = 2
+
+
+def create_predictor_cache(n_workers=1):
+    """
+    Create an empty predictor cache.
+
+    :param n_workers: Number of parallel workers (months/years processed at a time) sharing the cache. Default set
+                      to 1.
+
+    :return: A PredictorCache namedtuple.
+    """
+    return PredictorCache(static={}, yearly={}, monthly={}, lock=threading.Lock(), n_workers=n_workers)
+
+
+def _read_predictor_arr(input_raster):
+    """
+    Read a predictor raster as a flattened, read-only array with nan-position values set to 0.
+
+    :param input_raster: Input raster filepath.
+
+    :return: 1-D float32 numpy array.
+    """
+    data_arr = read_raster_arr_object(input_raster, get_file=False).flatten()
+    data_arr[np.isnan(data_arr)] = 0  # setting nan-position values with 0
+    data_arr.setflags(write=False)
+
+    return data_arr
+
+
+def get_static_predictor(predictor_cache, var, static_data_dir):
+    """
+    Get a static predictor's array from the predictor cache (read at first request).
+
+    :param predictor_cache: A PredictorCache namedtuple (from create_predictor_cache()).
+    :param var: Static variable name.
+    :param static_data_dir: Directory path of the static variable's raster.
+
+    :return: 1-D read-only float32 numpy array.
+    """
+    with predictor_cache.lock:
+        data_arr = predictor_cache.static.get(var)
+
+    if data_arr is None:
+        static_data = glob(os.path.join(static_data_dir, '*.tif'))[0]
+        data_arr = _read_predictor_arr(static_data)
+
+        with predictor_cache.lock:
+            data_arr = predictor_cache.static.setdefault(var, data_arr)
+
+    return data_arr
+
+
+def get_yearly_predictor(predictor_cache, var, yearly_data_dir, year):
+    """
+    Get a yearly predictor's array from the predictor cache (read at first request for the year). Arrays of the
+    oldest years are dropped from the cache when a new year is read.
+
+    :param predictor_cache: A PredictorCache namedtuple (from create_predictor_cache()).
+    :param var: Yearly variable name.
+    :param yearly_data_dir: Directory path of the yearly variable's rasters.
+    :param year: Year (int).
+
+    :return: 1-D read-only float32 numpy array.
+    """
+    with predictor_cache.lock:
+        data_arr = predictor_cache.yearly.get((var, year))
+
+    if data_arr is None:
+        yearly_data = find_raster(yearly_data_dir, year=year)
+        data_arr = _read_predictor_arr(yearly_data)
+
+        with predictor_cache.lock:
+            data_arr = predictor_cache.yearly.setdefault((var, year), data_arr)
+
+            var_years = sorted(key[1] for key in predictor_cache.yearly.keys() if key[0] == var)
+            for old_year in var_years[:-(predictor_cache.n_workers + 1)]:
+                predictor_cache.yearly.pop((var, old_year))
+
+    return data_arr
+
+
+def get_monthly_predictor(predictor_cache, var, monthly_data_dir, year, month, lag=0):
+    """
+    Get a monthly predictor's array (of a month or a previous month) from the predictor cache. Each month is read
+    once when walking forward in time. Months are lagged by calendar months.
+
+    :param predictor_cache: A PredictorCache namedtuple (from create_predictor_cache()).
+    :param var: Monthly variable name.
+    :param monthly_data_dir: Directory path of the monthly variable's rasters.
+    :param year: Year (int).
+    :param month: Month (int).
+    :param lag: Number of previous months. Default set to 0 for the month itself.
+
+    :return: 1-D read-only float32 numpy array.
+    """
+    lag_year, lag_month = shift_month(year, month, -lag)
+
+    with predictor_cache.lock:
+        if var not in predictor_cache.monthly:
+            # the sliding window also covers the months being processed by the other workers
+            max_lag = precip_max_lag if var == 'GRIDMET_Precip' else 0
+            predictor_cache.monthly[var] = create_monthly_lag_buffer(
+                lambda yr, mn: _read_predictor_arr(find_raster(monthly_data_dir, year=yr, month=mn)),
+                max_lag=max_lag + predictor_cache.n_workers - 1)
+
+        lag_buffer = predictor_cache.monthly[var]
+        data_arr = lag_buffer.arrays.get((lag_year, lag_month))
+
+    if data_arr is None:
+        data_arr = lag_buffer.reader(lag_year, lag_month)
+
+        with predictor_cache.lock:
+            add_monthly_lag_arr(lag_buffer, lag_year, lag_month, data_arr)
+
+    return data_arr
+
 
 def create_monthly_dataframes_for_eff_precip_prediction(years_list, month_range,
                                                         monthly_data_path_dict, yearly_data_path_dict,
                                                         static_data_path_dict, datasets_to_include, output_dir,
-                                                        skip_processing=False):
+                                                        feature_names=None, use_cpu=None, skip_processing=False):
     """
-    Create monthly dataframes of predictors to generate monthly effective prediction.
+    Create monthly dataframes of predictors to generate monthly effective prediction. Static predictors are read
+    once and yearly predictors once per year (see PredictorCache). Year-months are processed in parallel threads.
 
     :param years_list: A list of years_list for which data to include in the dataframe.
     :param month_range: A tuple of start and end month for which data to filter. Set to None if there is no monthly dataset.
@@ -37,6 +171,10 @@ def create_monthly_dataframes_for_eff_precip_prediction(years_list, month_range,
                                   Set to None if there is no yearly dataset.
     :param datasets_to_include: A list of datasets to include in the dataframe.
     :param output_dir: Filepath of output directory.
+    :param feature_names: A list of the trained model's feature names (from get_model_feature_names()). If given,
+                          only the datasets of these features are read and the dataframe columns are saved in this
+                          order. Default set to None to include all datasets_to_include.
+    :param use_cpu: Number of CPUs to use. Default set to None to use all CPUs of the machine.
     :param skip_processing: Set to True to skip this dataframe creation process.
 
     :return: None
@@ -46,92 +184,124 @@ def create_monthly_dataframes_for_eff_precip_prediction(years_list, month_range,
 
         month_list = [m for m in range(month_range[0], month_range[1] + 1)]  # creating list of months
 
-        for year in years_list:  # 1st loop controlling years_list
-            for month in month_list:  # 2nd loop controlling months
-
-                if year == 1999 and month in range(1, 10):  # skipping dataframe creation for 1999 January-September
-                    continue
-
-                else:
-                    print(f'creating dataframe for prediction - year={year}, month={month}...')
+        # skipping dataframe creation for 1999 January-September
+        year_months = [(year, month) for year in years_list for month in month_list
+                       if not (year == 1999 and month in range(1, 10))]
+
+        # year-months are processed in parallel, sharing the cached static/yearly/monthly predictors
+        n_workers, _ = get_prediction_workers(len(year_months), use_cpu)
+        predictor_cache = create_predictor_cache(n_workers)
+
+        # lagged GRIDMET precip is only read if the model uses it
+        include_precip_lags = True
+        if feature_names is not None:
+            include_precip_lags = any(feature in feature_names
+                                      for feature in ('GRIDMET_Precip_1_lag', 'GRIDMET_Precip_2_lag'))
+            datasets_to_include = [var for var in datasets_to_include if (var in feature_names) or
+                                   (var == 'GRIDMET_Precip' and include_precip_lags)]
+
+        def create_month_dataframe(year_month):
+            year, month = year_month
+            print(f'creating dataframe for prediction - year={year}, month={month}...')
+
+            variable_dict = {}
+
+            # reading monthly data and storing it in a dictionary
+            for var in monthly_data_path_dict.keys():
+                if var in datasets_to_include:
+
+                    if var == 'GRIDMET_Precip' and include_precip_lags:  # for including monthly and lagged monthly GRIDMET_precip in the dataframe
+                        # current and previous (calendar) months' precip data. Each month is read once
+                        # (see get_monthly_predictor())
+                        current_precip_arr = get_monthly_predictor(predictor_cache, var,
+                                                                   monthly_data_path_dict[var], year, month)
+
+                        variable_dict[var] = current_precip_arr
+                        variable_dict['month'] = np.full(len(current_precip_arr), month, dtype=np.int16)
+                        variable_dict['GRIDMET_Precip_1_lag'] = get_monthly_predictor(
+                            predictor_cache, var, monthly_data_path_dict[var], year, month, lag=1)
+                        variable_dict['GRIDMET_Precip_2_lag'] = get_monthly_predictor(
+                            predictor_cache, var, monthly_data_path_dict[var], year, month, lag=2)
+
+                    else:
+                        monthly_data = find_raster(monthly_data_path_dict[var], year=year, month=month)
+                        data_arr = read_raster_arr_object(monthly_data, get_file=False).flatten()
 
-                    variable_dict = {}
-
-                    # reading monthly data and storing it in a dictionary
-                    for var in monthly_data_path_dict.keys():
-                        if var in datasets_to_include:
+                        data_arr[np.isnan(data_arr)] = 0  # setting nan-position values with 0
+                        variable_dict[var] = data_arr
+                        variable_dict['month'] = np.full(len(data_arr), month, dtype=np.int16)
 
-                            if var == 'GRIDMET_Precip':  # for including monthly and lagged monthly GRIDMET_precip in the dataframe
-                                current_precip_data = glob(os.path.join(monthly_data_path_dict[var], f'*{year}_{month}.tif*'))[0]
+            # reading yearly data and storing it in a dictionary
+            if yearly_data_path_dict is not None:
+                for var in yearly_data_path_dict.keys():
+                    if var in datasets_to_include:
+                        variable_dict[var] = get_yearly_predictor(predictor_cache, var,
+                                                                  yearly_data_path_dict[var], year)
 
-                                current_month_date = datetime(year, month, 1)
+            # reading static data and storing it in a dictionary
+            if static_data_path_dict is not None:
+                for var in static_data_path_dict.keys():
+                    if var in datasets_to_include:
+                        variable_dict[var] = get_static_predictor(predictor_cache, var, static_data_path_dict[var])
 
-                                # Collect previous month's precip data
-                                prev_month_date = current_month_date - timedelta(30)
-                                prev_2_month_date = current_month_date - timedelta(60)
+            predictor_df = pd.DataFrame(variable_dict)
+            predictor_df = predictor_df.dropna()
 
-                                prev_month_precip_data = glob(os.path.join(monthly_data_path_dict[var],
-                                                                           f'*{prev_month_date.year}_{prev_month_date.month}.tif*'))[0]
-                                prev_2_month_precip_data = glob(os.path.join(monthly_data_path_dict[var],
-                                                                             f'*{prev_2_month_date.year}_{prev_2_month_date.month}.tif*'))[0]
+            # ordering the columns as in model training
+            if feature_names is not None:
+                missing_features = [feature for feature in feature_names if feature not in predictor_df.columns]
+                if len(missing_features) > 0:
+                    raise ValueError(f'no dataset found for model features {missing_features}')
 
-                                # reading datasets
-                                current_precip_arr = read_raster_arr_object(current_precip_data, get_file=False).flatten()
+                predictor_df = predictor_df[feature_names]
 
-                                prev_month_precip_arr = read_raster_arr_object(prev_month_precip_data, get_file=False).flatten()
-                                prev_2_month_precip_arr = read_raster_arr_object(prev_2_month_precip_data, get_file=False).flatten()
+            # saving input predictor csv
+            monthly_output_csv = os.path.join(output_dir, f'predictors_{year}_{month}.csv')
+            predictor_df.to_csv(monthly_output_csv, index=False)
 
-                                current_precip_arr[np.isnan(current_precip_arr)] = 0  # setting nan-position values with 0
-                                prev_month_precip_arr[np.isnan(prev_month_precip_arr)] = 0  # setting nan-position values with 0
-                                prev_2_month_precip_arr [np.isnan(prev_2_month_precip_arr)] = 0  # setting nan-position values with 0
+        run_in_thread_pool(create_month_dataframe, year_months, n_workers)
 
-                                variable_dict[var] = list(current_precip_arr)
-                                variable_dict['month'] = [int(month)] * len(current_precip_arr)
-                                variable_dict['GRIDMET_Precip_1_lag'] = list(prev_month_precip_arr)
-                                variable_dict['GRIDMET_Precip_2_lag'] = list(prev_2_month_precip_arr)
+    else:
+        pass
 
-                            else:
-                                monthly_data = glob(os.path.join(monthly_data_path_dict[var], f'*{year}_{month}.tif*'))[0]
-                                data_arr = read_raster_arr_object(monthly_data, get_file=False).flatten()
 
-                                data_arr[np.isnan(data_arr)] = 0  # setting nan-position values with 0
-                                variable_dict[var] = list(data_arr)
-                                variable_dict['month'] = [int(month)] * len(data_arr)
+def _write_irrigated_cropET_nan_pos_store(irrigated_cropET_dir, output_dir, monthly):
+    """
+    Write nan positions of irrigated cropET datasets to a mask store (packed bitmasks keyed by year/year-month).
+    Only the datasets of years/year-months not in the store are read, and their masks are appended to the store.
 
-                # reading yearly data and storing it in a dictionary
-                if yearly_data_path_dict is not None:
-                    for var in yearly_data_path_dict.keys():
-                        if var in datasets_to_include:
-                            yearly_data = glob(os.path.join(yearly_data_path_dict[var], f'*{year}*.tif'))[0]
-                            data_arr = read_raster_arr_object(yearly_data, get_file=False).flatten()
+    :param irrigated_cropET_dir: Filepath of input irrigated cropET directory.
+    :param output_dir: Filepath of output mask store directory.
+    :param monthly: Set to True for monthly irrigated cropET datasets, False for annual/water year datasets.
 
-                            data_arr[np.isnan(data_arr)] = 0  # setting nan-position values with 0
-                            variable_dict[var] = list(data_arr)
+    :return: None.
+    """
+    records = [rec for rec in build_raster_catalog(irrigated_cropET_dir)['records']
+               if (rec[2] is not None) == monthly]
+    records = sorted(records, key=lambda rec: (rec[1], rec[2] if monthly else 0))
 
-                # reading static data and storing it in a dictionary
-                if static_data_path_dict is not None:
-                    for var in static_data_path_dict.keys():
-                        if var in datasets_to_include:
-                            static_data = glob(os.path.join(static_data_path_dict[var], '*.tif'))[0]
-                            data_arr = read_raster_arr_object(static_data, get_file=False).flatten()
+    if len(records) == 0:
+        raise ValueError(f'no irrigated cropET datasets found in {irrigated_cropET_dir}')
 
-                            data_arr[np.isnan(data_arr)] = 0  # setting nan-position values with 0
-                            variable_dict[var] = list(data_arr)
+    stored_keys = get_mask_store_keys(output_dir)
+    records = [rec for rec in records if get_mask_key(rec[1], rec[2]) not in stored_keys]
+    print(f'{len(stored_keys)} nan position masks are already in the store, adding {len(records)}...')
 
-                predictor_df = pd.DataFrame(variable_dict)
-                predictor_df = predictor_df.dropna()
+    if len(records) == 0:
+        return None
 
-                # saving input predictor csv
-                monthly_output_csv = os.path.join(output_dir, f'predictors_{year}_{month}.csv')
-                predictor_df.to_csv(monthly_output_csv, index=False)
+    _, ref_file = read_raster_arr_object(records[0][-1])
 
-    else:
-        pass
+    nan_pos_masks = ((get_mask_key(rec[1], rec[2]), np.isnan(read_raster_arr_object(rec[-1], get_file=False)))
+                     for rec in records)
+    write_mask_store(output_dir, nan_pos_masks, ref_file.shape, append=True)
 
 
 def create_nan_pos_dict_for_monthly_irrigated_cropET(irrigated_cropET_dir, output_dir, skip_processing=False):
     """
-    Stores nan position pkl files for monthly irrigated cropET datasets.
+    Stores nan positions of monthly irrigated cropET datasets in a mask store (packed bitmasks, one per
+    year-month). Read with read_mask(output_dir, year, month).
+    Masks already in the store are kept and only the new datasets are added (delete output_dir to rebuild the store).
 
     :param irrigated_cropET_dir: Filepath of input monthly irrigated cropET directory.
     :param output_dir: Filepath of output directory.
@@ -140,43 +310,29 @@ def create_nan_pos_dict_for_monthly_irrigated_cropET(irrigated_cropET_dir, outpu
     :return: None.
     """
     if not skip_processing:
-        makedirs([output_dir])
+        print('creating nan position mask store for irrigated cropET...')
 
-        print('creating nan position dicts for irrigated cropET...')
-
-        irrigated_cropET_datasets = glob(os.path.join(irrigated_cropET_dir, '*.tif'))
-
-        for data in irrigated_cropET_datasets:
-            nan_pos_dict = {}  # an empty dict where nan positions will be saved as boolean data
-
-            name = os.path.basename(data).split('.')[0]
-            year = os.path.basename(data).split('_')[2]
-            month = os.path.basename(data).split('_')[3].split('.')[0]
-
-            arr = read_raster_arr_object(data, get_file=False).flatten()
-            nan_pos_dict[name] = np.isnan(arr)
-
-            nan_pos_dict_name = os.path.join(output_dir, f'nan_pos_{year}_{month}.pkl')
-            pickle.dump(nan_pos_dict, open(nan_pos_dict_name, mode='wb+'))
+        _write_irrigated_cropET_nan_pos_store(irrigated_cropET_dir, output_dir, monthly=True)
     else:
         pass
 
 
-def create_monthly_effective_precip_rasters(trained_model, input_csv_dir, exclude_columns,
-                                            irrig_cropET_nan_pos_dir,
-                                            prediction_name_keyword, output_dir,
-                                            ref_raster=WestUS_raster, skip_processing=False):
+def create_monthly_effective_precip_rasters(trained_model, input_csv_dir, irrig_cropET_nan_pos_dir,
+                                            prediction_name_keyword, output_dir, exclude_columns=None,
+                                            ref_raster=WestUS_raster, use_cpu=None, skip_processing=False):
     """
-    Create monthly effective precipitation prediction raster.
+    Create monthly effective precipitation prediction raster. Months are predicted in parallel threads, with the
+    CPUs divided between the threads and lightgbm (see get_prediction_workers()).
 
     :param trained_model: Trained ML model object.
     :param input_csv_dir: Filepath of input directory consisting of monthly predictor csvs for the model.
-    :param exclude_columns: List of predictors to exclude from model prediction.
-    :param irrig_cropET_nan_pos_dir: Filepath of input directory consisting of monthly nan position (irrigated cropET)
-                                     pkl files.
+    :param irrig_cropET_nan_pos_dir: Filepath of monthly nan position (irrigated cropET) mask store directory.
     :param prediction_name_keyword: A str that will be added before prediction file name.
     :param output_dir: Filepath of output directory to store predicted rasters.
+    :param exclude_columns: List of predictors to exclude from model prediction. Only used if the trained model
+                            doesn't store its feature names. Default set to None.
     :param ref_raster: Filepath of ref raster. Default set to WestUS reference raster.
+    :param use_cpu: Number of CPUs to use. Default set to None to use all CPUs of the machine.
     :param skip_processing: Set to true to skip this processing step.
 
     :return: None.
@@ -186,49 +342,57 @@ def create_monthly_effective_precip_rasters(trained_model, input_csv_dir, exclud
         makedirs([output_dir])
 
         # ref raster shape
-        ref_arr, ref_file = read_raster_arr_object(ref_raster)
-        ref_shape = ref_arr.shape
+        ref_file = get_ref_grid(ref_raster)
+        ref_shape = ref_file.shape
+
+        # predictors used in model training (in training order)
+        feature_names = get_model_feature_names(trained_model)
 
         # creating prediction raster for each month
         input_csvs = glob(os.path.join(input_csv_dir, '*.csv'))
+        n_workers, n_model_threads = get_prediction_workers(len(input_csvs), use_cpu)
 
-        for csv in input_csvs:
+        def predict_month(csv):
             year = os.path.basename(csv).split('_')[1]
             month = os.path.basename(csv).split('_')[2].split('.')[0]
             print(f'Generating {prediction_name_keyword} prediction raster for year {year}, month {month}...')
 
-            # loading input variable dataframe and filtering out columns
-            df = pd.read_csv(csv)
-            df = df.drop(columns=exclude_columns)
-            df = reindex_df(df)
+            # irrigated pixels (irrigated cropET not nan) to predict on
+            nan_pos = read_mask(irrig_cropET_nan_pos_dir, year=int(year), month=int(month))
+            irrig_pixel_idx = np.flatnonzero(~nan_pos).astype(np.int32)
 
-            # generating prediction with trained model
-            pred_arr = trained_model.predict(df)
-            pred_arr = np.array(pred_arr)
-
-            # replacing values with -9999 where irrigated cropET is nan
-            irrig_cropET_nan = glob(os.path.join(irrig_cropET_nan_pos_dir, f'*{year}_{month}.pkl*'))[0]
-            nan_pos_dict = pickle.load(open(irrig_cropET_nan, mode='rb'))
+            # loading input variable dataframe and filtering out columns. For models with stored feature names,
+            # only the model's features are parsed, in the order used in training
+            if feature_names is not None:
+                df = pd.read_csv(csv, usecols=feature_names)[feature_names]
+            else:
+                df = pd.read_csv(csv)
+                df = df.drop(columns=exclude_columns)
+                df = reindex_df(df)
 
-            nan_key = f'Irrigated_cropET_{year}_{month}'
-            pred_arr[nan_pos_dict[nan_key]] = -9999
+            # generating prediction with trained model only for the irrigated pixels
+            pred_vec = predict_feature_matrix(trained_model, df.to_numpy(dtype=np.float32)[irrig_pixel_idx],
+                                              num_threads=n_model_threads)
 
-            # reshaping the prediction raster for Western US and saving
-            pred_arr = pred_arr.reshape(ref_shape)
+            # scattering the predictions to Western US grid. -9999 where irrigated cropET is nan
+            pred_arr = scatter_pixels(pred_vec, irrig_pixel_idx, ref_shape, fill_value=-9999)
 
             output_prediction_raster = os.path.join(output_dir, f'{prediction_name_keyword}_{year}_{month}.tif')
 
             write_array_to_raster(raster_arr=pred_arr, raster_file=ref_file, transform=ref_file.transform,
                                   output_path=output_prediction_raster)
+
+        run_in_thread_pool(predict_month, input_csvs, n_workers)
     else:
         pass
 
 
 def create_annual_dataframes_for_peff_frac_prediction(years_list, yearly_data_path_dict,
                                                       static_data_path_dict, datasets_to_include, output_dir,
-                                                      skip_processing=False):
+                                                      use_cpu=None, skip_processing=False):
     """
-    Create annual dataframes of predictors to generate annual effective prediction fraction prediction.
+    Create annual dataframes of predictors to generate annual effective prediction fraction prediction. Years are
+    processed in parallel threads.
 
     :param years_list: A list of years_list for which data to include in the dataframe.
     :param yearly_data_path_dict: A dictionary with static variables' names as keys and their paths as values.
@@ -237,6 +401,7 @@ def create_annual_dataframes_for_peff_frac_prediction(years_list, yearly_data_pa
                                   Set to None if there is no yearly dataset.
     :param datasets_to_include: A list of datasets to include in the dataframe.
     :param output_dir: Filepath of output directory.
+    :param use_cpu: Number of CPUs to use. Default set to None to use all CPUs of the machine.
     :param skip_processing: Set to True to skip this dataframe creation process.
 
     :return: None
@@ -244,36 +409,33 @@ def create_annual_dataframes_for_peff_frac_prediction(years_list, yearly_data_pa
     if not skip_processing:
         makedirs([output_dir])
 
-        for year in years_list:  # 1st loop controlling years_list
-                print(f'creating dataframe for prediction - year={year}...')
+        n_workers, _ = get_prediction_workers(len(years_list), use_cpu)
+        predictor_cache = create_predictor_cache(n_workers)
 
-                variable_dict = {}
+        def create_year_dataframe(year):
+            print(f'creating dataframe for prediction - year={year}...')
 
-                # reading yearly data and storing it in a dictionary
-                for var in yearly_data_path_dict.keys():
-                    if var in datasets_to_include:
-                        yearly_data = glob(os.path.join(yearly_data_path_dict[var], f'*{year}*.tif'))[0]
-                        data_arr = read_raster_arr_object(yearly_data, get_file=False).flatten()
+            variable_dict = {}
 
-                        data_arr[np.isnan(data_arr)] = 0  # setting nan-position values with 0
-                        variable_dict[var] = list(data_arr)
+            # reading yearly data and storing it in a dictionary
+            for var in yearly_data_path_dict.keys():
+                if var in datasets_to_include:
+                    variable_dict[var] = get_yearly_predictor(predictor_cache, var, yearly_data_path_dict[var], year)
 
-                # reading static data and storing it in a dictionary
-                if static_data_path_dict is not None:
-                    for var in static_data_path_dict.keys():
-                        if var in datasets_to_include:
-                            static_data = glob(os.path.join(static_data_path_dict[var], '*.tif'))[0]
-                            data_arr = read_raster_arr_object(static_data, get_file=False).flatten()
+            # reading static data and storing it in a dictionary
+            if static_data_path_dict is not None:
+                for var in static_data_path_dict.keys():
+                    if var in datasets_to_include:
+                        variable_dict[var] = get_static_predictor(predictor_cache, var, static_data_path_dict[var])
 
-                            data_arr[np.isnan(data_arr)] = 0  # setting nan-position values with 0
-                            variable_dict[var] = list(data_arr)
+            predictor_df = pd.DataFrame(variable_dict)
+            predictor_df = predictor_df.dropna()
 
-                predictor_df = pd.DataFrame(variable_dict)
-                predictor_df = predictor_df.dropna()
+            # saving input predictor csv
+            monthly_output_csv = os.path.join(output_dir, f'predictors_{year}.csv')
+            predictor_df.to_csv(monthly_output_csv, index=False)
 
-                # saving input predictor csv
-                monthly_output_csv = os.path.join(output_dir, f'predictors_{year}.csv')
-                predictor_df.to_csv(monthly_output_csv, index=False)
+        run_in_thread_pool(create_year_dataframe, years_list, n_workers)
 
     else:
         pass
@@ -281,7 +443,9 @@ def create_annual_dataframes_for_peff_frac_prediction(years_list, yearly_data_pa
 
 def create_nan_pos_dict_for_annual_irrigated_cropET(irrigated_cropET_dir, output_dir, skip_processing=False):
     """
-    Stores nan position pkl files for annual/water year irrigated cropET datasets.
+    Stores nan positions of annual/water year irrigated cropET datasets in a mask store (packed bitmasks, one per
+    year). Read with read_mask(output_dir, year).
+    Masks already in the store are kept and only the new datasets are added (delete output_dir to rebuild the store).
 
     :param irrigated_cropET_dir: Filepath of input annual/water year irrigated cropET directory.
     :param output_dir: Filepath of output directory.
@@ -290,22 +454,9 @@ def create_nan_pos_dict_for_annual_irrigated_cropET(irrigated_cropET_dir, output
     :return: None.
     """
     if not skip_processing:
-        makedirs([output_dir])
+        print('creating nan position mask store for irrigated cropET...')
 
-        print('creating nan position dicts for irrigated cropET...')
-
-        irrigated_cropET_datasets = glob(os.path.join(irrigated_cropET_dir, '*.tif'))
-
-        nan_pos_dict = {}  # an empty dict where nan positions will be saved as boolean data
-        for data in irrigated_cropET_datasets:
-            name = os.path.basename(data).split('.')[0]
-            year = os.path.basename(data).split('_')[2].split('.')[0]
-
-            arr = read_raster_arr_object(data, get_file=False).flatten()
-            nan_pos_dict[name] = np.isnan(arr)
-
-            nan_pos_dict_name = os.path.join(output_dir, f'nan_pos_{year}.pkl')
-            pickle.dump(nan_pos_dict, open(nan_pos_dict_name, mode='wb+'))
+        _write_irrigated_cropET_nan_pos_store(irrigated_cropET_dir, output_dir, monthly=False)
     else:
         pass
 
@@ -314,19 +465,22 @@ def create_annual_peff_fraction_rasters(trained_model, input_csv_dir, exclude_co
                                         irrig_cropET_nan_pos_dir,
                                         lake_raster, ref_raster,
                                         prediction_name_keyword, output_dir,
-                                        skip_processing=False):
+                                        use_cpu=None, skip_processing=False):
     """
-    Create annual/water year effective precipitation fraction prediction raster.
+    Create annual/water year effective precipitation fraction prediction raster. Prediction is generated only for the
+    pixels with irrigated cropET that aren't lakes. Other pixels are set to -9999. Years are predicted in parallel
+    threads, with the CPUs divided between the threads and lightgbm (see get_prediction_workers()).
 
     :param trained_model: Trained ML model object.
     :param input_csv_dir: Filepath of input directory consisting of annual/water year predictor csvs for the model.
     :param exclude_columns: List of predictors to exclude from model prediction.
-    :param irrig_cropET_nan_pos_dir: Filepath of input directory consisting of annual.water year nan position
-                                     (irrigated cropET) pkl files.
+    :param irrig_cropET_nan_pos_dir: Filepath of annual/water year nan position (irrigated cropET) mask store
+                                     directory.
     :param prediction_name_keyword: A str that will be added before prediction file name.
     :param output_dir: Filepath of output directory to store predicted rasters.
     :param lake_raster: Filepath of lake raster.
     :param ref_raster: Filepath of ref raster. Default set to WestUS reference raster.
+    :param use_cpu: Number of CPUs to use. Default set to None to use all CPUs of the machine.
     :param skip_processing: Set to true to skip this processing step.
 
     :return: None.
@@ -335,16 +489,17 @@ def create_annual_peff_fraction_rasters(trained_model, input_csv_dir, exclude_co
         makedirs([output_dir])
 
         # ref raster shape
-        ref_arr, ref_file = read_raster_arr_object(ref_raster)
-        ref_shape = ref_arr.shape
+        ref_file = get_ref_grid(ref_raster)
+        ref_shape = ref_file.shape
 
         # loading lake raster data
-        lake_arr = read_raster_arr_object(lake_raster, get_file=False)
+        lake_arr = read_compact_raster_arr(lake_raster)
 
         # creating prediction raster for each year
         input_csvs = glob(os.path.join(input_csv_dir, '*.csv'))
+        n_workers, n_model_threads = get_prediction_workers(len(input_csvs), use_cpu)
 
-        for csv in input_csvs:
+        def predict_year(csv):
             year = os.path.basename(csv).split('_')[1].split('.')[0]
 
             print(f'Generating {prediction_name_keyword} prediction raster for year {year}...')
@@ -354,31 +509,381 @@ def create_annual_peff_fraction_rasters(trained_model, input_csv_dir, exclude_co
             df = df.drop(columns=exclude_columns)
             df = reindex_df(df)
 
-            # generating prediction with trained model
-            pred_arr = trained_model.predict(df)
-            pred_arr = np.array(pred_arr)
+            # pixels to predict on - irrigated cropET not nan and not lake (water body masking)
+            nan_pos = read_mask(irrig_cropET_nan_pos_dir, year=int(year))
+            pixel_idx = np.flatnonzero(~nan_pos & (lake_arr.ravel() != 1)).astype(np.int32)
+
+            # generating prediction with trained model only for those pixels
+            pred_vec = predict_feature_matrix(trained_model, df.to_numpy(dtype=np.float32)[pixel_idx],
+                                              num_threads=n_model_threads)
 
             # replacing >1 fraction values with 1. From our observation, the number of values replaced with this
             # filtering approach isn't much
-            pred_arr = np.where(pred_arr > 1, 1, pred_arr)
+            pred_vec = np.where(pred_vec > 1, 1, pred_vec)
 
-            # replacing values with -9999 where irrigated cropET is nan
-            irrig_cropET_nan = glob(os.path.join(irrig_cropET_nan_pos_dir, f'*{year}.pkl*'))[0]
-            nan_pos_dict = pickle.load(open(irrig_cropET_nan, mode='rb'))
+            # scattering the predictions to Western US grid. -9999 where irrigated cropET is nan or lake
+            pred_arr = scatter_pixels(pred_vec, pixel_idx, ref_shape, fill_value=-9999)
 
-            nan_key = f'Irrigated_cropET_{year}'
-            pred_arr[nan_pos_dict[nan_key]] = ref_file.nodata
+            output_prediction_raster = os.path.join(output_dir, f'{prediction_name_keyword}_{year}.tif')
+            write_array_to_raster(raster_arr=pred_arr, raster_file=ref_file, transform=ref_file.transform,
+                                  output_path=output_prediction_raster)
+
+        run_in_thread_pool(predict_year, input_csvs, n_workers)
+
+    else:
+        pass
 
-            # reshaping the prediction raster for Western US and saving
-            pred_arr = pred_arr.reshape(ref_shape)
 
-            # applying water body masking with lake raster
-            pred_arr = np.where(lake_arr == 1, -9999, pred_arr)
+def _read_feature_arr(feature, year, month, monthly_data_path_dict, yearly_data_path_dict, static_data_path_dict,
+                      predictor_cache):
+    """
+    Read the (flattened) array of a model feature from its raster. nan-position values are set to 0, same as in the
+    predictor dataframes.
+
+    :param feature: Feature name.
+    :param year: Year (int).
+    :param month: Month (int). None for annual models.
+    :param monthly_data_path_dict: A dictionary with monthly variables' names as keys and their paths as values.
+                                   Can be None.
+    :param yearly_data_path_dict: A dictionary with yearly variables' names as keys and their paths as values.
+                                  Can be None.
+    :param static_data_path_dict: A dictionary with static variables' names as keys and their paths as values.
+                                  Can be None.
+    :param predictor_cache: A PredictorCache namedtuple to reuse static and yearly feature arrays.
+
+    :return: 1-D read-only float32 numpy array.
+    """
+    monthly_data_path_dict = {} if monthly_data_path_dict is None else monthly_data_path_dict
+    yearly_data_path_dict = {} if yearly_data_path_dict is None else yearly_data_path_dict
+    static_data_path_dict = {} if static_data_path_dict is None else static_data_path_dict
+
+    if feature in monthly_data_path_dict:
+        return get_monthly_predictor(predictor_cache, feature, monthly_data_path_dict[feature], year, month)
+
+    elif feature in ('GRIDMET_Precip_1_lag', 'GRIDMET_Precip_2_lag'):
+        # previous (calendar) months' precip data
+        lag = 1 if feature == 'GRIDMET_Precip_1_lag' else 2
+        return get_monthly_predictor(predictor_cache, 'GRIDMET_Precip', monthly_data_path_dict['GRIDMET_Precip'],
+                                     year, month, lag=lag)
+
+    elif feature in yearly_data_path_dict:
+        return get_yearly_predictor(predictor_cache, feature, yearly_data_path_dict[feature], year)
+
+    elif feature in static_data_path_dict:
+        return get_static_predictor(predictor_cache, feature, static_data_path_dict[feature])
+
+    else:
+        raise ValueError(f'no dataset found for model feature {feature}')
+
+
+def get_feature_raster_sources(feature_names, year, month, monthly_data_path_dict, yearly_data_path_dict,
+                               static_data_path_dict):
+    """
+    Get the predictor raster of each model feature for a year/month (for block-wise prediction with
+    predict_raster_by_blocks()). The month feature is returned as a constant.
 
+    :param feature_names: A list of the trained model's feature names (from get_model_feature_names()).
+    :param year: Year (int).
+    :param month: Month (int). Set to None for annual models.
+    :param monthly_data_path_dict: A dictionary with monthly variables' names as keys and their paths as values.
+                                   Set to None if there is no monthly dataset.
+    :param yearly_data_path_dict: A dictionary with yearly variables' names as keys and their paths as values.
+                                  Set to None if there is no yearly dataset.
+    :param static_data_path_dict: A dictionary with static variables' names as keys and their paths as values.
+                                  Set to None if there is no static dataset.
+
+    :return: A list of raster filepaths (or constants) in the model's feature order.
+    """
+    monthly_data_path_dict = {} if monthly_data_path_dict is None else monthly_data_path_dict
+    yearly_data_path_dict = {} if yearly_data_path_dict is None else yearly_data_path_dict
+    static_data_path_dict = {} if static_data_path_dict is None else static_data_path_dict
+
+    feature_sources = []
+    for feature in feature_names:
+        if feature == 'month':
+            feature_sources.append(month)
+
+        elif feature in monthly_data_path_dict:
+            feature_sources.append(find_raster(monthly_data_path_dict[feature], year=year, month=month))
+
+        elif feature in ('GRIDMET_Precip_1_lag', 'GRIDMET_Precip_2_lag'):
+            # previous (calendar) months' precip data
+            lag = 1 if feature == 'GRIDMET_Precip_1_lag' else 2
+            lag_year, lag_month = shift_month(year, month, -lag)
+            feature_sources.append(find_raster(monthly_data_path_dict['GRIDMET_Precip'], year=lag_year,
+                                               month=lag_month))
+
+        elif feature in yearly_data_path_dict:
+            feature_sources.append(find_raster(yearly_data_path_dict[feature], year=year))
+
+        elif feature in static_data_path_dict:
+            feature_sources.append(glob(os.path.join(static_data_path_dict[feature], '*.tif'))[0])
+
+        else:
+            raise ValueError(f'no dataset found for model feature {feature}')
+
+    return feature_sources
+
+
+def assemble_feature_matrix(feature_names, year, month, monthly_data_path_dict, yearly_data_path_dict,
+                            static_data_path_dict, pixel_idx=None, predictor_cache=None):
+    """
+    Assemble a float32 C-contiguous feature matrix (pixels x features) for model prediction directly from rasters.
+    Columns are in the model's feature order.
+
+    :param feature_names: A list of the trained model's feature names (from get_model_feature_names()).
+    :param year: Year (int).
+    :param month: Month (int). Set to None for annual models.
+    :param monthly_data_path_dict: A dictionary with monthly variables' names as keys and their paths as values.
+                                   Set to None if there is no monthly dataset.
+    :param yearly_data_path_dict: A dictionary with yearly variables' names as keys and their paths as values.
+                                  Set to None if there is no yearly dataset.
+    :param static_data_path_dict: A dictionary with static variables' names as keys and their paths as values.
+                                  Set to None if there is no static dataset.
+    :param pixel_idx: Sorted flat pixel indices (from get_valid_pixel_index()) to assemble the rows for. Default set
+                      to None to assemble all pixels of the grid.
+    :param predictor_cache: A PredictorCache namedtuple (from create_predictor_cache()) to reuse static and yearly
+                            feature arrays between calls. Default set to None.
+
+    :return: 2-D float32 numpy array.
+    """
+    predictor_cache = create_predictor_cache() if predictor_cache is None else predictor_cache
+
+    feature_matrix = None
+    for col, feature in enumerate(feature_names):
+        if feature == 'month':
+            feature_vec = month
+        else:
+            feature_vec = _read_feature_arr(feature, year, month, monthly_data_path_dict, yearly_data_path_dict,
+                                            static_data_path_dict, predictor_cache)
+            if pixel_idx is not None:
+                feature_vec = gather_pixels(feature_vec, pixel_idx)
+
+        if feature_matrix is None:
+            n_rows = len(pixel_idx) if pixel_idx is not None else np.size(feature_vec)
+            feature_matrix = np.empty((n_rows, len(feature_names)), dtype=np.float32, order='C')
+
+        feature_matrix[:, col] = feature_vec
+
+    return feature_matrix
+
+
+def save_feature_matrix(feature_matrix, feature_names, pixel_idx, output_parquet):
+    """
+    Save a feature matrix (with the pixel indices of its rows) as a parquet file.
+
+    :param feature_matrix: 2-D numpy array (pixels x features).
+    :param feature_names: A list of feature names (columns of the matrix).
+    :param pixel_idx: Flat pixel indices of the rows. Can be None if the matrix has all pixels of the grid.
+    :param output_parquet: Filepath of output parquet file.
+
+    :return: Filepath of output parquet file.
+    """
+    if pixel_idx is None:
+        pixel_idx = np.arange(feature_matrix.shape[0], dtype=np.int32)
+
+    feature_df = pd.DataFrame(feature_matrix, columns=feature_names, copy=False)
+    feature_df.insert(0, 'pixel_idx', pixel_idx)
+    feature_df.to_parquet(output_parquet, index=False)
+
+    return output_parquet
+
+
+def predict_monthly_effective_precip_rasters(trained_model, years_list, month_range, monthly_data_path_dict,
+                                             yearly_data_path_dict, static_data_path_dict, irrigated_cropET_dir,
+                                             prediction_name_keyword, output_dir, ref_raster=WestUS_raster,
+                                             feature_matrix_dir=None, block_rows=None, use_cpu=None,
+                                             skip_processing=False):
+    """
+    Create monthly effective precipitation prediction rasters directly from the predictor rasters (without predictor
+    csvs and nan position pkl files). For each month, the model's features are read from the rasters into a float32
+    feature matrix of the pixels with irrigated cropET, predicted and scattered back to the grid. Other pixels are
+    set to -9999.
+
+    With block_rows, each month is predicted and written block by block (see predict_raster_by_blocks()), so peak
+    memory is set by the block size instead of the grid size (for larger/finer grids).
+
+    :param trained_model: Trained ML model object.
+    :param years_list: A list of years_list to predict for.
+    :param month_range: A tuple of start and end month to predict for.
+    :param monthly_data_path_dict: A dictionary with monthly variables' names as keys and their paths as values.
+    :param yearly_data_path_dict: A dictionary with yearly variables' names as keys and their paths as values.
+                                  Set to None if there is no yearly dataset.
+    :param static_data_path_dict: A dictionary with static variables' names as keys and their paths as values.
+                                  Set to None if there is no static dataset.
+    :param irrigated_cropET_dir: Filepath of input monthly irrigated cropET directory.
+    :param prediction_name_keyword: A str that will be added before prediction file name.
+    :param output_dir: Filepath of output directory to store predicted rasters.
+    :param ref_raster: Filepath of ref raster. Default set to WestUS reference raster.
+    :param feature_matrix_dir: Filepath of directory to also save the monthly feature matrices as parquet files.
+                               Default set to None to not save. Not available with block_rows.
+    :param block_rows: Number of rows (full raster width) per block for block-wise prediction. Default set to None
+                       to predict each month in full.
+    :param use_cpu: Number of CPUs to use. Default set to None to use all CPUs of the machine. The CPUs are divided
+                    between parallel year-months and lightgbm threads (see get_prediction_workers()).
+    :param skip_processing: Set to true to skip this processing step.
+
+    :return: None.
+    """
+    if not skip_processing:
+        if (block_rows is not None) and (feature_matrix_dir is not None):
+            raise ValueError('feature matrices can not be saved with block-wise prediction (block_rows)')
+
+        makedirs([output_dir])
+        if feature_matrix_dir is not None:
+            makedirs([feature_matrix_dir])
+
+        ref_file = get_ref_grid(ref_raster)
+
+        # predictors used in model training (in training order)
+        feature_names = get_model_feature_names(trained_model)
+
+        month_list = [m for m in range(month_range[0], month_range[1] + 1)]  # creating list of months
+
+        # skipping prediction for 1999 January-September
+        year_months = [(year, month) for year in years_list for month in month_list
+                       if not (year == 1999 and month in range(1, 10))]
+
+        # year-months are predicted in parallel, sharing the cached static/yearly/monthly predictors
+        n_workers, n_model_threads = get_prediction_workers(len(year_months), use_cpu)
+        predictor_cache = create_predictor_cache(n_workers)
+
+        def predict_month(year_month):
+            year, month = year_month
+            print(f'Generating {prediction_name_keyword} prediction raster for year {year}, month {month}...')
+
+            # irrigated pixels (irrigated cropET not nan) to predict on
+            irrigated_cropET_data = find_raster(irrigated_cropET_dir, year=year, month=month)
+            output_prediction_raster = os.path.join(output_dir, f'{prediction_name_keyword}_{year}_{month}.tif')
+
+            if block_rows is not None:
+                feature_sources = get_feature_raster_sources(feature_names, year, month, monthly_data_path_dict,
+                                                             yearly_data_path_dict, static_data_path_dict)
+                predict_raster_by_blocks(trained_model, feature_sources, output_prediction_raster,
+                                         mask_sources=[irrigated_cropET_data], block_rows=block_rows,
+                                         num_threads=n_model_threads)
+                return
+
+            irrig_pixel_idx = get_valid_pixel_index(read_raster_arr_object(irrigated_cropET_data, get_file=False))
+
+            feature_matrix = assemble_feature_matrix(feature_names, year, month, monthly_data_path_dict,
+                                                     yearly_data_path_dict, static_data_path_dict,
+                                                     pixel_idx=irrig_pixel_idx, predictor_cache=predictor_cache)
+
+            if feature_matrix_dir is not None:
+                save_feature_matrix(feature_matrix, feature_names, irrig_pixel_idx,
+                                    os.path.join(feature_matrix_dir, f'predictors_{year}_{month}.parquet'))
+
+            # generating prediction with trained model and scattering to Western US grid.
+            # -9999 where irrigated cropET is nan
+            pred_vec = predict_feature_matrix(trained_model, feature_matrix, num_threads=n_model_threads)
+            pred_arr = scatter_pixels(pred_vec, irrig_pixel_idx, ref_file.shape, fill_value=-9999)
+
+            write_array_to_raster(raster_arr=pred_arr, raster_file=ref_file, transform=ref_file.transform,
+                                  output_path=output_prediction_raster)
+
+        run_in_thread_pool(predict_month, year_months, n_workers)
+    else:
+        pass
+
+
+def predict_annual_peff_fraction_rasters(trained_model, years_list, yearly_data_path_dict, static_data_path_dict,
+                                         irrigated_cropET_dir, lake_raster, prediction_name_keyword, output_dir,
+                                         ref_raster=WestUS_raster, feature_matrix_dir=None, block_rows=None,
+                                         use_cpu=None, skip_processing=False):
+    """
+    Create annual/water year effective precipitation fraction prediction rasters directly from the predictor rasters
+    (without predictor csvs and nan position pkl files). For each year, the model's features are read from the
+    rasters into a float32 feature matrix of the pixels with irrigated cropET that aren't lakes, predicted and
+    scattered back to the grid. Other pixels are set to -9999.
+
+    With block_rows, each year is predicted and written block by block (see predict_raster_by_blocks()), so peak
+    memory is set by the block size instead of the grid size (for larger/finer grids).
+
+    :param trained_model: Trained ML model object.
+    :param years_list: A list of years_list to predict for.
+    :param yearly_data_path_dict: A dictionary with yearly variables' names as keys and their paths as values.
+    :param static_data_path_dict: A dictionary with static variables' names as keys and their paths as values.
+                                  Set to None if there is no static dataset.
+    :param irrigated_cropET_dir: Filepath of input annual/water year irrigated cropET directory.
+    :param lake_raster: Filepath of lake raster.
+    :param prediction_name_keyword: A str that will be added before prediction file name.
+    :param output_dir: Filepath of output directory to store predicted rasters.
+    :param ref_raster: Filepath of ref raster. Default set to WestUS reference raster.
+    :param feature_matrix_dir: Filepath of directory to also save the annual feature matrices as parquet files.
+                               Default set to None to not save. Not available with block_rows.
+    :param block_rows: Number of rows (full raster width) per block for block-wise prediction. Default set to None
+                       to predict each year in full.
+    :param use_cpu: Number of CPUs to use. Default set to None to use all CPUs of the machine. The CPUs are divided
+                    between parallel years and lightgbm threads (see get_prediction_workers()).
+    :param skip_processing: Set to true to skip this processing step.
+
+    :return: None.
+    """
+    if not skip_processing:
+        if (block_rows is not None) and (feature_matrix_dir is not None):
+            raise ValueError('feature matrices can not be saved with block-wise prediction (block_rows)')
+
+        makedirs([output_dir])
+        if feature_matrix_dir is not None:
+            makedirs([feature_matrix_dir])
+
+        ref_file = get_ref_grid(ref_raster)
+
+        # loading lake raster data (read block by block with block_rows)
+        lake_arr = read_compact_raster_arr(lake_raster) if block_rows is None else None
+
+        # predictors used in model training (in training order)
+        feature_names = get_model_feature_names(trained_model)
+
+        # years are predicted in parallel, sharing the cached static/yearly predictors
+        n_workers, n_model_threads = get_prediction_workers(len(years_list), use_cpu)
+        predictor_cache = create_predictor_cache(n_workers)
+
+        def predict_year(year):
+            print(f'Generating {prediction_name_keyword} prediction raster for year {year}...')
+
+            # pixels to predict on - irrigated cropET not nan and not lake (water body masking)
+            irrigated_cropET_data = find_raster(irrigated_cropET_dir, year=year)
             output_prediction_raster = os.path.join(output_dir, f'{prediction_name_keyword}_{year}.tif')
+
+            if block_rows is not None:
+                feature_sources = get_feature_raster_sources(feature_names, year, None, None, yearly_data_path_dict,
+                                                             static_data_path_dict)
+                predict_raster_by_blocks(trained_model, feature_sources, output_prediction_raster,
+                                         mask_sources=[irrigated_cropET_data, lake_raster],
+                                         mask_function=lambda mask_blocks: ~np.isnan(mask_blocks[0]) &
+                                                                           (mask_blocks[1] != 1),
+                                         postprocess_function=lambda pred_vec: np.where(pred_vec > 1, 1, pred_vec),
+                                         block_rows=block_rows, num_threads=n_model_threads)
+                return
+
+            pixel_idx = get_valid_pixel_index(read_raster_arr_object(irrigated_cropET_data, get_file=False),
+                                              mask=lake_arr != 1)
+
+            feature_matrix = assemble_feature_matrix(feature_names, year, None, None, yearly_data_path_dict,
+                                                     static_data_path_dict, pixel_idx=pixel_idx,
+                                                     predictor_cache=predictor_cache)
+
+            if feature_matrix_dir is not None:
+                save_feature_matrix(feature_matrix, feature_names, pixel_idx,
+                                    os.path.join(feature_matrix_dir, f'predictors_{year}.parquet'))
+
+            # generating prediction with trained model
+            pred_vec = predict_feature_matrix(trained_model, feature_matrix, num_threads=n_model_threads)
+
+            # replacing >1 fraction values with 1. From our observation, the number of values replaced with this
+            # filtering approach isn't much
+            pred_vec = np.where(pred_vec > 1, 1, pred_vec)
+
+            # scattering the predictions to Western US grid. -9999 where irrigated cropET is nan or lake
+            pred_arr = scatter_pixels(pred_vec, pixel_idx, ref_file.shape, fill_value=-9999)
+
             write_array_to_raster(raster_arr=pred_arr, raster_file=ref_file, transform=ref_file.transform,
                                   output_path=output_prediction_raster)
 
+        run_in_thread_pool(predict_year, years_list, n_workers)
+
     else:
         pass
 
@@ -431,9 +936,7 @@ def sum_peff_water_year(years_list, monthly_peff_dir, output_peff_dir, skip_proc
 
         for yr in years_list:
             # # summing peff for water year (previous year's October to current year's september)
-            peff_prev_years = glob(os.path.join(monthly_peff_dir, f'*{yr - 1}_1[0-2].*tif'))
-            pff_data_current_years = glob(os.path.join(monthly_peff_dir, f'*{yr}_[1-9].*tif'))
-            peff_water_yr_list = peff_prev_years + pff_data_current_years
+            peff_water_yr_list = list_water_year_rasters(monthly_peff_dir, year=yr)
 
             sum_rasters(raster_list=peff_water_yr_list, raster_dir=None,
                         output_raster=os.path.join(output_peff_dir, f'effective_precip_{yr}.tif'),
@@ -460,8 +963,8 @@ def estimate_peff_precip_water_year_fraction(years_list, peff_dir_water_yr, prec
 
         for yr in years_list:
             # collecting and reading datasets
-            peff_data = glob(os.path.join(peff_dir_water_yr, f'*{yr}*.tif'))[0]
-            precip_data = glob(os.path.join(precip_dir_water_yr, f'*{yr}*.tif'))[0]
+            peff_data = find_raster(peff_dir_water_yr, year=yr)
+            precip_data = find_raster(precip_dir_water_yr, year=yr)
 
             peff_arr, file = read_raster_arr_object(peff_data)
             precip_arr = read_raster_arr_object(precip_data, get_file=False)
@@ -495,12 +998,12 @@ def process_monthly_peff_rasters_to_multiband_forGEE(years, peff_monthly_dir, ou
 
         # collecting the monthly Peff estimates serially for a year
         for month in list(range(1, 13)):
-            monthly_peff = glob(os.path.join(peff_monthly_dir, f'*{year}_{month}*.tif'))
+            monthly_peff = find_raster(peff_monthly_dir, year=year, month=month, required=False)
 
-            if len(monthly_peff) == 0:  # in case of 2020, Peff data is available up to month 9. This blocks controls data ingestion for year 2020
+            if monthly_peff is None:  # in case of 2020, Peff data is available up to month 9. This blocks controls data ingestion for year 2020
                 pass
             else:
-                peff_data_list.append(monthly_peff[0])
+                peff_data_list.append(monthly_peff)
 
         # creating the multi-band image for monthly datasets within an year
         output_raster = os.path.join(output_dir, f'effective_precip_{year}_monthly.tif')
@@ -532,8 +1035,8 @@ def estimate_water_yr_peff_using_peff_frac(years_list, water_year_precip_dir, wa
             print(f'Estimating water year Peff using water year Peff fraction (from water year model) for year {yr}...')
 
             # laoding and reading data
-            precip = glob(os.path.join(water_year_precip_dir, f'*{yr}*.tif'))[0]
-            peff_frac = glob(os.path.join(water_year_peff_frac_dir, f'*{yr}*.tif'))[0]
+            precip = find_raster(water_year_precip_dir, year=yr)
+            peff_frac = find_raster(water_year_peff_frac_dir, year=yr)
 
             precip_arr = read_raster_arr_object(precip, get_file=False)
             peff_frac_arr, raster_file = read_raster_arr_object(peff_frac)
@@ -587,21 +1090,21 @@ def scale_monthy_peff_with_wateryr_peff_model(years_list, unscaled_peff_monthly_
 
                     # selecting the water year of total peff data based on month
                     if mn in range(10, 12 + 1):
-                        peff_unbound_wy = glob(os.path.join(unscaled_peff_water_yr_dir, f'*{yr + 1}*.tif'))[0]
+                        peff_unbound_wy = find_raster(unscaled_peff_water_yr_dir, year=yr + 1)
                         peff_unbound_wy_arr = read_raster_arr_object(peff_unbound_wy, get_file=False)
 
-                        peff_bound_wy = glob(os.path.join(scaled_peff_water_yr_dir, f'*{yr + 1}*.tif'))[0]
+                        peff_bound_wy = find_raster(scaled_peff_water_yr_dir, year=yr + 1)
                         peff_bound_wy_arr = read_raster_arr_object(peff_bound_wy, get_file=False)
 
                     elif mn in range(1, 9 + 1):
-                        peff_unbound_wy = glob(os.path.join(unscaled_peff_water_yr_dir, f'*{yr}*.tif'))[0]
+                        peff_unbound_wy = find_raster(unscaled_peff_water_yr_dir, year=yr)
                         peff_unbound_wy_arr = read_raster_arr_object(peff_unbound_wy, get_file=False)
 
-                        peff_bound_wy = glob(os.path.join(scaled_peff_water_yr_dir, f'*{yr}*.tif'))[0]
+                        peff_bound_wy = find_raster(scaled_peff_water_yr_dir, year=yr)
                         peff_bound_wy_arr = read_raster_arr_object(peff_bound_wy, get_file=False)
 
                     # selecting the monthly peff data
-                    unscaled_peff_monthly = glob(os.path.join(unscaled_peff_monthly_dir, f'*{yr}_{mn}*.tif'))[0]
+                    unscaled_peff_monthly = find_raster(unscaled_peff_monthly_dir, year=yr, month=mn)
                     unscaled_peff_monthly_arr, raster_file = read_raster_arr_object(unscaled_peff_monthly)
 
                     # scaling monthly peff with bounded peff total
@@ -10,9 +10,8 @@ from Codes.utils.system_ops import makedirs
 from Codes.utils.stats_ops import calculate_r2, calculate_rmse, calculate_mae
 from Codes.utils.plots import scatter_plot_of_same_vars, density_grid_plot_of_same_vars
 from Codes.utils.ml_ops import create_train_test_monthly_dataframe, split_train_val_test_set, train_model, \
-    create_aleplots, create_pdplots, plot_permutation_importance
-from Codes.effective_precip.m00_eff_precip_utils import create_monthly_dataframes_for_eff_precip_prediction, \
-    create_nan_pos_dict_for_monthly_irrigated_cropET, create_monthly_effective_precip_rasters, \
+    create_aleplots, create_pdplots, plot_permutation_importance, compile_model
+from Codes.effective_precip.m00_eff_precip_utils import predict_monthly_effective_precip_rasters, \
     collect_Peff_predictions_in_dataframe, sum_peff_water_year
 
 # model resolution and reference raster/shapefile
@@ -68,17 +67,6 @@ train_test_years_list = [2008, 2009, 2010, 2011, 2012, 2013, 2014, 2015, 2016, 2
 months = (1, 12)  # the model will itself discard the month is places where growing season is less than 12 months
                   # (using the nan value set up)
 
-# datasets to include in monthly dataframe for Peff prediction
-datasets_to_include_month_predictors = ['PRISM_Precip', 'PRISM_Tmax', 'PRISM_Tmin',
-                                        'GRIDMET_Precip', 'GRIDMET_RET', 'GRIDMET_vap_pres_def', 'GRIDMET_max_RH',
-                                        'GRIDMET_min_RH', 'GRIDMET_wind_vel', 'GRIDMET_short_rad', 'DAYMET_sun_hr',
-                                        'Bulk_density', 'Clay_content', 'Field_capacity', 'Sand_content',
-                                        'AWC', 'Slope', 'Latitude', 'Longitude']
-
-# exclude columns during prediction (the prediction dataframes don't have 'year' column)
-exclude_columns_in_prediction = ['Latitude', 'Longitude', 'Bulk_density', 'Clay_content',
-                                 'Slope', 'PRISM_Tmax', 'PRISM_Tmin', 'PRISM_Precip',
-                                 'GRIDMET_wind_vel', 'GRIDMET_min_RH', 'GRIDMET_vap_pres_def']
 # prediction time periods
 prediction_years = [1999, 2000, 2001, 2002, 2003, 2004, 2005, 2006, 2007, 2008, 2009, 2010,
                     2011, 2012, 2013, 2014, 2015, 2016, 2017, 2018, 2019, 2020]
@@ -94,8 +82,7 @@ if __name__ == '__main__':
     skip_plot_perm_imp = True                               ######
     skip_plot_ale = True                                    ######  Always set to True when running in Linux
     skip_plot_pdp = True                                    ######
-    skip_processing_monthly_predictor_dataframe = True      ######
-    skip_processing_nan_pos_irrig_cropET = True             ######
+    skip_compile_model = True                               ######
     skip_estimate_monthly_eff_precip_WestUS = True          ######
     skip_storing_peff_pred_monthly_csv = True               ######
     skip_sum_peff_water_year = True                         ######
@@ -114,8 +101,8 @@ if __name__ == '__main__':
                                                            static_data_path_dict=static_data_path_dict,
                                                            datasets_to_include=datasets_to_include,
                                                            output_parquet=train_test_parquet_path,
-                                                           skip_processing=skip_train_test_df_creation,
-                                                           n_partitions=5)
+                                                           incremental=True,
+                                                           skip_processing=skip_train_test_df_creation)
 
     # # train-test split
     output_dir = '../../Eff_Precip_Model_Run/monthly_model/Model_csv'
@@ -251,35 +238,26 @@ if __name__ == '__main__':
     # ************************ Generating monthly effective precip estimates for 17 states (westUS) ************************
     print('**********************************')
 
-    # # Creating monthly predictor dataframe for model prediction
-    monthly_predictor_csv_dir = '../../Eff_Precip_Model_Run/monthly_model/Model_csv/monthly_predictors'
-    create_monthly_dataframes_for_eff_precip_prediction(years_list=prediction_years,
-                                                        month_range=months,
-                                                        monthly_data_path_dict=monthly_data_path_dict,
-                                                        yearly_data_path_dict=yearly_data_path_dict,
-                                                        static_data_path_dict=static_data_path_dict,
-                                                        datasets_to_include=datasets_to_include_month_predictors,
-                                                        output_dir=monthly_predictor_csv_dir,
-                                                        skip_processing=skip_processing_monthly_predictor_dataframe)
-
-    # # Creating nan position dict for irrigated cropET (westUS)
-    irrigated_cropET_monthly_dir = '../../Data_main/Raster_data/Irrigated_cropET/WestUS_monthly'
-    output_dir_nan_pos = '../../Eff_Precip_Model_Run/monthly_model/Model_csv/nan_pos_irrigated_cropET'
-
-    create_nan_pos_dict_for_monthly_irrigated_cropET(irrigated_cropET_dir=irrigated_cropET_monthly_dir,
-                                                     output_dir=output_dir_nan_pos,
-                                                     skip_processing=skip_processing_nan_pos_irrig_cropET)
+    # # compiling the trained model (lleaves) for faster prediction. The trained model is used if lleaves isn't
+    # # installed or the compiled model's predictions don't match
+    prediction_model = compile_model(trained_model=lgbm_reg_trained, check_data=x_test,
+                                     output_dir=save_model_to_dir, model_name=f'effective_precip_{model_version}',
+                                     backend='lleaves', skip_processing=skip_compile_model)
 
-    # # Generating monthly Peff predictions for 17 states
+    # # Generating monthly Peff predictions for 17 states (directly from predictor rasters)
+    irrigated_cropET_monthly_dir = '../../Data_main/Raster_data/Irrigated_cropET/WestUS_monthly'
     effective_precip_monthly_output_dir = f'../../Data_main/Raster_data/Effective_precip_prediction_WestUS/{model_version}_monthly'
 
-    create_monthly_effective_precip_rasters(trained_model=lgbm_reg_trained, input_csv_dir=monthly_predictor_csv_dir,
-                                            exclude_columns=exclude_columns_in_prediction,
-                                            irrig_cropET_nan_pos_dir=output_dir_nan_pos,
-                                            prediction_name_keyword='effective_precip',
-                                            output_dir=effective_precip_monthly_output_dir,
-                                            ref_raster=WestUS_raster,
-                                            skip_processing=skip_estimate_monthly_eff_precip_WestUS)
+    predict_monthly_effective_precip_rasters(trained_model=prediction_model, years_list=prediction_years,
+                                             month_range=months,
+                                             monthly_data_path_dict=monthly_data_path_dict,
+                                             yearly_data_path_dict=yearly_data_path_dict,
+                                             static_data_path_dict=static_data_path_dict,
+                                             irrigated_cropET_dir=irrigated_cropET_monthly_dir,
+                                             prediction_name_keyword='effective_precip',
+                                             output_dir=effective_precip_monthly_output_dir,
+                                             ref_raster=WestUS_raster,
+                                             skip_processing=skip_estimate_monthly_eff_precip_WestUS)
 
     # # storing monthly predictions of Peff for all years_list in a dataframe
     output_csv = os.path.join(f'../../Data_main/Raster_data/Effective_precip_prediction_WestUS/{model_version}_monthly.csv')
@@ -10,9 +10,8 @@ from Codes.utils.system_ops import makedirs
 from Codes.utils.stats_ops import calculate_r2, calculate_rmse, calculate_mae
 from Codes.utils.plots import scatter_plot_of_same_vars, density_grid_plot_of_same_vars
 from Codes.utils.ml_ops import create_train_test_annual_dataframe, split_train_val_test_set, train_model, \
-    create_aleplots, create_pdplots, plot_permutation_importance
-from Codes.effective_precip.m00_eff_precip_utils import create_annual_dataframes_for_peff_frac_prediction, \
-    create_nan_pos_dict_for_annual_irrigated_cropET, create_annual_peff_fraction_rasters, \
+    create_aleplots, create_pdplots, plot_permutation_importance, compile_model
+from Codes.effective_precip.m00_eff_precip_utils import predict_annual_peff_fraction_rasters, \
     collect_Peff_predictions_in_dataframe
 
 # model resolution and reference raster/shapefile
@@ -90,19 +89,6 @@ exclude_columns_in_training = [
 train_test_years_list = [2009, 2010, 2011, 2012, 2013, 2014, 2015, 2016, 2017, 2018, 2019,
                          2020]  # training data starting from 2008 as rainfed cropET dataset starts from 2008
 
-# datasets to include in annual  dataframe for Peff fraction prediction
-datasets_to_include_annual_predictors = ['PRISM_Tmax', 'GRIDMET_Precip', 'GRIDMET_RET',
-                                         'GRIDMET_max_RH', 'GRIDMET_short_rad', 'DAYMET_sun_hr',
-                                         'TERRACLIMATE_SR', 'Runoff_precip_fraction',
-                                         'Precipitation_intensity', 'Dryness_index',
-                                         'Relative_infiltration_capacity', 'PET_P_corr',
-                                         'Bulk_density', 'Clay_content', 'Field_capacity',
-                                         'Sand_content', 'AWC', 'Slope',
-                                         'Latitude', 'Longitude']
-
-# exclude columns during prediction (the prediction dataframes don't have 'year' column)
-exclude_columns_in_prediction = exclude_columns_in_training
-
 # prediction time periods
 prediction_years = [2000, 2001, 2002, 2003, 2004, 2005, 2006, 2007, 2008, 2009, 2010,
                     2011, 2012, 2013, 2014, 2015, 2016, 2017, 2018, 2019, 2020]
@@ -118,8 +104,7 @@ if __name__ == '__main__':
     skip_plot_perm_imp = True                                  ######
     skip_plot_ale = True                                       ######  Always set to True when running in Linux
     skip_plot_pdp = True                                       ######
-    skip_processing_annual_predictor_dataframe = True          ######
-    skip_processing_nan_pos_irrig_cropET = True                ######
+    skip_compile_model = True                                  ######
     skip_estimate_water_year_peff_frac_WestUS = True           ######
     skip_storing_peff_frac_pred_annual_csv = True              ######
 
@@ -288,34 +273,25 @@ if __name__ == '__main__':
     # ****************** Generating annual effective precip fraction estimates for 17 states (westUS) ******************
     print('**********************************')
 
-    # # Creating water year predictor dataframe for model prediction
-    annual_predictor_csv_dir = '../../Eff_Precip_Model_Run/annual_model/Model_csv/annual_predictors'
-    create_annual_dataframes_for_peff_frac_prediction(years_list=prediction_years,
-                                                      yearly_data_path_dict=yearly_data_path_dict,
-                                                      static_data_path_dict=static_data_path_dict,
-                                                      datasets_to_include=datasets_to_include_annual_predictors,
-                                                      output_dir=annual_predictor_csv_dir,
-                                                      skip_processing=skip_processing_annual_predictor_dataframe)
+    # # compiling the trained model (lleaves) for faster prediction. The trained model is used if lleaves isn't
+    # # installed or the compiled model's predictions don't match
+    prediction_model = compile_model(trained_model=lgbm_reg_trained, check_data=x_test,
+                                     output_dir=save_model_to_dir, model_name=f'effective_precip_frac_{model_version}',
+                                     backend='lleaves', skip_processing=skip_compile_model)
 
-    # # Creating nan position dict for irrigated cropET (westUS)
+    # # Generating water year Peff fraction predictions (directly from predictor rasters)
     irrigated_cropET_water_year_dir = '../../Data_main/Raster_data/Irrigated_cropET/WestUS_water_year'
-    output_dir_nan_pos = '../../Eff_Precip_Model_Run/annual_model/Model_csv/nan_pos_irrigated_cropET'
-
-    create_nan_pos_dict_for_annual_irrigated_cropET(irrigated_cropET_dir=irrigated_cropET_water_year_dir,
-                                                    output_dir=output_dir_nan_pos,
-                                                    skip_processing=skip_processing_nan_pos_irrig_cropET)
-
-    # # Generating water year Peff fraction predictions
     peff_fraction_water_year_output_dir = f'../../Data_main/Raster_data/Effective_precip_fraction_WestUS/{model_version}_water_year_frac'
     lake_raster = '../../Data_main/Raster_data/HydroLakes/Lakes.tif'
 
-    create_annual_peff_fraction_rasters(trained_model=lgbm_reg_trained, input_csv_dir=annual_predictor_csv_dir,
-                                        exclude_columns=exclude_columns_in_prediction,
-                                        irrig_cropET_nan_pos_dir=output_dir_nan_pos, ref_raster=WestUS_raster,
-                                        prediction_name_keyword='peff_frac',
-                                        output_dir=peff_fraction_water_year_output_dir,
-                                        lake_raster=lake_raster,
-                                        skip_processing=skip_estimate_water_year_peff_frac_WestUS)
+    predict_annual_peff_fraction_rasters(trained_model=prediction_model, years_list=prediction_years,
+                                         yearly_data_path_dict=yearly_data_path_dict,
+                                         static_data_path_dict=static_data_path_dict,
+                                         irrigated_cropET_dir=irrigated_cropET_water_year_dir,
+                                         lake_raster=lake_raster, prediction_name_keyword='peff_frac',
+                                         output_dir=peff_fraction_water_year_output_dir,
+                                         ref_raster=WestUS_raster,
+                                         skip_processing=skip_estimate_water_year_peff_frac_WestUS)
 
     # # # Storing annual predictions of Peff for all years_list in a dataframe
     output_csv = os.path.join(
@@ -1,14 +1,15 @@
 import os
 import sys
 import numpy as np
-from glob import glob
 
 from os.path import dirname, abspath
 
 sys.path.insert(0, dirname(dirname(dirname(abspath(__file__)))))
 
 from Codes.utils.system_ops import makedirs
-from Codes.utils.raster_ops import read_raster_arr_object, write_array_to_raster
+from Codes.utils.raster_catalog import find_raster
+from Codes.utils.raster_ops import read_raster_arr_object, write_array_to_raster, get_ref_grid
+from Codes.utils.sparse_ops import get_valid_pixel_index, gather_pixels, scatter_pixels, save_pixel_vectors
 
 no_data_value = -9999
 model_res = 0.01976293625031605786  # in deg, ~2 km
@@ -19,7 +20,7 @@ GEE_merging_refraster_large_grids = '../../Data_main/reference_rasters/GEE_mergi
 
 def estimate_netGW_Irr(years_list, effective_precip_dir_pp, irrigated_cropET_dir,
                        irrigated_fraction_dir, sw_cnsmp_use_dir, output_dir,
-                       ref_raster=WestUS_raster, skip_processing=False):
+                       ref_raster=WestUS_raster, output_vector_dir=None, skip_processing=False):
     """
     Estimate growing season (annual) net groundwater irrigation (consumptive groundwater use by crops or ET_gw) for
     the Western US compiling growing season irrigated cropET, growing season effective precipitation, and growing
@@ -36,6 +37,8 @@ def estimate_netGW_Irr(years_list, effective_precip_dir_pp, irrigated_cropET_dir
                                 (source: USGS HUC12-level surface water irrigation dataset)
     :param output_dir: Output directory to save the growing season netGW datasets.
     :param ref_raster : Western US reference raster.
+    :param output_vector_dir: Directory to also save the irrigated pixels' netGW as valid-pixel vectors (.npz, see
+                              Codes.utils.sparse_ops). Default set to None to not save.
     :param skip_processing: Set to True if want to skip this step.
 
     :return: None.
@@ -43,42 +46,59 @@ def estimate_netGW_Irr(years_list, effective_precip_dir_pp, irrigated_cropET_dir
     if not skip_processing:
         makedirs([output_dir])
 
-        ref_arr, ref_file = read_raster_arr_object(ref_raster)
+        ref_file = get_ref_grid(ref_raster)
         for year in years_list:
             print(f'Estimating growing season netGW for {year}...')
 
             # loading effective precipitation, irrigated cropET, irrigated fraction,
             # and surface water irrigation datasets
-            eff_precip = glob(os.path.join(effective_precip_dir_pp, f'*{year}*.tif'))[0]
-            irrigated_cropET = glob(os.path.join(irrigated_cropET_dir, f'*{year}*.tif'))[0]
-            irrigated_fraction = glob(os.path.join(irrigated_fraction_dir, f'*{year}*.tif'))[0]
-            sw_cnsmp_data = glob(os.path.join(sw_cnsmp_use_dir, f'*{year}*.tif'))[0]
+            eff_precip = find_raster(effective_precip_dir_pp, year=year)
+            irrigated_cropET = find_raster(irrigated_cropET_dir, year=year)
+            irrigated_fraction = find_raster(irrigated_fraction_dir, year=year)
+            sw_cnsmp_data = find_raster(sw_cnsmp_use_dir, year=year)
 
+            irrigated_frac_arr = read_raster_arr_object(irrigated_fraction, get_file=False)
             eff_precip_arr = read_raster_arr_object(eff_precip, get_file=False)
             irrigated_cropET_arr = read_raster_arr_object(irrigated_cropET, get_file=False)
-            irrigated_frac_arr = read_raster_arr_object(irrigated_fraction, get_file=False)
             sw_cnsmp_use_arr = read_raster_arr_object(sw_cnsmp_data, get_file=False)
 
+            # the computation is done only for the irrigated pixels (irrigated fraction > 0) where all datasets are
+            # available, as 1-D vectors. all other pixels end up as 0 (inside Western US) or no data
+            irrig_pixel_idx = get_valid_pixel_index(eff_precip_arr, irrigated_cropET_arr, sw_cnsmp_use_arr,
+                                                    irrigated_frac_arr,
+                                                    mask=np.nan_to_num(irrigated_frac_arr) > 0)
+
+            eff_precip_vec = gather_pixels(eff_precip_arr, irrig_pixel_idx)
+            irrigated_cropET_vec = gather_pixels(irrigated_cropET_arr, irrig_pixel_idx)
+            irrigated_frac_vec = gather_pixels(irrigated_frac_arr, irrig_pixel_idx)
+            sw_cnsmp_use_vec = gather_pixels(sw_cnsmp_use_arr, irrig_pixel_idx)
+
             # # estimating growing season net ET (SW and GW) irrigation
-            net_et_irrig = np.where(~np.isnan(eff_precip_arr), irrigated_cropET_arr - eff_precip_arr, -9999)
+            net_et_irrig = irrigated_cropET_vec - eff_precip_vec
 
             # the processed net ET irrigation estimates are averaged over only irrigated areas in a pixel.
             # before subtracting sw irrigation from this value to get netGW_irrig, the net_et_irrig need to be area
             # averaged for 2km pixel. This will lead to area-averaged netGW estimate which can be compared to area-averaged pumping.
             # multiplying with irrigated fraction will give the 2km pixel averaged net et irrigation estimates
-            net_et_irrig_aa = np.where(~np.isnan(net_et_irrig), net_et_irrig * irrigated_frac_arr, -9999)
+            net_et_irrig_aa = net_et_irrig * irrigated_frac_vec
 
             # netGW estimation
             # netGW over irrigated cropland = irrigated cropET - effective precipitation - surface water irrigation
-            net_gw_irrig = np.where(~np.isnan(net_et_irrig_aa), net_et_irrig_aa - sw_cnsmp_use_arr, -9999)
+            net_gw_irrig_vec = net_et_irrig_aa - sw_cnsmp_use_vec
 
             # in case net GW is < 0 (surface water irrigation or effective precipitation is higher than
-            # irrigated cropET), netGW is assigned to 0
-            net_gw_irrig = np.where(net_gw_irrig >= 0, net_gw_irrig, -9999)
-
-            # assigning 0 to all non-irrigated pixels inside the landmass of the Western US
-            # using reference raster
-            net_gw_irrig = np.where((net_gw_irrig == -9999) & (ref_arr == 0), 0, net_gw_irrig)
+            # irrigated cropET), the pixel is dropped and gets netGW = 0 (inside the Western US) from the background
+            positive_netGW = net_gw_irrig_vec >= 0
+            irrig_pixel_idx, net_gw_irrig_vec = irrig_pixel_idx[positive_netGW], net_gw_irrig_vec[positive_netGW]
+
+            # assigning 0 to all non-irrigated pixels inside the landmass of the Western US (using reference raster)
+            # and scattering irrigated pixels' netGW to the grid
+            net_gw_irrig = np.where(ref_file.arr == 0, 0, -9999).astype(np.float32)
+            net_gw_irrig = scatter_pixels(net_gw_irrig_vec, irrig_pixel_idx, ref_file.shape, out=net_gw_irrig)
+
+            if output_vector_dir is not None:
+                save_pixel_vectors(os.path.join(output_vector_dir, f'netGW_Irr_{year}.npz'), irrig_pixel_idx,
+                                   ref_file.shape, netGW_Irr=net_gw_irrig_vec)
 
             output_raster = os.path.join(output_dir, f'netGW_Irr_{year}.tif')
             write_array_to_raster(net_gw_irrig, ref_file, ref_file.transform, output_raster)
@@ -6,10 +6,12 @@ from osgeo import gdal
 import geopandas as gpd
 
 from Codes.utils.system_ops import makedirs
+from Codes.utils.raster_catalog import find_raster
 from Codes.utils.vector_ops import clip_vector
+from Codes.utils.basin_ops import clip_raster_to_basin
 from Codes.utils.ml_ops import create_train_test_monthly_dataframe
 from Codes.utils.raster_ops import read_raster_arr_object, write_array_to_raster, shapefile_to_raster, \
-    clip_resample_reproject_raster, make_lat_lon_array_from_raster
+    clip_resample_reproject_raster, get_lon_lat_grid, get_ref_grid
 
 no_data_value = -9999
 model_res = 0.01976293625031605786  # in deg, ~2 km
@@ -40,30 +42,20 @@ def clip_netGW_Irr_frac_for_basin(years, basin_shp, netGW_input_dir, basin_netGW
         print(f'Clipping growing season netGW for {year}...')
 
         # netGW
-        netGW_raster = glob(os.path.join(netGW_input_dir, f'*{year}*.tif'))[0]
+        netGW_raster = find_raster(netGW_input_dir, year=year)
 
-        clip_resample_reproject_raster(input_raster=netGW_raster, input_shape=basin_shp,
-                                       output_raster_dir=basin_netGW_output_dir,
-                                       keyword=' ', raster_name=f'netGW_Irr_{year}.tif',
-                                       clip=True, resample=False, clip_and_resample=False,
-                                       targetaligned=True, resample_algorithm='near',
-                                       resolution=resolution,
-                                       crs='EPSG:4269', output_datatype=gdal.GDT_Float32,
-                                       use_ref_width_height=False)
+        clip_raster_to_basin(input_raster=netGW_raster, basin_shp=basin_shp,
+                             output_raster=os.path.join(basin_netGW_output_dir, f'netGW_Irr_{year}.tif'),
+                             resolution=resolution)
 
         if irr_frac_input_dir is not None:
             print(f'Clipping irrigated fraction for {year}...')
             # irrigation fraction
-            irr_frac_raster = glob(os.path.join(irr_frac_input_dir, f'*{year}*.tif'))[0]
+            irr_frac_raster = find_raster(irr_frac_input_dir, year=year)
 
-            clip_resample_reproject_raster(input_raster=irr_frac_raster, input_shape=basin_shp,
-                                           output_raster_dir=basin_irr_frac_output_dir,
-                                           keyword=' ', raster_name=f'Irr_frac_{year}.tif',
-                                           clip=True, resample=False, clip_and_resample=False,
-                                           targetaligned=True, resample_algorithm='near',
-                                           resolution=resolution,
-                                           crs='EPSG:4269', output_datatype=gdal.GDT_Float32,
-                                           use_ref_width_height=False)
+            clip_raster_to_basin(input_raster=irr_frac_raster, basin_shp=basin_shp,
+                                 output_raster=os.path.join(basin_irr_frac_output_dir, f'Irr_frac_{year}.tif'),
+                                 resolution=resolution)
 
 
 def pumping_AF_pts_to_raster(years, pumping_pts_shp, pumping_attr_AF,
@@ -131,25 +123,15 @@ def pumping_AF_pts_to_raster(years, pumping_pts_shp, pumping_attr_AF,
         pumping_mm_raster = os.path.join(interim_pumping_mm_dir, '', f'pumping_{year}_mm.tif')
         write_array_to_raster(pumping_mm_arr, file, file.transform, pumping_mm_raster)
 
-        # # clipping data only to required basin
+        # # clipping data only to required basin (using the cached basin window and mask)
         # pumping AF data
-        clip_resample_reproject_raster(input_raster=pumping_AF_raster,
-                                       input_shape=basin_shp, output_raster_dir=pumping_AF_dir,
-                                       keyword=' ', raster_name=output_AF_raster,
-                                       clip=True, resample=False, clip_and_resample=False,
-                                       targetaligned=True, resample_algorithm='near',
-                                       resolution=model_res,
-                                       crs='EPSG:4269', output_datatype=gdal.GDT_Float32,
-                                       use_ref_width_height=False)
+        clip_raster_to_basin(input_raster=pumping_AF_raster, basin_shp=basin_shp,
+                             output_raster=os.path.join(pumping_AF_dir, output_AF_raster), ref_raster=ref_raster,
+                             resolution=resolution)
         # pumping mm data
-        clip_resample_reproject_raster(input_raster=pumping_mm_raster,
-                                       input_shape=basin_shp, output_raster_dir=pumping_mm_dir,
-                                       keyword=' ', raster_name=pumping_raster_name,
-                                       clip=True, resample=False, clip_and_resample=False,
-                                       targetaligned=True, resample_algorithm='near',
-                                       resolution=model_res,
-                                       crs='EPSG:4269', output_datatype=gdal.GDT_Float32,
-                                       use_ref_width_height=False)
+        clip_raster_to_basin(input_raster=pumping_mm_raster, basin_shp=basin_shp,
+                             output_raster=os.path.join(pumping_mm_dir, pumping_raster_name), ref_raster=ref_raster,
+                             resolution=resolution)
 
     return pumping_AF_dir, pumping_mm_dir
 
@@ -175,40 +157,42 @@ def compile_pixelwise_basin_df_for_netGW_pumping(years, basin_netGW_dir, output_
 
     print(f'Compiling growing season netGW vs pumping dataframe...')
 
-    # empty dictionary with to store data
+    # empty dictionary with to store data (a list of arrays, one for each year)
     extract_dict = {'year': [], 'netGW_mm': [], 'pumping_mm': [], 'pumping_AF': [],
                     'lat': [], 'lon': []}
 
     # lopping through each year and storing data in a list
     for year in years:
-        netGW_data = glob(os.path.join(basin_netGW_dir, f'*{year}*.tif'))[0]
-        netGW_arr = read_raster_arr_object(netGW_data, get_file=False).flatten()
-
-        lon_arr, lat_arr = make_lat_lon_array_from_raster(netGW_data)
-        lon_arr = lon_arr.flatten()
-        lat_arr = lat_arr.flatten()
+        netGW_data = find_raster(basin_netGW_dir, year=year)
+        netGW_arr, netGW_file = read_raster_arr_object(netGW_data)
 
-        year_list = [year] * len(netGW_arr)
+        # lon, lat from the (cached) grid coordinates. no_data_value (-9999) is assigned to nodata pixels
+        lon_grid, lat_grid = get_lon_lat_grid(netGW_file.transform, netGW_arr.shape)
+        netGW_nan_mask = np.isnan(netGW_arr)
+        lon_arr = np.where(netGW_nan_mask, no_data_value, lon_grid).ravel()
+        lat_arr = np.where(netGW_nan_mask, no_data_value, lat_grid).ravel()
+        netGW_arr = netGW_arr.ravel()
 
-        extract_dict['year'].extend(year_list)
-        extract_dict['netGW_mm'].extend(list(netGW_arr))
-        extract_dict['lon'].extend(list(lon_arr))
-        extract_dict['lat'].extend(list(lat_arr))
+        extract_dict['year'].append(np.full(len(netGW_arr), year))
+        extract_dict['netGW_mm'].append(netGW_arr)
+        extract_dict['lon'].append(lon_arr)
+        extract_dict['lat'].append(lat_arr)
 
         if basin_pumping_AF_dir and basin_pumping_mm_dir:     # reading pumping data if directories are provided
-            pumping_mm_data = glob(os.path.join(basin_pumping_mm_dir, f'*{year}*.tif'))[0]
-            pumping_AF_data = glob(os.path.join(basin_pumping_AF_dir, f'*{year}*.tif'))[0]
+            pumping_mm_data = find_raster(basin_pumping_mm_dir, year=year)
+            pumping_AF_data = find_raster(basin_pumping_AF_dir, year=year)
 
-            pump_mm_arr = read_raster_arr_object(pumping_mm_data, get_file=False).flatten()
-            pump_AF_arr = read_raster_arr_object(pumping_AF_data, get_file=False).flatten()
+            pump_mm_arr = read_raster_arr_object(pumping_mm_data, get_file=False).ravel()
+            pump_AF_arr = read_raster_arr_object(pumping_AF_data, get_file=False).ravel()
 
-            extract_dict['pumping_mm'].extend(list(pump_mm_arr))
-            extract_dict['pumping_AF'].extend(list(pump_AF_arr))
+            extract_dict['pumping_mm'].append(pump_mm_arr)
+            extract_dict['pumping_AF'].append(pump_AF_arr)
 
         else:
-            extract_dict['pumping_mm'].extend([None] * len(netGW_arr))
-            extract_dict['pumping_AF'].extend([None] * len(netGW_arr))
+            extract_dict['pumping_mm'].append(np.full(len(netGW_arr), np.nan))
+            extract_dict['pumping_AF'].append(np.full(len(netGW_arr), np.nan))
 
+    extract_dict = {key: np.concatenate(arrs) for key, arrs in extract_dict.items()}
 
     # converting dictionary to dataframe and saving to csv
     df = pd.DataFrame(extract_dict)
@@ -244,7 +228,7 @@ def compile_pixelwise_netGW_to_annual_df(years, basin_netGW_dir, output_csv):
 
     # lopping through each year and storing data in a list
     for year in years:
-        netGW_data = glob(os.path.join(basin_netGW_dir, f'*{year}*.tif'))[0]
+        netGW_data = find_raster(basin_netGW_dir, year=year)
         netGW_arr = read_raster_arr_object(netGW_data, get_file=False).flatten()
 
         year_list = [year] * len(netGW_arr)
@@ -448,7 +432,7 @@ def aggregate_netGW_insitu_usgs_pumping_to_annualCSV_NV_UT(years, basin_netGW_di
 
     # lopping through each year and storing data in a list
     for year in years:
-        netGW_data = glob(os.path.join(basin_netGW_dir, f'*{year}*.tif'))[0]
+        netGW_data = find_raster(basin_netGW_dir, year=year)
 
         netGW_arr = read_raster_arr_object(netGW_data, get_file=False).flatten()
         year_list = [year] * len(netGW_arr)
@@ -968,7 +952,7 @@ def extract_pumping_estimate_with_lat_lon(years, input_csv, input_data_dir, resa
     makedirs([resampled_output_dir])
     # looping through each year and extracting values in each coordinate
     for year in years:
-        pumping_data = glob(os.path.join(input_data_dir, f'*{year}*.tif'))[0]
+        pumping_data = find_raster(input_data_dir, year=year)
         raster_name = os.path.basename(pumping_data)
 
         # resampling pumping data as it might be only for a region, but to extract data it need to be of
@@ -1026,28 +1010,20 @@ def process_and_aggregate_irrigated_acres(years, irr_cropland_input_dir, irr_fra
         print(f'Clipping irrigated cropland and fraction data for {year}...')
 
         # irrigation fraction
-        irr_frac_raster = glob(os.path.join(irr_frac_input_dir, f'*{year}*.tif'))[0]
+        irr_frac_raster = find_raster(irr_frac_input_dir, year=year)
 
-        basin_irr_frac_data = clip_resample_reproject_raster(input_raster=irr_frac_raster, input_shape=basin_shp,
-                                                             output_raster_dir=basin_irr_frac_output_dir,
-                                                             keyword=' ', raster_name=f'Irr_frac_{year}.tif',
-                                                             clip=True, resample=False, clip_and_resample=False,
-                                                             targetaligned=True, resample_algorithm='near',
-                                                             resolution=resolution,
-                                                             crs='EPSG:4269', output_datatype=gdal.GDT_Float32,
-                                                             use_ref_width_height=False)
+        basin_irr_frac_data = clip_raster_to_basin(input_raster=irr_frac_raster, basin_shp=basin_shp,
+                                                   output_raster=os.path.join(basin_irr_frac_output_dir,
+                                                                              f'Irr_frac_{year}.tif'),
+                                                   resolution=resolution)
 
         # irrigation cropland
-        irr_crop_raster = glob(os.path.join(irr_cropland_input_dir, f'*{year}*.tif'))[0]
+        irr_crop_raster = find_raster(irr_cropland_input_dir, year=year)
 
-        basin_irr_cropland_data = clip_resample_reproject_raster(input_raster=irr_crop_raster, input_shape=basin_shp,
-                                                                 output_raster_dir=basin_irr_cropland_output_dir,
-                                                                 keyword=' ', raster_name=f'Irr_cropland_{year}.tif',
-                                                                 clip=True, resample=False, clip_and_resample=False,
-                                                                 targetaligned=True, resample_algorithm='near',
-                                                                 resolution=resolution,
-                                                                 crs='EPSG:4269', output_datatype=gdal.GDT_Float32,
-                                                                 use_ref_width_height=False)
+        basin_irr_cropland_data = clip_raster_to_basin(input_raster=irr_crop_raster, basin_shp=basin_shp,
+                                                       output_raster=os.path.join(basin_irr_cropland_output_dir,
+                                                                                  f'Irr_cropland_{year}.tif'),
+                                                       resolution=resolution)
 
         # calculating irrigated area
         irr_frac_arr, file = read_raster_arr_object(basin_irr_frac_data)
@@ -1190,6 +1166,10 @@ def compile_annual_irr_rainfed_ET(years, area_code, area_shape, area_ref_raster,
         makedirs([USDA_CDL_output_dir, irrigated_cropland_output_dir, rainfed_cropland_output_dir,
                   irrigated_cropET_output_dir, rainfed_cropET_output_dir])
 
+        # reference raster of the area (read once, shared by all clipped datasets)
+        ref_file = get_ref_grid(area_ref_raster)
+        ref_arr = ref_file.arr
+
         # clipping + resampling of cdl data
         cdl_datasets = glob(os.path.join(cdl_input_dir, '*.tif'))
 
@@ -1212,7 +1192,6 @@ def compile_annual_irr_rainfed_ET(years, area_code, area_shape, area_ref_raster,
                                                                 resolution=resolution, ref_raster=area_ref_raster)
 
                 # replacing nan values where reference raster is zero with zero
-                ref_arr, ref_file = read_raster_arr_object(area_ref_raster)
                 clipped_arr = read_raster_arr_object(clipped_raster, get_file=False)
 
                 clipped_arr = np.where(np.isnan(clipped_arr) & (ref_arr == 0), ref_arr, clipped_arr)
@@ -1233,7 +1212,6 @@ def compile_annual_irr_rainfed_ET(years, area_code, area_shape, area_ref_raster,
                                                                 resolution=resolution, ref_raster=area_ref_raster)
 
                 # replacing nan values where reference raster is zero with zero
-                ref_arr, ref_file = read_raster_arr_object(area_ref_raster)
                 clipped_arr = read_raster_arr_object(clipped_raster, get_file=False)
 
                 clipped_arr = np.where(np.isnan(clipped_arr) & (ref_arr == 0), ref_arr, clipped_arr)
@@ -1253,7 +1231,6 @@ def compile_annual_irr_rainfed_ET(years, area_code, area_shape, area_ref_raster,
                                                             resolution=resolution, ref_raster=area_ref_raster)
 
             # replacing nan values where reference raster is zero with zero
-            ref_arr, ref_file = read_raster_arr_object(area_ref_raster)
             clipped_arr = read_raster_arr_object(clipped_raster, get_file=False)
 
             clipped_arr = np.where(np.isnan(clipped_arr) & (ref_arr == 0), ref_arr, clipped_arr)
@@ -1272,7 +1249,6 @@ def compile_annual_irr_rainfed_ET(years, area_code, area_shape, area_ref_raster,
                                                             resolution=resolution, ref_raster=area_ref_raster)
 
             # replacing nan values where reference raster is zero with zero
-            ref_arr, ref_file = read_raster_arr_object(area_ref_raster)
             clipped_arr = read_raster_arr_object(clipped_raster, get_file=False)
 
             clipped_arr = np.where(np.isnan(clipped_arr) & (ref_arr == 0), ref_arr, clipped_arr)
@@ -1325,16 +1301,12 @@ def clip_Peff_for_basin(years, basin_shp, Peff_input_dir, basin_Peff_output_dir,
         if month_range is None:
             print(f'Clipping effective precipitation for {year}...')
 
-            peff_raster = glob(os.path.join(Peff_input_dir, f'*{year}*.tif'))[0]
+            peff_raster = find_raster(Peff_input_dir, year=year)
 
-            clip_resample_reproject_raster(input_raster=peff_raster, input_shape=basin_shp,
-                                           output_raster_dir=basin_Peff_output_dir,
-                                           keyword=basin_code, raster_name=None,
-                                           clip=True, resample=False, clip_and_resample=False,
-                                           targetaligned=True, resample_algorithm='near',
-                                           resolution=resolution,
-                                           crs='EPSG:4269', output_datatype=gdal.GDT_Float32,
-                                           use_ref_width_height=False)
+            clip_raster_to_basin(input_raster=peff_raster, basin_shp=basin_shp,
+                                 output_raster=os.path.join(basin_Peff_output_dir,
+                                                            f'{basin_code}_{os.path.basename(peff_raster)}'),
+                                 resolution=resolution)
 
         else:  # for monthly effective precipitation estimates
             months = list(range(month_range[0], month_range[1] + 1))
@@ -1342,16 +1314,11 @@ def clip_Peff_for_basin(years, basin_shp, Peff_input_dir, basin_Peff_output_dir,
             for month in months:
                 print(f'Clipping effective precipitation for {year=}, {month=} ...')
 
-                peff_raster = glob(os.path.join(Peff_input_dir, f'*{year}_{month}*.tif'))[0]
+                peff_raster = find_raster(Peff_input_dir, year=year, month=month)
 
-                clip_resample_reproject_raster(input_raster=peff_raster, input_shape=basin_shp,
-                                               output_raster_dir=basin_Peff_output_dir,
-                                               keyword=' ', raster_name=None,
-                                               clip=True, resample=False, clip_and_resample=False,
-                                               targetaligned=True, resample_algorithm='near',
-                                               resolution=resolution,
-                                               crs='EPSG:4269', output_datatype=gdal.GDT_Float32,
-                                               use_ref_width_height=False)
+                clip_raster_to_basin(input_raster=peff_raster, basin_shp=basin_shp,
+                                     output_raster=os.path.join(basin_Peff_output_dir, os.path.basename(peff_raster)),
+                                     resolution=resolution)
 
 
 def clip_precip_for_basin(years, basin_shp, precip_input_dir, basin_precip_output_dir,
@@ -1376,32 +1343,23 @@ def clip_precip_for_basin(years, basin_shp, precip_input_dir, basin_precip_outpu
         if month_range is None:
             print(f'Clipping water year precipitation for {year}...')
 
-            precip_raster = glob(os.path.join(precip_input_dir, f'*{year}*.tif'))[0]
+            precip_raster = find_raster(precip_input_dir, year=year)
 
-            clip_resample_reproject_raster(input_raster=precip_raster, input_shape=basin_shp,
-                                           output_raster_dir=basin_precip_output_dir,
-                                           keyword=basin_code, raster_name=None,
-                                           clip=True, resample=False, clip_and_resample=False,
-                                           targetaligned=True, resample_algorithm='near',
-                                           resolution=resolution,
-                                           crs='EPSG:4269', output_datatype=gdal.GDT_Float32,
-                                           use_ref_width_height=False)
+            clip_raster_to_basin(input_raster=precip_raster, basin_shp=basin_shp,
+                                 output_raster=os.path.join(basin_precip_output_dir,
+                                                            f'{basin_code}_{os.path.basename(precip_raster)}'),
+                                 resolution=resolution)
         else:  # for monthly precipitation estimates
             months = list(range(month_range[0], month_range[1] + 1))
 
             for month in months:
                 print(f'Clipping monthly precipitation for {year=}, {month=} ...')
 
-                precip_raster = glob(os.path.join(precip_input_dir, f'*{year}_{month}*.tif'))[0]
+                precip_raster = find_raster(precip_input_dir, year=year, month=month)
 
-                clip_resample_reproject_raster(input_raster=precip_raster, input_shape=basin_shp,
-                                               output_raster_dir=basin_precip_output_dir,
-                                               keyword=' ', raster_name=None,
-                                               clip=True, resample=False, clip_and_resample=False,
-                                               targetaligned=True, resample_algorithm='near',
-                                               resolution=resolution,
-                                               crs='EPSG:4269', output_datatype=gdal.GDT_Float32,
-                                               use_ref_width_height=False)
+                clip_raster_to_basin(input_raster=precip_raster, basin_shp=basin_shp,
+                                     output_raster=os.path.join(basin_precip_output_dir, os.path.basename(precip_raster)),
+                                     resolution=resolution)
 
 
 def compile_basin_growS_peff_water_yr_precip_to_csv(years, basin_peff_dir, basin_water_yr_precip_dir,
@@ -1433,8 +1391,8 @@ def compile_basin_growS_peff_water_yr_precip_to_csv(years, basin_peff_dir, basin
 
     # lopping through each year and storing data in a list
     for year in years:
-        peff_data = glob(os.path.join(basin_peff_dir, f'*{year}*.tif'))[0]
-        precip_data = glob(os.path.join(basin_water_yr_precip_dir, f'*{year}*.tif'))[0]
+        peff_data = find_raster(basin_peff_dir, year=year)
+        precip_data = find_raster(basin_water_yr_precip_dir, year=year)
 
         peff_arr = read_raster_arr_object(peff_data, get_file=False).flatten()
         precip_arr = read_raster_arr_object(precip_data, get_file=False).flatten()
@@ -1510,7 +1468,7 @@ def compile_basin_monthly_peff_to_csv(years, month_range, basin_peff_dir, basin_
         months = list(range(month_range[0], month_range[1]+1))
 
         for month in months:
-            peff_data = glob(os.path.join(basin_peff_dir, f'*{year}_{month}*.tif'))[0]
+            peff_data = find_raster(basin_peff_dir, year=year, month=month)
 
             peff_arr = read_raster_arr_object(peff_data, get_file=False).flatten()
 
@@ -1569,7 +1527,7 @@ def compile_basin_monthly_precip_mv_avg_to_csv(years, month_range, basin_precip_
         months = list(range(month_range[0], month_range[1] + 1))
 
         for month in months:
-            precip_data = glob(os.path.join(basin_precip_dir, f'*{year}_{month}*.tif'))[0]
+            precip_data = find_raster(basin_precip_dir, year=year, month=month)
 
             precip_arr = read_raster_arr_object(precip_data, get_file=False).flatten()
 
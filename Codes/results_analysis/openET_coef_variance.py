@@ -3,7 +3,7 @@ import numpy as np
 from glob import glob
 
 from Codes.utils.system_ops import makedirs
-from Codes.utils.raster_ops import read_raster_arr_object, write_array_to_raster
+from Codes.utils.raster_ops import write_raster_by_blocks
 
 
 def coef_var_openET_models(years, model_dir_dict, netGW_dir, stdv_output_dir):
@@ -19,45 +19,38 @@ def coef_var_openET_models(years, model_dir_dict, netGW_dir, stdv_output_dir):
         sims_data = glob(os.path.join(model_dir_dict['SIMS'], f'*{year}*'))[0]
         disalexi_data = glob(os.path.join(model_dir_dict['DISALEXI'], f'*{year}*'))[0]
 
-        # reading each model's data
-        ssebop_arr = read_raster_arr_object(ssebop_data, get_file=False)
-        eemetric_arr = read_raster_arr_object(eemetric_data, get_file=False)
-        geesebal_arr = read_raster_arr_object(geesebal_data, get_file=False)
-        ptjpl_arr = read_raster_arr_object(ptjpl_data, get_file=False)
-        sims_arr = read_raster_arr_object(sims_data, get_file=False)
-        disalexi_arr = read_raster_arr_object(disalexi_data, get_file=False)
+        # reading netGW data. will be used as filter
+        netGW_data = glob(os.path.join(netGW_dir, f'*{year}*'))[0]
 
-        # estimating standard deviation of the models at annual scale
-        stacked_arrays = np.stack([ssebop_arr, eemetric_arr, geesebal_arr,
-                                   ptjpl_arr, sims_arr, disalexi_arr], axis=0)
-        stdv_per_element = np.std(stacked_arrays, axis=0)
+        def openET_stats_block(block_arrs):
+            # estimating standard deviation of the models at annual scale
+            stacked_arrays = np.stack(block_arrs[:6], axis=0)
+            stdv_per_element = np.std(stacked_arrays, axis=0)
 
-        # estimating annual mean
-        mean_per_element = np.mean(stacked_arrays, axis=0)
+            # estimating annual mean
+            mean_per_element = np.mean(stacked_arrays, axis=0)
 
-        # reading netGW data. will be used as filter
-        netGW_data = glob(os.path.join(netGW_dir, f'*{year}*'))[0]
-        netGW_arr, file = read_raster_arr_object(netGW_data)
+            # forcing nan values (-9999) with netGW array. In netGW array, nan values has been replaced with zero.
+            netGW_arr = block_arrs[6]
+            stdv_per_element[netGW_arr == 0] = -9999
+            mean_per_element[netGW_arr == 0] = -9999
 
-        # forcing nan values (-9999) with netGW array. In netGW array, nan values has been replaced with zero.
-        stdv_per_element[netGW_arr == 0] = -9999
-        mean_per_element[netGW_arr == 0] = -9999
+            # calculating coef. of variation
+            coef_variation_arr = np.where((stdv_per_element != -9999) & (mean_per_element != -9999),
+                                          stdv_per_element /mean_per_element, -9999)
 
-        # saving stdv and mean for each year
-        stdv_raster = os.path.join(stdv_output_dir, f'openET_stdv_{year}.tif')
-        write_array_to_raster(raster_arr=stdv_per_element, raster_file=file, transform=file.transform,
-                              output_path=stdv_raster)
+            return [stdv_per_element, mean_per_element, coef_variation_arr]
 
+        # estimating and saving stdv, mean, and coef. of variation for each year (block by block, so that only a
+        # block of the model datasets is in memory at a time)
+        stdv_raster = os.path.join(stdv_output_dir, f'openET_stdv_{year}.tif')
         mean_raster = os.path.join(stdv_output_dir, f'openET_mean_{year}.tif')
-        write_array_to_raster(raster_arr=mean_per_element, raster_file=file, transform=file.transform,
-                              output_path=mean_raster)
-
-        # calculating coef. of variation
-        coef_variation_arr = np.where((stdv_per_element != -9999) & (mean_per_element != -9999),
-                                      stdv_per_element /mean_per_element, -9999)
         coef_var_raster = os.path.join(stdv_output_dir, f'openET_coef_var_{year}.tif')
-        write_array_to_raster(raster_arr=coef_variation_arr, raster_file=file, transform=file.transform,
-                              output_path=coef_var_raster)
+
+        write_raster_by_blocks(input_rasters=[ssebop_data, eemetric_data, geesebal_data, ptjpl_data,
+                                              sims_data, disalexi_data, netGW_data],
+                               output_rasters=[stdv_raster, mean_raster, coef_var_raster],
+                               block_function=openET_stats_block)
 
 
 if __name__ == '__main__':
@@ -10,7 +10,10 @@ from os.path import dirname, abspath
 sys.path.insert(0, dirname(dirname(dirname(abspath(__file__)))))
 
 from Codes.utils.system_ops import makedirs, copy_file
-from Codes.utils.raster_ops import read_raster_arr_object, write_array_to_raster, shapefile_to_raster
+from Codes.utils.raster_catalog import find_raster
+from Codes.utils.raster_ops import read_raster_arr_object, write_array_to_raster, shapefile_to_raster, get_ref_grid, \
+    read_compact_raster_arr, write_compact_raster
+from Codes.utils.sparse_ops import get_valid_pixel_index, gather_pixels, scatter_pixels
 
 no_data_value = -9999
 model_res = 0.01976293625031605786  # in deg, ~2 km
@@ -45,7 +48,7 @@ def create_canal_coverage_raster(years_list, canal_shapefile, irrig_cropET_grow_
         canal_raster = shapefile_to_raster(input_shape=canal_shapefile, output_dir=canal_coverage_output_dir,
                                            raster_name='canal_coverage.tif', burnvalue=1, use_attr=False, add=None,
                                            ref_raster=ref_raster, resolution=resolution, alltouched=True)
-        canal_arr = read_raster_arr_object(canal_raster, get_file=None)
+        canal_arr = read_compact_raster_arr(canal_raster)
 
         # now we will loop over irrigated cropET for each growing season and only assign canal
         # coverage to pixels that have some values of irrigated cropET.
@@ -60,8 +63,8 @@ def create_canal_coverage_raster(years_list, canal_shapefile, irrig_cropET_grow_
             canal_coverage_arr = np.where((canal_arr == 1) & (~np.isnan(irrig_cropET_arr)), 1, -9999)
 
             output_raster = os.path.join(canal_coverage_output_dir, f'canal_coverage_{year}.tif')
-            write_array_to_raster(raster_arr=canal_coverage_arr, raster_file=file, transform=file.transform,
-                                  output_path=output_raster)
+            write_compact_raster(raster_arr=canal_coverage_arr, raster_file=file, transform=file.transform,
+                                 output_path=output_raster)  # uint8, 255 as nodata
 
             # irrigated cropET overlaid on canal coverage raster
             cropET_canal_cover_arr = np.where((canal_arr == 1) & (~np.isnan(irrig_cropET_arr)), irrig_cropET_arr, -9999)
@@ -144,10 +147,29 @@ def estimate_sw_mm_HUC12(years_list, HUC12_input_shapefile, irrigated_CropET_wit
         pass
 
 
+def _sw_cnsmp_use_dense(sw_irrig_arr, irr_eff_arr, irrig_cropET_arr, total_irrig_cropET_arr):
+    """
+    Distribute HUC12 level surface water consumptive use to pixels over the full grid (reference for the valid-pixel
+    distribution in distribute_SW_consmp_use_to_pixels()).
+
+    :param sw_irrig_arr: HUC12 total sw irrigation array.
+    :param irr_eff_arr: HUC12 irrigation efficiency array.
+    :param irrig_cropET_arr: Irrigated cropET array.
+    :param total_irrig_cropET_arr: HUC12 total irrigated cropET array.
+
+    :return: Float32 sw consumptive use array. -9999 where sw irrigation, irrigated cropET and HUC12 total irrigated
+             cropET are all 0.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where((sw_irrig_arr != 0) | (irrig_cropET_arr != 0) | (total_irrig_cropET_arr != 0),
+                        sw_irrig_arr * irr_eff_arr * (irrig_cropET_arr / total_irrig_cropET_arr),
+                        -9999).astype(np.float32)
+
+
 def distribute_SW_consmp_use_to_pixels(years_list, HUC12_shapefile, HUC12_Irr_eff_shapefile,
                                        irrigated_CropET_growing_season,
                                        sw_dist_outdir, ref_raster=WestUS_raster,
-                                       resolution=model_res, skip_processing=False):
+                                       resolution=model_res, check_dense=False, skip_processing=False):
     """
     Distribute HUC12 level surface water consumptive use (unit mm/growing season) to irrigated pixels that have
     canal coverage (within 2 km buffer of canal).
@@ -161,6 +183,8 @@ def distribute_SW_consmp_use_to_pixels(years_list, HUC12_shapefile, HUC12_Irr_ef
     :param sw_dist_outdir: Output directory to save sw distributed rasters.
     :param ref_raster: Filepath of Western US reference raster.
     :param resolution: Model resolution.
+    :param check_dense: Set to True to check the (valid-pixel) distribution against the full grid computation.
+                        Default set to False.
     :param skip_processing: Set to True to skip this step.
 
     :return: None.
@@ -177,13 +201,14 @@ def distribute_SW_consmp_use_to_pixels(years_list, HUC12_shapefile, HUC12_Irr_ef
         huc12_gdf.to_file(HUC12_processed)
 
         # reference raster
-        ref_arr, ref_file = read_raster_arr_object(ref_raster)
+        ref_file = get_ref_grid(ref_raster)
+        ref_arr = ref_file.arr
 
         for year in years_list:
             print(f'distributing surface water irrigation to pixels for {year}...')
 
             # getting growing season irrigated cropET raster
-            irrig_cropET_Huc12_tot = glob(os.path.join(irrigated_CropET_growing_season, f'*{year}*.tif'))[0]
+            irrig_cropET_Huc12_tot = find_raster(irrigated_CropET_growing_season, year=year)
 
             # converting total irrigated cropET of HUC12 to raster (HUC12 sum)
             total_irrig_cropET_ras = f'total_irrig_cropET_{year}.tif'
@@ -218,11 +243,33 @@ def distribute_SW_consmp_use_to_pixels(years_list, HUC12_shapefile, HUC12_Irr_ef
             total_irrig_cropET_arr = read_raster_arr_object(total_irrig_cropET, get_file=False)
             sw_irrig_arr = read_raster_arr_object(total_sw_irrig, get_file=False)
 
+            # the distribution is computed as 1-D vectors, only for the pixels where all inputs are valid (not nan)
+            # and any of sw irrigation, irrigated cropET and HUC12 total irrigated cropET is non-zero. Of the other
+            # pixels, the ones with nan in any input are nan and the ones with all zero inputs are -9999 (same as
+            # the full grid computation in _sw_cnsmp_use_dense())
+            nonzero_mask = (sw_irrig_arr != 0) | (irrig_cropET_arr != 0) | (total_irrig_cropET_arr != 0)
+            pixel_idx = get_valid_pixel_index(sw_irrig_arr, irr_eff_arr, irrig_cropET_arr, total_irrig_cropET_arr,
+                                              mask=nonzero_mask)
+
+            irrig_cropET_vec = gather_pixels(irrig_cropET_arr, pixel_idx)
+            total_irrig_cropET_vec = gather_pixels(total_irrig_cropET_arr, pixel_idx)
+            sw_irrig_vec = gather_pixels(sw_irrig_arr, pixel_idx)
+            irr_eff_vec = gather_pixels(irr_eff_arr, pixel_idx)
+
             # the total sw irrigation will be distributed to a pixel based on its ratio
             # of irrigated cropET in a pixel/total irrigated cropET in the HUC12
             # Also, multiplying with irrigation efficiency to get consumptive SW use
-            sw_cnsmp_use_arr = np.where((sw_irrig_arr != 0) | (irrig_cropET_arr != 0) | (total_irrig_cropET_arr != 0),
-                                    sw_irrig_arr * irr_eff_arr * (irrig_cropET_arr/total_irrig_cropET_arr), -9999)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                sw_cnsmp_use_vec = sw_irrig_vec * irr_eff_vec * (irrig_cropET_vec / total_irrig_cropET_vec)
+
+            sw_cnsmp_use_arr = np.where(nonzero_mask, np.nan, -9999).astype(np.float32)
+            sw_cnsmp_use_arr = scatter_pixels(sw_cnsmp_use_vec, pixel_idx, ref_file.shape, out=sw_cnsmp_use_arr)
+
+            if check_dense:
+                dense_arr = _sw_cnsmp_use_dense(sw_irrig_arr, irr_eff_arr, irrig_cropET_arr, total_irrig_cropET_arr)
+                if not np.array_equal(sw_cnsmp_use_arr, dense_arr, equal_nan=True):
+                    raise ValueError(f'valid-pixel sw consumptive use of {year} does not match the full grid '
+                                     f'computation')
 
             sw_initial_output_dir = os.path.join(sw_dist_outdir, 'SW_dist_initial')
             makedirs([sw_initial_output_dir])
@@ -234,7 +281,7 @@ def distribute_SW_consmp_use_to_pixels(years_list, HUC12_shapefile, HUC12_Irr_ef
             # this is specially an important step for regions with groundwater pumping
             # but no surface irrigation (during calculation of netGW)
             # regions out of Western US (sea and others) are assigned no data value
-            sw_cnsmp_use_arr = np.where(~np.isnan(sw_cnsmp_use_arr), sw_cnsmp_use_arr, 0)
+            sw_cnsmp_use_arr[np.isnan(sw_cnsmp_use_arr)] = 0
             sw_cnsmp_use_arr = np.where(ref_arr == 0, sw_cnsmp_use_arr, ref_arr)  # assigning no data value
 
             sw_cnsmp_use_raster = os.path.join(sw_dist_outdir, f'sw_cnsmp_use_{year}.tif')
@@ -0,0 +1,137 @@
+import os
+import numpy as np
+import rasterio as rio
+import geopandas as gpd
+from collections import namedtuple
+from rasterio.windows import Window
+from rasterio.features import geometry_mask
+from rasterio.windows import transform as window_transform
+
+from Codes.utils.system_ops import makedirs
+from Codes.utils.raster_ops import get_ref_grid, write_array_to_raster, clip_resample_reproject_raster
+
+no_data_value = -9999
+WestUS_raster = '../../Data_main/reference_rasters/Western_US_refraster_2km.tif'
+
+# basin pixel window and mask on the reference grid. Can be passed as raster_file in write_array_to_raster()
+BasinGrid = namedtuple('BasinGrid', ['window', 'mask', 'transform', 'crs', 'shape', 'count'])
+
+# basin registry {(absolute basin shapefile path, shapefile modification time, absolute reference raster path):
+#                 BasinGrid}
+_basin_registry = {}
+
+
+def get_basin_grid(basin_shp, ref_raster=WestUS_raster):
+    """
+    Get the pixel window and (boolean) mask of a basin on the reference grid. The basin shapefile is rasterized once
+    per process and kept in the basin registry (re-rasterized only if the shapefile is modified).
+
+    A pixel is inside the basin if its center is inside the basin polygon(s), same as gdal.Warp clipping with a
+    cutline. The window is the basin's bounding box snapped to the reference grid.
+
+    :param basin_shp: Filepath of basin shapefile.
+    :param ref_raster: Reference raster filepath. Default set to WestUS_raster.
+
+    :return: A BasinGrid namedtuple. BasinGrid.mask is True for pixels inside the basin.
+    """
+    basin_path = os.path.abspath(basin_shp)
+    registry_key = (basin_path, os.stat(basin_path).st_mtime_ns, os.path.abspath(ref_raster))
+
+    if registry_key not in _basin_registry:
+        ref_grid = get_ref_grid(ref_raster)
+        ref_height, ref_width = ref_grid.shape
+
+        basin_gdf = gpd.read_file(basin_shp).to_crs(ref_grid.crs)
+        min_x, min_y, max_x, max_y = basin_gdf.total_bounds
+
+        # basin bounding box snapped to the reference grid (clipped at reference grid extent)
+        row_start, col_start = rio.transform.rowcol(ref_grid.transform, min_x, max_y, op=np.floor)
+        row_stop, col_stop = rio.transform.rowcol(ref_grid.transform, max_x, min_y, op=np.floor)
+        row_start, col_start = max(int(row_start), 0), max(int(col_start), 0)
+        row_stop, col_stop = min(int(row_stop) + 1, ref_height), min(int(col_stop) + 1, ref_width)
+
+        window = Window(col_off=col_start, row_off=row_start, width=col_stop - col_start,
+                        height=row_stop - row_start)
+        basin_transform = window_transform(window, ref_grid.transform)
+
+        basin_mask = geometry_mask(basin_gdf.geometry, out_shape=(window.height, window.width),
+                                   transform=basin_transform, invert=True)
+        basin_mask.setflags(write=False)  # shared by all functions, so made read-only
+
+        _basin_registry[registry_key] = BasinGrid(window=window, mask=basin_mask, transform=basin_transform,
+                                                  crs=ref_grid.crs, shape=basin_mask.shape, count=1)
+
+    return _basin_registry[registry_key]
+
+
+def clip_arr_to_basin(input_arr, basin_shp, ref_raster=WestUS_raster):
+    """
+    Clip an array (on the reference grid) to a basin.
+
+    :param input_arr: Input numpy array with the same shape as the reference raster.
+    :param basin_shp: Filepath of basin shapefile.
+    :param ref_raster: Reference raster filepath. Default set to WestUS_raster.
+
+    :return: Clipped float32 numpy array. Pixels outside the basin are nan.
+    """
+    basin = get_basin_grid(basin_shp, ref_raster)
+
+    clipped_arr = input_arr[basin.window.toslices()].astype(np.float32)
+    clipped_arr[~basin.mask] = np.nan
+
+    return clipped_arr
+
+
+def clip_raster_to_basin(input_raster, basin_shp, output_raster, ref_raster=WestUS_raster, resolution=None,
+                         nodata=no_data_value):
+    """
+    Clip a raster (on the reference grid) to a basin by reading only the basin window of the raster and masking it with
+    the cached basin mask. Rasters that are not on the reference grid, or that are clipped to a resolution other than
+    the reference grid's, are clipped (and resampled) with gdal.Warp.
+
+    :param input_raster: Input raster filepath.
+    :param basin_shp: Filepath of basin shapefile.
+    :param output_raster: Filepath of output (clipped) raster.
+    :param ref_raster: Reference raster filepath. Default set to WestUS_raster.
+    :param resolution: Output resolution (in the reference grid's unit). Default set to None to keep the reference
+                       grid resolution.
+    :param nodata: no_data_value set as -9999.
+
+    :return: Filepath of output (clipped) raster.
+    """
+    ref_grid = get_ref_grid(ref_raster)
+
+    with rio.open(input_raster) as src:
+        on_ref_grid = (src.shape == ref_grid.shape) and src.transform.almost_equals(ref_grid.transform) and \
+                      ((resolution is None) or np.isclose(abs(ref_grid.transform.a), resolution, rtol=1e-6, atol=0))
+
+        if on_ref_grid:
+            basin = get_basin_grid(basin_shp, ref_raster)
+
+            clipped_arr = src.read(1, window=basin.window, out_dtype=np.float32)
+            if src.nodata is not None:
+                clipped_arr[np.isclose(clipped_arr, src.nodata)] = nodata
+            clipped_arr[np.isnan(clipped_arr) | ~basin.mask] = nodata
+
+    if not on_ref_grid:
+        return clip_resample_reproject_raster(input_raster=input_raster, input_shape=basin_shp,
+                                              output_raster_dir=os.path.dirname(output_raster),
+                                              raster_name=os.path.basename(output_raster),
+                                              clip=True, resample=False, clip_and_resample=False,
+                                              targetaligned=True, resample_algorithm='near', resolution=resolution,
+                                              crs=ref_grid.crs.to_string(), use_ref_width_height=False)
+
+    makedirs([os.path.dirname(output_raster)])
+    write_array_to_raster(raster_arr=clipped_arr, raster_file=basin, transform=basin.transform,
+                          output_path=output_raster, nodata=nodata)
+
+    return output_raster
+
+
+def clear_basin_registry():
+    """
+    Clear the basin registry.
+
+    :return: None.
+    """
+    _basin_registry.clear()
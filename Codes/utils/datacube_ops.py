@@ -0,0 +1,343 @@
+import os
+import numpy as np
+import pandas as pd
+import xarray as xr
+import rasterio as rio
+import dask.array as dska
+from dask import delayed
+from functools import partial
+from collections import namedtuple, OrderedDict
+
+from Codes.utils.system_ops import makedirs
+from Codes.utils.raster_catalog import build_raster_catalog, find_raster
+from Codes.utils.raster_ops import read_raster_arr_object, read_raster_source
+
+no_data_value = -9999
+
+# datacube formats by extension. A datacube path (instead of a directory of monthly GeoTIFFs) can be used as the
+# monthly data source in functions that read monthly datasets through get_monthly_raster_source()/read_monthly_arr()
+datacube_extensions = ('.zarr', '.nc')
+
+# opened datacubes {(absolute path, modification time): xarray dataset}
+_datacubes = {}
+
+# sliding window of monthly arrays for lag/lead features. Arrays are read with the reader (reader(year, month)) and
+# kept in calendar order, oldest first. When walking forward in time, each month is read exactly once irrespective of
+# the number of lags/leads requested.
+MonthlyLagBuffer = namedtuple('MonthlyLagBuffer', ['reader', 'arrays', 'size'])
+
+
+def is_datacube(source):
+    """
+    Check if a monthly data source is a datacube (Zarr store or NetCDF file) rather than a directory of monthly
+    GeoTIFFs.
+
+    :param source: Monthly data source path.
+
+    :return: True if the source is a datacube.
+    """
+    return isinstance(source, str) and source.rstrip('/\\').endswith(datacube_extensions)
+
+
+def convert_monthly_rasters_to_datacube(input_dir, output_datacube, variable=None, years_list=None, time_chunk=12,
+                                        space_chunk=512, skip_processing=False):
+    """
+    Convert a directory of monthly rasters ('<variable>_<year>_<month>.tif') to a single (time, y, x) chunked datacube
+    with CF time coordinates. Chunking on both time and space keeps whole-map reads (one month) and per-pixel
+    time-series reads cheap.
+
+    The datacube is written as a Zarr store if output_datacube ends with '.zarr', otherwise as a NetCDF (.nc) file.
+    Monthly rasters are read lazily, chunk by chunk, while writing.
+
+    :param input_dir: Directory path of monthly rasters.
+    :param output_datacube: Filepath of output datacube (.zarr or .nc).
+    :param variable: Variable name in the datacube. Default set to None to take it from the raster names.
+    :param years_list: List of years to include. Default set to None to include all years.
+    :param time_chunk: Chunk size along time (in months). Default set to 12.
+    :param space_chunk: Chunk size along y and x (in pixels). Default set to 512.
+    :param skip_processing: Set to True to skip datacube conversion.
+
+    :return: Filepath of output datacube.
+    """
+    if not skip_processing:
+        print(f'converting monthly rasters of {input_dir} to datacube...')
+
+        makedirs([os.path.dirname(output_datacube)])
+
+        # monthly records sorted by (year, month)
+        records = [rec for rec in build_raster_catalog(input_dir)['records']
+                   if rec[2] is not None and (years_list is None or rec[1] in years_list)]
+        records = sorted(records, key=lambda rec: (rec[1], rec[2]))
+
+        if len(records) == 0:
+            raise ValueError(f'no monthly rasters found in {input_dir}')
+
+        if variable is None:
+            variable = records[0][0]
+
+        # grid info from the first raster. x/y are pixel center coordinates
+        with rio.open(records[0][-1]) as src:
+            transform, crs, height, width = src.transform, src.crs, src.height, src.width
+
+        x_coords = transform.c + (np.arange(width) + 0.5) * transform.a
+        y_coords = transform.f + (np.arange(height) + 0.5) * transform.e
+        times = pd.to_datetime([f'{rec[1]}-{rec[2]:02d}-01' for rec in records])
+
+        # lazy (time, y, x) stack of the monthly rasters
+        monthly_arrs = [dska.from_delayed(delayed(read_raster_arr_object)(rec[-1], get_file=False),
+                                          shape=(height, width), dtype=np.float32) for rec in records]
+
+        chunks = (min(time_chunk, len(records)), min(space_chunk, height), min(space_chunk, width))
+        cube_arr = dska.stack(monthly_arrs, axis=0).rechunk(chunks)
+
+        # CF grid mapping variable, also read by GDAL
+        spatial_ref = xr.DataArray(0, attrs={'crs_wkt': crs.to_wkt(), 'spatial_ref': crs.to_wkt(),
+                                             'GeoTransform': ' '.join(str(val) for val in transform.to_gdal())})
+
+        datacube = xr.Dataset({variable: (('time', 'y', 'x'), cube_arr, {'grid_mapping': 'spatial_ref'}),
+                               'spatial_ref': spatial_ref},
+                              coords={'time': times, 'y': y_coords, 'x': x_coords})
+
+        if crs.is_geographic:
+            datacube['x'].attrs = {'standard_name': 'longitude', 'units': 'degrees_east'}
+            datacube['y'].attrs = {'standard_name': 'latitude', 'units': 'degrees_north'}
+        else:
+            datacube['x'].attrs = {'standard_name': 'projection_x_coordinate'}
+            datacube['y'].attrs = {'standard_name': 'projection_y_coordinate'}
+
+        time_encoding = {'units': 'days since 1970-01-01', 'calendar': 'standard', 'dtype': 'int32'}
+
+        if output_datacube.rstrip('/\\').endswith('.zarr'):
+            datacube.to_zarr(output_datacube, mode='w',
+                             encoding={variable: {'chunks': chunks, '_FillValue': np.nan}, 'time': time_encoding})
+        else:
+            datacube.to_netcdf(output_datacube, mode='w',
+                               encoding={variable: {'zlib': True, 'complevel': 4, 'chunksizes': chunks,
+                                                    '_FillValue': np.nan},
+                                         'time': time_encoding})
+
+        return output_datacube
+
+    else:
+        return output_datacube
+
+
+def open_datacube(datacube_path):
+    """
+    Open a datacube (lazily) once per process. The datacube is reopened if it has been modified.
+
+    :param datacube_path: Filepath of datacube (.zarr or .nc).
+
+    :return: xarray dataset.
+    """
+    cube_path = os.path.abspath(datacube_path)
+    cache_key = (cube_path, os.stat(cube_path).st_mtime_ns)
+
+    if cache_key not in _datacubes:
+        for key in [key for key in _datacubes.keys() if key[0] == cube_path]:
+            _datacubes.pop(key).close()
+
+        if cube_path.rstrip('/\\').endswith('.zarr'):
+            _datacubes[cache_key] = xr.open_zarr(cube_path)
+        else:
+            _datacubes[cache_key] = xr.open_dataset(cube_path, chunks={})
+
+    return _datacubes[cache_key]
+
+
+def get_datacube_variable(datacube_path):
+    """
+    Get the (single) data variable name of a datacube.
+
+    :param datacube_path: Filepath of datacube (.zarr or .nc).
+
+    :return: Variable name.
+    """
+    datacube = open_datacube(datacube_path)
+
+    return [var for var in datacube.data_vars if var != 'spatial_ref'][0]
+
+
+def _get_time_index(datacube_path, year, month):
+    """
+    Get the time index of a month in a datacube.
+
+    :param datacube_path: Filepath of datacube (.zarr or .nc).
+    :param year: Year (int).
+    :param month: Month (int).
+
+    :return: Time index (int). None if the month is not in the datacube.
+    """
+    time_index = open_datacube(datacube_path).get_index('time')
+    month_time = pd.Timestamp(year=int(year), month=int(month), day=1)
+
+    if month_time in time_index:
+        return time_index.get_loc(month_time)
+    else:
+        return None
+
+
+def read_datacube_arr(datacube_path, year, month, window=None):
+    """
+    Read the array of a month from a datacube, in full or only within a window.
+
+    :param datacube_path: Filepath of datacube (.zarr or .nc).
+    :param year: Year (int).
+    :param month: Month (int).
+    :param window: rasterio window to read. Default set to None to read full extent.
+
+    :return: Float32 numpy array (nodata as nan).
+    """
+    time_idx = _get_time_index(datacube_path, year, month)
+    if time_idx is None:
+        raise KeyError(f'{year}-{month} not found in {datacube_path}')
+
+    data = open_datacube(datacube_path)[get_datacube_variable(datacube_path)]
+
+    if window is not None:
+        (row_start, row_stop), (col_start, col_stop) = window.toranges()
+        data = data.isel(time=time_idx, y=slice(row_start, row_stop), x=slice(col_start, col_stop))
+    else:
+        data = data.isel(time=time_idx)
+
+    return data.values.astype(np.float32)
+
+
+def read_datacube_pixel_series(datacube_path, row, col):
+    """
+    Read the monthly time-series of a pixel from a datacube.
+
+    :param datacube_path: Filepath of datacube (.zarr or .nc).
+    :param row: Row index of the pixel.
+    :param col: Column index of the pixel.
+
+    :return: A pandas series of pixel values indexed by time.
+    """
+    data = open_datacube(datacube_path)[get_datacube_variable(datacube_path)]
+
+    return data.isel(y=row, x=col).to_series()
+
+
+def get_monthly_raster_source(source, year, month, required=True):
+    """
+    Get the raster source of a month from a directory of monthly rasters or from a datacube.
+
+    :param source: Directory path of monthly rasters or filepath of datacube (.zarr or .nc).
+    :param year: Year (int).
+    :param month: Month (int).
+    :param required: Set to False to return None (instead of raising FileNotFoundError) if the month is not found.
+                     Default set to True.
+
+    :return: Raster filepath (for a directory) or a reader function that takes a window (for a datacube). Both can be
+             used with read_raster_source(), iter_raster_blocks(), write_raster_by_blocks(), sum_rasters() and
+             mean_rasters().
+    """
+    if is_datacube(source):
+        if _get_time_index(source, year, month) is None:
+            if required:
+                raise FileNotFoundError(f'{source}: year={year} month={month}')
+            return None
+        return partial(read_datacube_arr, source, int(year), int(month))
+    else:
+        return find_raster(source, year=year, month=month, required=required)
+
+
+def read_monthly_arr(source, year, month):
+    """
+    Read the array of a month from a directory of monthly rasters or from a datacube.
+
+    :param source: Directory path of monthly rasters or filepath of datacube (.zarr or .nc).
+    :param year: Year (int).
+    :param month: Month (int).
+
+    :return: Float32 numpy array (nodata as nan).
+    """
+    return read_raster_source(get_monthly_raster_source(source, year, month))
+
+
+def list_water_year_sources(source, year):
+    """
+    List monthly raster sources of a water year (previous year's October to current year's September) from a
+    directory of monthly rasters or from a datacube.
+
+    :param source: Directory path of monthly rasters or filepath of datacube (.zarr or .nc).
+    :param year: Water year (int).
+
+    :return: A list of raster sources (see get_monthly_raster_source()) ordered by month (October of the previous
+             year first). Missing months are skipped.
+    """
+    water_yr_months = [(year - 1, month) for month in range(10, 13)] + [(year, month) for month in range(1, 10)]
+    raster_sources = [get_monthly_raster_source(source, yr, month, required=False) for yr, month in water_yr_months]
+
+    return [raster_source for raster_source in raster_sources if raster_source is not None]
+
+
+def shift_month(year, month, n_months):
+    """
+    Shift a (year, month) by a number of calendar months.
+
+    :param year: Year (int).
+    :param month: Month (int).
+    :param n_months: Number of months to shift by. Negative for previous months.
+
+    :return: A tuple of shifted (year, month).
+    """
+    month_idx = int(year) * 12 + (int(month) - 1) + int(n_months)
+
+    return month_idx // 12, month_idx % 12 + 1
+
+
+def create_monthly_lag_buffer(reader, max_lag=2, max_lead=0):
+    """
+    Create a sliding window (ring buffer) of monthly arrays for lag/lead features.
+
+    :param reader: A function that takes (year, month) and returns the month's array (e.g.
+                   partial(read_monthly_arr, source)).
+    :param max_lag: Maximum number of previous months requested. Default set to 2.
+    :param max_lead: Maximum number of next months requested. Default set to 0.
+
+    :return: A MonthlyLagBuffer namedtuple.
+    """
+    return MonthlyLagBuffer(reader=reader, arrays=OrderedDict(), size=max_lag + max_lead + 1)
+
+
+def get_monthly_lag_arr(lag_buffer, year, month, lag=0):
+    """
+    Get the array of a month lagged by a number of calendar months (e.g. lag=1 gives previous month's array) from a
+    monthly lag buffer. The array is read only if it isn't in the buffer. The oldest month is dropped when the buffer
+    is full.
+
+    :param lag_buffer: A MonthlyLagBuffer namedtuple (from create_monthly_lag_buffer()).
+    :param year: Year (int) of the current month.
+    :param month: Current month (int).
+    :param lag: Number of months to lag. Negative for leads. Default set to 0 for the current month.
+
+    :return: The array returned by the buffer's reader.
+    """
+    lag_year, lag_month = shift_month(year, month, -lag)
+
+    if (lag_year, lag_month) not in lag_buffer.arrays:
+        add_monthly_lag_arr(lag_buffer, lag_year, lag_month, lag_buffer.reader(lag_year, lag_month))
+
+    return lag_buffer.arrays[(lag_year, lag_month)]
+
+
+def add_monthly_lag_arr(lag_buffer, year, month, arr):
+    """
+    Add a month's array (read outside the buffer, e.g. by parallel workers) to a monthly lag buffer. The oldest month
+    is dropped when the buffer is full.
+
+    :param lag_buffer: A MonthlyLagBuffer namedtuple (from create_monthly_lag_buffer()).
+    :param year: Year (int).
+    :param month: Month (int).
+    :param arr: The month's array.
+
+    :return: None.
+    """
+    lag_buffer.arrays[(year, month)] = arr
+
+    # keeping the months in calendar order and dropping the oldest ones
+    for key in sorted(lag_buffer.arrays.keys()):
+        lag_buffer.arrays.move_to_end(key)
+    while len(lag_buffer.arrays) > lag_buffer.size:
+        lag_buffer.arrays.popitem(last=False)
@@ -1,15 +1,22 @@
 import os
 import sys
 import csv
+import json
+import shutil
 import joblib
 import timeit
+import hashlib
 import numpy as np
 import pandas as pd
+import pyarrow as pa
 from glob import glob
+import pyarrow.parquet as pq
 import dask.dataframe as ddf
 import matplotlib.pyplot as plt
-from datetime import datetime, timedelta
 from timeit import default_timer as timer
+from collections import namedtuple
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 
 import lightgbm as lgb
 from lightgbm import LGBMRegressor
@@ -28,12 +35,30 @@ sys.path.insert(0, dirname(dirname(dirname(abspath(__file__)))))
 
 from Codes.utils.system_ops import makedirs
 from Codes.utils.stats_ops import calculate_rmse, calculate_r2
-from Codes.utils.raster_ops import read_raster_arr_object
+from Codes.utils.raster_catalog import find_raster
+from Codes.utils.raster_ops import read_raster_arr_object, write_raster_by_blocks
+from Codes.utils.datacube_ops import is_datacube, read_monthly_arr, shift_month, create_monthly_lag_buffer, \
+    get_monthly_lag_arr
+from Codes.utils.sparse_ops import get_valid_pixel_index, gather_pixels
 
 no_data_value = -9999
 model_res = 0.02000000000000000389  # in deg, 2 km
 WestUS_raster = '../../Data_main/reference_rasters/Western_US_refraster_2km.tif'
 
+# maximum number of parallel prediction workers (each worker holds a month's/year's feature matrix in memory)
+max_prediction_workers = 16
+
+# compiled tree-ensemble (lleaves or treelite/tl2cgen shared library) of a trained lightgbm model. Can be used in place
+# of the trained model in predict_feature_matrix() and the prediction functions (see compile_model()).
+# predict: function taking (feature_matrix, num_threads) and returning 1-D predictions
+CompiledModel = namedtuple('CompiledModel', ['backend', 'predict', 'feature_names', 'model_file'])
+
+# incremental train-test store - a directory of (year, month) parquet partitions (read as one dataframe with
+# pd.read_parquet(store_dir)) and a manifest of the partitions' columns, row counts and source-file checksums.
+# Source files are recorded as {filepath: {'sha256', 'size', 'mtime_ns'}}, so a file is re-hashed only if its size or
+# modification time has changed. Temporary files are prefixed with '_' so that pyarrow doesn't read them as data.
+train_test_manifest = '_manifest.json'
+
 
 def reindex_df(df):
     """
@@ -49,25 +74,483 @@ def reindex_df(df):
     return df
 
 
+def get_model_feature_names(trained_model):
+    """
+    Get the feature (predictor) names of a trained model in the order they were used in training.
+
+    :param trained_model: Trained ML model object (LGBMRegressor, lightgbm Booster or CompiledModel).
+
+    :return: A list of feature names. None if the model doesn't store feature names.
+    """
+    if isinstance(trained_model, CompiledModel):
+        return list(trained_model.feature_names)
+    elif hasattr(trained_model, 'feature_name_'):  # LGBMRegressor
+        return list(trained_model.feature_name_)
+    elif hasattr(trained_model, 'feature_name'):  # lightgbm Booster
+        return list(trained_model.feature_name())
+    else:
+        return None
+
+
+def predict_feature_matrix(trained_model, feature_matrix, num_threads=None):
+    """
+    Predict with a trained model on a numpy feature matrix (columns in the model's feature order). The lightgbm
+    booster (or the compiled model) is called directly to skip the pandas/sklearn input checks.
+
+    :param trained_model: Trained ML model object (LGBMRegressor, lightgbm Booster or CompiledModel).
+    :param feature_matrix: 2-D numpy array (rows x features) of predictors.
+    :param num_threads: Number of lightgbm threads for this prediction (see get_prediction_workers()). Default set to
+                        None to use the model's setting.
+
+    :return: 1-D numpy array of predictions.
+    """
+    feature_matrix = np.ascontiguousarray(feature_matrix, dtype=np.float32)
+    thread_param = {} if num_threads is None else {'num_threads': num_threads}
+
+    if isinstance(trained_model, CompiledModel):
+        return trained_model.predict(feature_matrix, num_threads)
+    elif hasattr(trained_model, 'booster_'):  # LGBMRegressor
+        return trained_model.booster_.predict(feature_matrix, **thread_param)
+    elif isinstance(trained_model, lgb.Booster):
+        return trained_model.predict(feature_matrix, **thread_param)
+    else:
+        return np.asarray(trained_model.predict(feature_matrix))
+
+
+def compile_model(trained_model, check_data, output_dir, model_name, backend='lleaves', rtol=1e-5, atol=1e-4,
+                  skip_processing=False):
+    """
+    Compile a trained lightgbm model into native code for faster batch prediction, with lleaves (LLVM) or
+    treelite/tl2cgen (C shared library). The compiled model is cached in output_dir (keyed by the model's content),
+    so it is compiled only once per model.
+
+    The compiled model's predictions are checked against the lightgbm booster on check_data. The trained model is
+    returned (and used for prediction) if the backend isn't installed or the predictions don't match.
+
+    *** lleaves and treelite/tl2cgen are optional dependencies. Install with 'pip install lleaves' or
+    'pip install treelite tl2cgen' (needs a C compiler).
+
+    :param trained_model: Trained ML model object (LGBMRegressor or lightgbm Booster).
+    :param check_data: Predictor dataframe/2-D array (e.g. x_test) to check compiled model's predictions with.
+    :param output_dir: Filepath of output directory to save the compiled model.
+    :param model_name: Model's name to save the compiled model with.
+    :param backend: Compiler backend. Can be 'lleaves' or 'tl2cgen'. Default set to 'lleaves'.
+    :param rtol: Relative tolerance of the prediction check. Default set to 1e-5.
+    :param atol: Absolute tolerance of the prediction check. Default set to 1e-4.
+    :param skip_processing: Set to True to skip compiling and use the trained model. Default set to False.
+
+    :return: A CompiledModel namedtuple or the trained model.
+    """
+    if not skip_processing:
+        if backend not in ('lleaves', 'tl2cgen'):
+            raise ValueError(f"backend must be 'lleaves' or 'tl2cgen', got {backend}")
+
+        try:
+            if backend == 'lleaves':
+                import lleaves
+            else:
+                import treelite
+                import tl2cgen
+        except ImportError:
+            print(f'{backend} is not installed. Using the trained lightgbm model for prediction.')
+            return trained_model
+
+        makedirs([output_dir])
+
+        booster = trained_model.booster_ if hasattr(trained_model, 'booster_') else trained_model
+        feature_names = get_model_feature_names(trained_model)
+
+        # model text file. Compiled model files are named with model text's hash so that a retrained model with the
+        # same name isn't served from an old compiled file
+        model_str = booster.model_to_string()
+        model_hash = hashlib.sha1(model_str.encode()).hexdigest()[:12]
+
+        model_txt = os.path.join(output_dir, f'{model_name}.txt')
+        with open(model_txt, 'w') as model_file:
+            model_file.write(model_str)
+
+        print(f'Compiling trained model with {backend}...')
+
+        if backend == 'lleaves':
+            compiled_file = os.path.join(output_dir, f'{model_name}_{model_hash}_lleaves.o')
+
+            llvm_model = lleaves.Model(model_file=model_txt)
+            llvm_model.compile(cache=compiled_file)
+
+            def predict(feature_matrix, num_threads=None):
+                n_jobs = cpu_count() if num_threads is None else num_threads
+                return llvm_model.predict(np.asarray(feature_matrix, dtype=np.float64), n_jobs=n_jobs)
+
+        else:
+            compiled_file = os.path.join(output_dir, f'{model_name}_{model_hash}_tl2cgen.so')
+
+            if not os.path.exists(compiled_file):
+                tl_model = treelite.frontend.load_lightgbm_model(model_txt)
+                tl2cgen.export_lib(tl_model, toolchain='gcc', libpath=compiled_file,
+                                   params={'parallel_comp': cpu_count()})
+            # the thread count of a tl2cgen predictor is set when the library is loaded, so one predictor is kept
+            # per thread count
+            tl_predictors = {}
+
+            def predict(feature_matrix, num_threads=None):
+                n_jobs = cpu_count() if num_threads is None else num_threads
+                if n_jobs not in tl_predictors:
+                    tl_predictors[n_jobs] = tl2cgen.Predictor(compiled_file, nthread=n_jobs)
+
+                dmat = tl2cgen.DMatrix(np.asarray(feature_matrix, dtype=np.float32))
+                return tl_predictors[n_jobs].predict(dmat).ravel()
+
+        compiled_model = CompiledModel(backend=backend, predict=predict, feature_names=feature_names,
+                                       model_file=compiled_file)
+
+        # checking compiled model's predictions against the lightgbm booster
+        if isinstance(check_data, pd.DataFrame) and feature_names is not None:
+            check_data = check_data[feature_names]
+        check_matrix = np.ascontiguousarray(check_data, dtype=np.float32)
+
+        booster_pred = booster.predict(check_matrix)
+        compiled_pred = compiled_model.predict(check_matrix)
+
+        if not np.allclose(compiled_pred, booster_pred, rtol=rtol, atol=atol):
+            max_diff = np.max(np.abs(compiled_pred - booster_pred))
+            print(f'{backend} compiled model predictions differ from the trained model (max difference {max_diff}). '
+                  f'Using the trained lightgbm model for prediction.')
+            return trained_model
+
+        print(f'Compiled model saved as {compiled_file}')
+
+        return compiled_model
+
+    else:
+        return trained_model
+
+
+def predict_raster_by_blocks(trained_model, feature_sources, output_raster, mask_sources=None, mask_function=None,
+                             postprocess_function=None, block_rows=512, num_threads=None, nodata=no_data_value):
+    """
+    Predict with a trained model over aligned predictor rasters block by block (row-blocks of full raster width) and
+    write the prediction raster block by block. Only one block of each predictor raster, its feature matrix and
+    predictions are in memory at a time, so peak memory is set by block_rows, not by the grid size.
+
+    For each block, the pixels to predict on are selected with the mask rasters, the feature matrix (float32, columns
+    in the model's feature order, nan set to 0) is built for those pixels only, predicted and scattered back to the
+    block. Other pixels are set to nodata. The output raster takes grid info from the first mask (or predictor) raster.
+
+    :param trained_model: Trained ML model object (LGBMRegressor, lightgbm Booster or CompiledModel).
+    :param feature_sources: A list of predictor sources in the model's feature order. Each item can be a raster source
+                            (raster filepath, (raster filepath, band) tuple or reader function, see
+                            read_raster_source()) or a number for a constant feature (e.g. month).
+    :param output_raster: Filepath of output prediction raster.
+    :param mask_sources: A list of raster sources to select the pixels to predict on. Default set to None to predict
+                         on all pixels.
+    :param mask_function: Function that takes the list of mask block arrays (in mask_sources order) and returns a
+                          boolean block array of the pixels to predict on. Default set to None to predict on pixels
+                          that are valid (not nan) in all mask rasters.
+    :param postprocess_function: Function applied to the 1-D predictions of a block (e.g. to bound values). Default
+                                 set to None.
+    :param block_rows: Number of rows (full raster width) per block. Default set to 512.
+    :param num_threads: Number of lightgbm threads for prediction (see get_prediction_workers()). Default set to
+                        None to use the model's setting.
+    :param nodata: no_data_value set as -9999.
+
+    :return: Filepath of output prediction raster.
+    """
+    mask_sources = [] if mask_sources is None else mask_sources
+
+    raster_feature_idx = [idx for idx, source in enumerate(feature_sources) if not isinstance(source, (int, float))]
+    # mask rasters first, so that the output raster takes grid info from them
+    input_rasters = list(mask_sources) + [feature_sources[idx] for idx in raster_feature_idx]
+
+    def predict_block(block_arrs):
+        mask_blocks = block_arrs[:len(mask_sources)]
+        feature_blocks = block_arrs[len(mask_sources):]
+        block_shape = block_arrs[0].shape
+
+        # pixels to predict on
+        if len(mask_blocks) == 0:
+            pixel_idx = np.arange(np.prod(block_shape), dtype=np.int32)
+        elif mask_function is not None:
+            pixel_idx = np.flatnonzero(mask_function(mask_blocks)).astype(np.int32)
+        else:
+            pixel_idx = get_valid_pixel_index(*mask_blocks)
+
+        pred_block = np.full(block_shape, nodata, dtype=np.float32)
+
+        if len(pixel_idx) == 0:
+            return pred_block
+
+        # feature matrix of the block's pixels to predict on
+        feature_matrix = np.empty((len(pixel_idx), len(feature_sources)), dtype=np.float32, order='C')
+        for col, source in enumerate(feature_sources):
+            if col in raster_feature_idx:
+                feature_matrix[:, col] = gather_pixels(feature_blocks[raster_feature_idx.index(col)], pixel_idx)
+            else:
+                feature_matrix[:, col] = source
+        feature_matrix[np.isnan(feature_matrix)] = 0  # setting nan-position values with 0
+
+        pred_vec = predict_feature_matrix(trained_model, feature_matrix, num_threads=num_threads)
+        if postprocess_function is not None:
+            pred_vec = postprocess_function(pred_vec)
+
+        pred_block.ravel()[pixel_idx] = pred_vec
+
+        return pred_block
+
+    return write_raster_by_blocks(input_rasters, output_raster, predict_block, block_rows=block_rows,
+                                  dtype=np.float32, nodata=nodata)
+
+
+def get_prediction_workers(n_tasks, use_cpu=None, max_workers=max_prediction_workers):
+    """
+    Divide CPUs between parallel prediction workers (year-months/years processed at a time) and lightgbm threads
+    per prediction, so that the machine is neither oversubscribed nor idle. Workers are favored as the prediction
+    passes are limited by raster I/O latency. The number of workers is capped by max_workers as each worker holds
+    its own feature matrix.
+
+    :param n_tasks: Number of tasks (e.g. year-months to predict).
+    :param use_cpu: Number of CPUs to use. Default set to None to use all CPUs of the machine.
+    :param max_workers: Maximum number of parallel workers. Default set to max_prediction_workers.
+
+    :return: A tuple of number of workers and number of lightgbm threads per worker.
+    """
+    use_cpu = cpu_count() if use_cpu is None else use_cpu
+
+    n_workers = max(1, min(n_tasks, use_cpu, max_workers))
+    n_model_threads = max(1, use_cpu // n_workers)
+
+    return n_workers, n_model_threads
+
+
+def run_in_thread_pool(func, tasks, n_workers):
+    """
+    Run a function on a list of tasks with a ThreadPool. Threads are used (not processes) as raster I/O and lightgbm
+    prediction release the GIL, and workers can share the cached (read-only) predictor arrays.
+
+    :param func: Function that takes a task.
+    :param tasks: A list of tasks.
+    :param n_workers: Number of threads. The tasks are run serially if 1.
+
+    :return: A list of the function's results in the order of tasks.
+    """
+    if n_workers == 1:
+        return [func(task) for task in tasks]
+
+    # Using imap() as it completes assigning one task at a time to the ThreadPool(), so tasks (e.g. months) are
+    # started in order
+    pool = ThreadPool(n_workers)
+    try:
+        results = list(pool.imap(func, tasks))
+    finally:
+        pool.close()
+        pool.join()
+
+    return results
+
+
 def apply_OneHotEncoding(input_df):
     one_hot = OneHotEncoder()
     input_df_enc = one_hot.fit_transform(input_df)
     return input_df_enc
 
 
+def get_train_test_months(years_list):
+    """
+    Get the (year, month) pairs included in the monthly train-test dataframe. Only October-December of 2008 and
+    January-September of 2020 are included as water years are considered from 2009 to 2020.
+
+    :param years_list: A list of years_list.
+
+    :return: A list of (year, month) tuples.
+    """
+    year_months = []
+    for year in years_list:
+        if year == 2008:
+            month_list = range(10, 13)
+        elif year == 2020:
+            month_list = range(1, 10)
+        else:
+            month_list = range(1, 13)
+
+        year_months.extend([(year, month) for month in month_list])
+
+    return year_months
+
+
+def _read_static_pixel_data(static_data_path_dict, datasets_to_include):
+    """
+    Read the static datasets of a train-test dataframe as vectors of the pixels that are valid in all of them.
+    Rows of other pixels would be dropped anyway, so the dataframe columns are only allocated for these pixels.
+
+    :param static_data_path_dict: A dictionary with static variables' names as keys and their paths as values.
+                                  Can be None.
+    :param datasets_to_include: A list of datasets to include in the dataframe.
+
+    :return: Pixel indices (None if there is no static dataset) and a dictionary of static variables' pixel vectors.
+    """
+    static_arr_dict = {}
+    if static_data_path_dict is not None:
+        for var in static_data_path_dict.keys():
+            if var in datasets_to_include:
+                print(f'processing data for {var}..')
+
+                static_data = glob(os.path.join(static_data_path_dict[var], '*.tif'))[0]
+                static_arr_dict[var] = read_raster_arr_object(static_data, get_file=False)
+
+    if len(static_arr_dict) == 0:
+        return None, {}
+
+    pixel_idx = get_valid_pixel_index(*static_arr_dict.values())
+    static_vec_dict = {var: gather_pixels(arr, pixel_idx) for var, arr in static_arr_dict.items()}
+
+    return pixel_idx, static_vec_dict
+
+
+def _drop_nan_rows(column_dict):
+    """
+    Drop rows with nan (in any column) of a dictionary of dataframe columns with a single mask.
+
+    :param column_dict: A dictionary of dataframe columns (numpy arrays of same length).
+
+    :return: A dictionary of dataframe columns without nan rows.
+    """
+    valid_rows = np.ones(len(next(iter(column_dict.values()))), dtype=bool)
+    for col in column_dict.values():
+        if np.issubdtype(col.dtype, np.floating):
+            valid_rows &= ~np.isnan(col)
+
+    # compressing one column at a time (instead of the full table) to keep the memory peak low
+    for var in list(column_dict.keys()):
+        column_dict[var] = column_dict[var][valid_rows]
+
+    return column_dict
+
+
+def get_file_checksum(filepath, chunk_size=1 << 20):
+    """
+    Get the sha256 checksum of a file.
+
+    :param filepath: Filepath.
+    :param chunk_size: Number of bytes read at a time. Default set to 1 MB.
+
+    :return: Hex digest (str).
+    """
+    file_hash = hashlib.sha256()
+    with open(filepath, mode='rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            file_hash.update(chunk)
+
+    return file_hash.hexdigest()
+
+
+def _write_json_atomic(data, output_json):
+    """
+    Write a json file atomically (to a temporary file, then replaced), so that an interrupted run doesn't leave a
+    partially written file.
+
+    :param data: Data (dict) to write.
+    :param output_json: Filepath of output json file.
+
+    :return: None.
+    """
+    tmp_json = f'{output_json}.tmp'
+    with open(tmp_json, mode='w') as json_file:
+        json.dump(data, json_file, indent=1)
+    os.replace(tmp_json, output_json)
+
+
+def _get_source_record(source, known_records):
+    """
+    Get the checksum record of a source file of an incremental train-test store. The file is hashed only if it isn't
+    in known_records or its size or modification time has changed.
+
+    :param source: Source (raster) filepath or datacube path.
+    :param known_records: A dictionary of known source records {filepath: record}. Updated in place.
+
+    :return: A dictionary {'sha256', 'size', 'mtime_ns'}. None for datacube sources.
+    """
+    if is_datacube(source):
+        return None
+
+    file_stat = os.stat(source)
+    record = known_records.get(source)
+
+    if (record is None) or (record['size'] != file_stat.st_size) or (record['mtime_ns'] != file_stat.st_mtime_ns):
+        record = {'sha256': get_file_checksum(source), 'size': file_stat.st_size, 'mtime_ns': file_stat.st_mtime_ns}
+        known_records[source] = record
+
+    return record
+
+
+def _read_train_test_manifest(store_dir, column_names):
+    """
+    Read the manifest of an incremental train-test store. An empty manifest is returned if there isn't any or if it
+    was written with different columns (i.e. all partitions need to be built).
+
+    :param store_dir: Directory path of the incremental train-test store.
+    :param column_names: A list of the train-test dataframe's columns.
+
+    :return: Manifest dictionary {'columns': column_names, 'partitions': {key: partition info}}.
+    """
+    manifest_json = os.path.join(store_dir, train_test_manifest)
+
+    if os.path.exists(manifest_json):
+        with open(manifest_json) as json_file:
+            manifest = json.load(json_file)
+
+        if manifest.get('columns') == column_names:
+            return manifest
+
+    return {'columns': column_names, 'partitions': {}}
+
+
+def _save_train_test_dataframe(column_dict, output_parquet, n_partitions):
+    """
+    Drop rows with nan (in any column) with a single mask and save the train-test dataframe.
+
+    :param column_dict: A dictionary of dataframe columns (numpy arrays of same length).
+    :param output_parquet: Output filepath of the parquet file (or '.csv' file) to save.
+    :param n_partitions: Number of partitions to save the parquet file in using dask dataframe.
+
+    :return: None.
+    """
+    train_test_df = pd.DataFrame(_drop_nan_rows(column_dict), copy=False)
+
+    if '.parquet' in output_parquet:
+        train_test_ddf = ddf.from_pandas(train_test_df, npartitions=n_partitions)
+        train_test_ddf.to_parquet(output_parquet, write_index=False)
+    elif '.csv' in output_parquet:
+        train_test_df.to_csv(output_parquet, index=False)
+
+
 def create_train_test_monthly_dataframe(years_list, monthly_data_path_dict, yearly_data_path_dict,
                                         static_data_path_dict, datasets_to_include, output_parquet,
-                                        skip_processing=False, n_partitions=20):
+                                        incremental=False, prune=False, skip_processing=False):
     """
     Compile monthly/yearly/static datasets into a dataframe. This function-generated dataframe will be used as
     train-test data for ML model at monthly scale.
 
+    The dataframe is streamed to the output file one (year, month) block at a time, so only one month's rows are
+    in memory. Each block is built in numpy columns (float32 for variables, int16 for year and month) of the pixels
+    valid in all static datasets, and rows with nan are dropped with a single mask. In the parquet file each
+    (year, month) block is a row group with year/month statistics, so reads filtered on year/month (e.g.
+    pd.read_parquet(..., filters=[('month', 'in', [4, 5])])) only read the matching row groups.
+
+    With incremental=True, output_parquet is a directory (store) of one parquet file per (year, month) with a manifest
+    of the partitions' source-file (monthly, lagged monthly, yearly and static rasters) checksums. Only the
+    partitions that are missing, or whose source files have changed since they were built, are built (e.g. a newly
+    added year). Source files are only re-hashed if their size or modification time has changed. Each partition is
+    written to a temporary file and then moved in place, so an interrupted run doesn't leave partial partitions
+    (leftover temporary files are removed on the next run). Partitions of years/months not in years_list are kept,
+    unless prune=True. The store is read as one dataframe with pd.read_parquet(output_parquet). Datacube sources are
+    recorded without checksums, so changes within a datacube aren't detected.
+
     *** if there is no yearly dataset, set yearly_data_path_dict to None.
     *** if there is no static data, set static_data_path_dict to None.
 
     :param years_list: A list of years_list for which data to include in the dataframe.
     :param monthly_data_path_dict: A dictionary with monthly variables' names as keys and their paths as values.
-                                   This can't be None.
+                                   This can't be None. A path can be a directory of monthly rasters or a datacube
+                                   (.zarr/.nc) created with convert_monthly_rasters_to_datacube().
     :param yearly_data_path_dict: A dictionary with yearly variables' names as keys and their paths as values.
                                   Set to None if there is no yearly dataset.
     :param static_data_path_dict: A dictionary with static variables' names as keys and their paths as values.
@@ -75,147 +558,188 @@ def create_train_test_monthly_dataframe(years_list, monthly_data_path_dict, year
     :param datasets_to_include: A list of datasets to include in the dataframe.
     :param output_parquet: Output filepath of the parquet file to save. Using parquet as it requires lesser memory.
                             Can also save smaller dataframe as csv file if name has '.csv' extension.
+    :param incremental: Set to True to build/update an incremental train-test store (parquet only) at output_parquet.
+                        Default set to False to build the full dataframe.
+    :param prune: Set to True to remove the partitions of years/months that aren't in years_list from the incremental
+                  store. Default set to False to keep them.
     :param skip_processing: Set to True to skip this dataframe creation process.
-    :param n_partitions: Number of partitions to save the parquet file in using dask dataframe.
 
     :return: The filepath of the output parquet file.
     """
     if not skip_processing:
         print('creating train-test dataframe for monthly model...')
 
+        if incremental and ('.parquet' not in output_parquet):
+            raise ValueError('incremental train-test dataframe can only be saved as parquet')
+
         output_dir = os.path.dirname(output_parquet)
         makedirs([output_dir])
 
-        variable_dict = {}
-        yearly_month_count_dict = {}
+        year_months = get_train_test_months(years_list)
+        monthly_vars = [var for var in monthly_data_path_dict.keys() if var in datasets_to_include]
+        yearly_vars = [] if yearly_data_path_dict is None else \
+            [var for var in yearly_data_path_dict.keys() if var in datasets_to_include]
+
+        static_vars = [] if static_data_path_dict is None else \
+            [var for var in static_data_path_dict.keys() if var in datasets_to_include]
+
+        column_names = []
+        for var in monthly_vars:
+            column_names.append(var)
+            if len(column_names) == 1:
+                column_names.extend(['year', 'month'])
+            if var == 'GRIDMET_Precip':
+                column_names.extend(['GRIDMET_Precip_1_lag', 'GRIDMET_Precip_2_lag'])
+        column_names.extend(yearly_vars + static_vars)
+
+        schema = pa.schema([(var, pa.int16() if var in ('year', 'month') else pa.float32()) for var in column_names])
+
+        if incremental:
+            # replacing the single parquet file of an earlier (non-incremental) run with the store directory
+            if os.path.isfile(output_parquet):
+                os.remove(output_parquet)
+            makedirs([output_parquet])
+
+            # removing temporary files left by an interrupted run
+            for tmp_file in glob(os.path.join(output_parquet, '_*.tmp')):
+                os.remove(tmp_file)
+
+            manifest = _read_train_test_manifest(output_parquet, column_names)
+            manifest_json = os.path.join(output_parquet, train_test_manifest)
+
+            partition_keys = [f'{year}_{month}' for year, month in year_months]
+            if prune:
+                # removing partitions of years/months that aren't in years_list
+                for key in [key for key in manifest['partitions'].keys() if key not in partition_keys]:
+                    partition_file = os.path.join(output_parquet, manifest['partitions'].pop(key)['file'])
+                    if os.path.exists(partition_file):
+                        os.remove(partition_file)
+
+            # finding the partitions to build - missing, or with changed source files. Source records of the
+            # manifest are reused for files with unchanged size and modification time
+            known_records = {}
+            for partition in manifest['partitions'].values():
+                for source, record in partition['sources'].items():
+                    if isinstance(record, dict):
+                        known_records[source] = record
+
+            def get_checksums(source_records):
+                return {source: record['sha256'] if isinstance(record, dict) else record
+                        for source, record in source_records.items()}
+
+            def get_partition_sources(year, month):
+                sources = []
+                for var in monthly_vars:
+                    lags = range(3) if var == 'GRIDMET_Precip' else range(1)
+                    for lag in lags:
+                        lag_year, lag_month = shift_month(year, month, -lag)
+                        sources.append(monthly_data_path_dict[var] if is_datacube(monthly_data_path_dict[var]) else
+                                       find_raster(monthly_data_path_dict[var], year=lag_year, month=lag_month))
+                sources.extend([find_raster(yearly_data_path_dict[var], year=year) for var in yearly_vars])
+                sources.extend([glob(os.path.join(static_data_path_dict[var], '*.tif'))[0] for var in static_vars])
+
+                return {source: _get_source_record(source, known_records) for source in sources}
+
+            partition_sources = {}
+            for year, month in year_months:
+                key = f'{year}_{month}'
+                sources = get_partition_sources(year, month)
+                partition = manifest['partitions'].get(key)
+
+                if (partition is None) or (get_checksums(partition['sources']) != get_checksums(sources)) or \
+                        (not os.path.exists(os.path.join(output_parquet, partition['file']))):
+                    partition_sources[(year, month)] = sources
+                else:
+                    # refreshing size and modification time of the (unchanged) sources
+                    partition['sources'] = sources
 
-        # monthly data compilation
-        for var in monthly_data_path_dict.keys():
-            if var in datasets_to_include:
-                print(f'processing data for {var}...')
-
-                for year in years_list:
-                    # creating list of month to be included for each year
-                    if year == 2008:
-                        month_list = range(10, 13)
-                    elif year == 2020:
-                        month_list = range(1, 10)
-                    else:
-                        month_list = range(1, 13)
-
-                    if var == 'GRIDMET_Precip':  # for including monthly and lagged monthly GRIDMET_precip in the dataframe
-                        for month_count, month in enumerate(month_list):
-                            current_precip_data = \
-                            glob(os.path.join(monthly_data_path_dict[var], f'*{year}_{month}.tif*'))[0]
-
-                            current_month_date = datetime(year, month, 1)
-
-                            # Collect previous month's precip data
-                            prev_month_date = current_month_date - timedelta(30)
-                            prev_2_month_date = current_month_date - timedelta(60)
-
-                            prev_month_precip_data = glob(os.path.join(monthly_data_path_dict[var],
-                                                                       f'*{prev_month_date.year}_{prev_month_date.month}.tif*'))[
-                                0]
-                            prev_2_month_precip_data = glob(os.path.join(monthly_data_path_dict[var],
-                                                                         f'*{prev_2_month_date.year}_{prev_2_month_date.month}.tif*'))[
-                                0]
-
-                            # reading datasets
-                            current_precip_arr = read_raster_arr_object(current_precip_data, get_file=False).flatten()
-                            len_arr = len(list(current_precip_arr))
-                            year_data = [int(year)] * len_arr
-                            month_data = [int(month)] * len_arr
-
-                            prev_month_precip_arr = read_raster_arr_object(prev_month_precip_data,
-                                                                           get_file=False).flatten()
-                            prev_2_month_precip_arr = read_raster_arr_object(prev_2_month_precip_data,
-                                                                             get_file=False).flatten()
-
-                            if (month_count == 0) & (
-                                    var not in variable_dict.keys()):  # initiating the key and adding first series of data
-                                variable_dict[var] = list(current_precip_arr)
-                                variable_dict['year'] = year_data
-                                variable_dict['month'] = month_data
-
-                                variable_dict['GRIDMET_Precip_1_lag'] = list(prev_month_precip_arr)
-                                variable_dict['GRIDMET_Precip_2_lag'] = list(prev_2_month_precip_arr)
-
-                            else:  # if key already found, extending the data list
-                                variable_dict[var].extend(list(current_precip_arr))
-                                variable_dict['year'].extend(year_data)
-                                variable_dict['month'].extend(month_data)
-
-                                variable_dict['GRIDMET_Precip_1_lag'].extend(list(prev_month_precip_arr))
-                                variable_dict['GRIDMET_Precip_2_lag'].extend(list(prev_2_month_precip_arr))
-
-                            yearly_month_count_dict[year] = month_count + 1
-
-                    else:
-                        for month_count, month in enumerate(month_list):
-                            monthly_data = glob(os.path.join(monthly_data_path_dict[var], f'*{year}_{month}.tif*'))[0]
-
-                            data_arr = read_raster_arr_object(monthly_data, get_file=False).flatten()
-                            len_arr = len(list(data_arr))
-                            year_data = [int(year)] * len_arr
-                            month_data = [int(month)] * len_arr
-
-                            if (month_count == 0) & (
-                                    var not in variable_dict.keys()):  # initiating the key and adding first series of data
-                                variable_dict[var] = list(data_arr)
-                                variable_dict['year'] = year_data
-                                variable_dict['month'] = month_data
-                            else:  # if key already found, extending the data list
-                                variable_dict[var].extend(list(data_arr))
-                                variable_dict['year'].extend(year_data)
-                                variable_dict['month'].extend(month_data)
-
-                            yearly_month_count_dict[year] = month_count + 1
+            year_months = [year_month for year_month in year_months if year_month in partition_sources]
+            print(f'{len(partition_keys) - len(year_months)} (year, month) partitions are up to date, '
+                  f'building {len(year_months)}...')
 
-        # annual data compilation
-        if yearly_data_path_dict is not None:
-            for var in yearly_data_path_dict.keys():
-                if var in datasets_to_include:
-                    print(f'processing data for {var}..')
+            _write_json_atomic(manifest, manifest_json)
+
+            if len(year_months) == 0:
+                return output_parquet
+
+        # static data compilation (only the pixels valid in all static datasets are kept)
+        pixel_idx, static_vec_dict = _read_static_pixel_data(static_data_path_dict, datasets_to_include)
+
+        def read_pixels(arr):
+            return arr.ravel() if pixel_idx is None else gather_pixels(arr, pixel_idx)
+
+        parquet_writer = None
+        if not incremental:
+            # replacing the output of an earlier run (the dask parquet writer or incremental runs wrote a directory)
+            if os.path.isdir(output_parquet):
+                shutil.rmtree(output_parquet)
+
+            parquet_writer = pq.ParquetWriter(output_parquet, schema) if '.parquet' in output_parquet else None
+
+        # monthly data sliding windows. previous months' arrays are kept for lagged GRIDMET_precip, so each month
+        # is read once
+        def monthly_pixel_reader(source):
+            return lambda yr, mn: read_pixels(read_monthly_arr(source, yr, mn))
+
+        lag_buffers = {var: create_monthly_lag_buffer(monthly_pixel_reader(monthly_data_path_dict[var]),
+                                                      max_lag=2 if var == 'GRIDMET_Precip' else 0)
+                       for var in monthly_vars}
+
+        yearly_vec_dict = {}
+        for month_count, (year, month) in enumerate(year_months):
+            print(f'processing data for year {year}, month {month}...')
 
-                    for year_count, year in enumerate(years_list):
-                        yearly_data = glob(os.path.join(yearly_data_path_dict[var], f'*{year}*.tif'))[0]
+            # annual data (read once for all months of a year)
+            if (month_count == 0) or (year != year_months[month_count - 1][0]):
+                yearly_vec_dict = {var: read_pixels(read_raster_arr_object(
+                    find_raster(yearly_data_path_dict[var], year=year), get_file=False)) for var in yearly_vars}
 
-                        data_arr = read_raster_arr_object(yearly_data, get_file=False).flatten()
+            block_dict = {}
 
-                        if (year_count == 0) & (var not in variable_dict.keys()):
-                            variable_dict[var] = list(data_arr) * yearly_month_count_dict[year]
+            # monthly data (from monthly rasters' directory or datacube)
+            for var in monthly_vars:
+                block_dict[var] = get_monthly_lag_arr(lag_buffers[var], year, month)
 
-                        else:
-                            variable_dict[var].extend(list(data_arr) * yearly_month_count_dict[year])
+                if var == 'GRIDMET_Precip':  # for including lagged monthly GRIDMET_precip in the dataframe
+                    # previous (calendar) months' precip data
+                    block_dict['GRIDMET_Precip_1_lag'] = get_monthly_lag_arr(lag_buffers[var], year, month, lag=1)
+                    block_dict['GRIDMET_Precip_2_lag'] = get_monthly_lag_arr(lag_buffers[var], year, month, lag=2)
 
-        # static data compilation
-        # counting total number of months in all years_list
-        # need only for monthly train-test dataframe creation
-        total_month_count = 0
-        for i in yearly_month_count_dict.values():
-            total_month_count += i
+            block_dict.update(yearly_vec_dict)
+            block_dict.update(static_vec_dict)
 
-        if static_data_path_dict is not None:
-            for var in static_data_path_dict.keys():
-                if var in datasets_to_include:
-                    print(f'processing data for {var}..')
+            # pixel count from the pixel index or any of the included datasets (monthly datasets might be excluded)
+            n_pixels = len(pixel_idx) if pixel_idx is not None else next(iter(block_dict.values())).size
+            block_dict['year'] = np.full(n_pixels, year, dtype=np.int16)
+            block_dict['month'] = np.full(n_pixels, month, dtype=np.int16)
 
-                    static_data = glob(os.path.join(static_data_path_dict[var], '*.tif'))[0]
+            block_dict = _drop_nan_rows({var: block_dict[var] for var in column_names})
 
-                    data_arr = read_raster_arr_object(static_data, get_file=False).flatten()
-                    data_duplicated_for_total_months = list(data_arr) * total_month_count
+            # writing the block. one row group per (year, month) in parquet
+            if incremental:
+                # one file per (year, month). Written to a temporary file and moved in place, then recorded in the
+                # manifest. File names are zero-padded so that the store is read in (year, month) order
+                block_table = pa.table(block_dict, schema=schema)
+                partition_file = f'part_{year}_{month:02d}.parquet'
+                tmp_parquet = os.path.join(output_parquet, f'_{partition_file}.tmp')
 
-                    variable_dict[var] = data_duplicated_for_total_months
+                pq.write_table(block_table, tmp_parquet, row_group_size=max(block_table.num_rows, 1))
+                os.replace(tmp_parquet, os.path.join(output_parquet, partition_file))
 
-        train_test_ddf = ddf.from_dict(variable_dict, npartitions=n_partitions)
-        train_test_ddf = train_test_ddf.dropna()
+                manifest['partitions'][f'{year}_{month}'] = {'file': partition_file, 'rows': block_table.num_rows,
+                                                             'sources': partition_sources[(year, month)]}
+                _write_json_atomic(manifest, manifest_json)
 
-        if '.parquet' in output_parquet:
-            train_test_ddf.to_parquet(output_parquet, write_index=False)
-        elif '.csv' in output_parquet:
-            train_test_df = train_test_ddf.compute()
-            train_test_df.to_csv(output_parquet, index=False)
+            elif parquet_writer is not None:
+                block_table = pa.table(block_dict, schema=schema)
+                if block_table.num_rows > 0:
+                    parquet_writer.write_table(block_table, row_group_size=block_table.num_rows)
+            elif '.csv' in output_parquet:
+                pd.DataFrame(block_dict, copy=False).to_csv(output_parquet, mode='w' if month_count == 0 else 'a',
+                                                            header=(month_count == 0), index=False)
+
+        if parquet_writer is not None:
+            parquet_writer.close()
 
         return output_parquet
 
@@ -230,6 +754,10 @@ def create_train_test_annual_dataframe(years_list, yearly_data_path_dict,
     Compile yearly/static datasets into a dataframe. This function-generated dataframe will be used as
     train-test data for ML model at annual scale.
 
+    The dataframe is built in preallocated float32 numpy columns of (number of years x pixels valid in all static
+    datasets) rows. Static columns are filled by broadcasting, and rows with nan are dropped with a single mask
+    before saving.
+
     *** if there is no static data, set static_data_path_dict to None.
 
     :param years_list: A list of years_list for which data to include in the dataframe.
@@ -242,7 +770,6 @@ def create_train_test_annual_dataframe(years_list, yearly_data_path_dict,
                             Can also save smaller dataframe as csv file if name has '.csv' extension.
     :param skip_processing: Set to True to skip this dataframe creation process.
     :param n_partitions: Number of partitions to save the parquet file in using dask dataframe.
-    :param filter_for_slope: Se to True to filter for slope. Default set to False to skip the filtering.
 
     :return: The filepath of the output parquet file.
     """
@@ -252,44 +779,36 @@ def create_train_test_annual_dataframe(years_list, yearly_data_path_dict,
         output_dir = os.path.dirname(output_parquet)
         makedirs([output_dir])
 
-        variable_dict = {}
-
-        # annual data compilation
-        for var in yearly_data_path_dict.keys():
-            if var in datasets_to_include:
-                print(f'processing data for {var}..')
-
-                for year_count, year in enumerate(years_list):
-                    yearly_data = glob(os.path.join(yearly_data_path_dict[var], f'*{year}*.tif'))[0]
+        yearly_vars = [var for var in yearly_data_path_dict.keys() if var in datasets_to_include]
 
-                    data_arr = read_raster_arr_object(yearly_data, get_file=False).flatten()
+        # static data compilation (only the pixels valid in all static datasets are kept)
+        pixel_idx, static_vec_dict = _read_static_pixel_data(static_data_path_dict, datasets_to_include)
 
-                    if (year_count == 0) & (var not in variable_dict.keys()):
-                        variable_dict[var] = list(data_arr)
+        def read_pixels(arr):
+            return arr.ravel() if pixel_idx is None else gather_pixels(arr, pixel_idx)
 
-                    else:
-                        variable_dict[var].extend(list(data_arr))
+        # preallocating the columns. Rows are ordered by year and pixel
+        n_years = len(years_list)
+        n_pixels = read_pixels(read_raster_arr_object(find_raster(yearly_data_path_dict[yearly_vars[0]],
+                                                                  year=years_list[0]), get_file=False)).size
 
-        # static data compilation
-        if static_data_path_dict is not None:
-            for var in static_data_path_dict.keys():
-                if var in datasets_to_include:
-                    print(f'processing data for {var}..')
+        column_dict = {var: np.empty(n_years * n_pixels, dtype=np.float32)
+                       for var in yearly_vars + list(static_vec_dict.keys())}
 
-                    static_data = glob(os.path.join(static_data_path_dict[var], '*.tif'))[0]
-                    data_arr = read_raster_arr_object(static_data, get_file=False).flatten()
+        # annual data compilation
+        for var in yearly_vars:
+            print(f'processing data for {var}..')
+            var_columns = column_dict[var].reshape(n_years, n_pixels)
 
-                    data_duplicated_for_total_years = list(data_arr) * len(years_list)
-                    variable_dict[var] = data_duplicated_for_total_years
+            for year_count, year in enumerate(years_list):
+                yearly_data = find_raster(yearly_data_path_dict[var], year=year)
+                var_columns[year_count] = read_pixels(read_raster_arr_object(yearly_data, get_file=False))
 
-        train_test_ddf = ddf.from_dict(variable_dict, npartitions=n_partitions)
-        train_test_ddf = train_test_ddf.dropna()
+        # static data (broadcasted to all years)
+        for var, static_vec in static_vec_dict.items():
+            column_dict[var].reshape(n_years, n_pixels)[:] = static_vec
 
-        if '.parquet' in output_parquet:
-            train_test_ddf.to_parquet(output_parquet, write_index=False)
-        elif '.csv' in output_parquet:
-            train_test_df = train_test_ddf.compute()
-            train_test_df.to_csv(output_parquet, index=False)
+        _save_train_test_dataframe(column_dict, output_parquet, n_partitions)
 
         return output_parquet
 
@@ -327,11 +846,13 @@ def split_train_val_test_set(input_csv, pred_attr, exclude_columns, output_dir,
     if not skip_processing:
         print('Splitting train-test dataframe into train and test dataset...')
 
-        input_df = pd.read_parquet(input_csv)
-
         if month_range is not None:  # filter for specific month ranges
+            # only the row groups of the months in range are read from parquet
             month_list = [m for m in range(month_range[0], month_range[1] + 1)]  # creating list of months
+            input_df = pd.read_parquet(input_csv, filters=[('month', 'in', month_list)])
             input_df = input_df[input_df['month'].isin(month_list)]
+        else:
+            input_df = pd.read_parquet(input_csv)
 
         if remove_outlier:  # removing outliers. detected by EDA
             input_df = input_df[input_df[pred_attr] <= outlier_upper_val]
@@ -425,7 +946,8 @@ def split_train_val_test_set_by_year(input_csv, pred_attr, exclude_columns,
               f'years_list {years_in_train} in train set', '\n',
               f'year {year_in_test} in test set')
 
-        input_df = pd.read_parquet(input_csv)
+        # only the row groups of the train and test years_list are read from parquet
+        input_df = pd.read_parquet(input_csv, filters=[('year', 'in', list(years_in_train) + list(year_in_test))])
         drop_columns = exclude_columns + [
             pred_attr]  # dropping unwanted columns/columns that will not be used in model training
 
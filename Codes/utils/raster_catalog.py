@@ -0,0 +1,187 @@
+import os
+import re
+
+# module-level catalog of indexed directories
+# {(absolute directory path, extension): {'mtime': directory modification time,
+#                                          'records': list of (variable, year, month, region, filepath),
+#                                          'by_year': {year: [records]},
+#                                          'by_year_month': {(year, month): [records]}}}
+_catalog = {}
+
+# a year token (e.g. 2000) or a joined year-month token (e.g. 200001, as in PRISM bil names)
+year_token_pattern = re.compile(r'^(19|20)\d{2}$')
+year_month_token_pattern = re.compile(r'^(19|20)\d{2}(0[1-9]|1[0-2])$')
+
+
+def parse_raster_name(filepath):
+    """
+    Parse variable, year, month and region from a dataset filename.
+
+    Filenames in this project follow the '<variable>_<year>_<month>_<region>.tif' convention where month and
+    region (GEE patch number, basin or unit tag) are optional. Examples -
+    'Irrigated_cropET_2000_1.tif' -> ('Irrigated_cropET', 2000, 1, None),
+    'Irrigated_cropET_2000_1_25.tif' -> ('Irrigated_cropET', 2000, 1, '25'),
+    'netGW_Irr_2000.tif' -> ('netGW_Irr', 2000, None, None),
+    'pumping_2000_AF.tif' -> ('pumping', 2000, None, 'AF'),
+    'AWC_WestUS.tif' -> ('AWC_WestUS', None, None, None).
+
+    ** Yearly GEE patches ('<variable>_<year>_<patch>.tif') can't be told apart from monthly datasets by name. The
+    catalog is meant for processed (merged) dataset directories, not for the raw GEE patch directories.
+
+    :param filepath: Filepath or filename of the dataset.
+
+    :return: A tuple of (variable, year, month, region). year/month/region are None if not present in the name.
+    """
+    file_stem = os.path.basename(filepath).split('.')[0]
+    tokens = file_stem.split('_')
+
+    for idx, token in enumerate(tokens):
+        if year_token_pattern.match(token):
+            year = int(token)
+            rest = tokens[idx + 1:]
+
+            # month is the token right after year, written without zero padding (1-12)
+            month = None
+            if len(rest) > 0 and rest[0].isdigit() and 1 <= int(rest[0]) <= 12:
+                month = int(rest[0])
+                rest = rest[1:]
+
+            variable = '_'.join(tokens[:idx]) if idx > 0 else None
+            region = '_'.join(rest) if len(rest) > 0 else None
+
+            return variable, year, month, region
+
+        elif year_month_token_pattern.match(token):
+            variable = '_'.join(tokens[:idx]) if idx > 0 else None
+            rest = tokens[idx + 1:]
+            region = '_'.join(rest) if len(rest) > 0 else None
+
+            return variable, int(token[:4]), int(token[4:]), region
+
+    # static datasets (no year in the name)
+    return file_stem, None, None, None
+
+
+def build_raster_catalog(directory, extension='.tif', force_refresh=False):
+    """
+    Index all files (with the given extension) of a directory by (variable, year, month, region).
+
+    The index is built once and kept for the whole process. It is rebuilt automatically when the modification time
+    of the directory changes (files added, removed or renamed), or when force_refresh is True.
+
+    :param directory: Directory path to index.
+    :param extension: File extension to index. Default set to '.tif'.
+    :param force_refresh: Set to True to rebuild the index even if the directory has not changed.
+
+    :return: A dictionary with 'mtime', 'records', 'by_year' and 'by_year_month' keys.
+    """
+    dir_path = os.path.abspath(directory)
+    dir_mtime = os.stat(dir_path).st_mtime_ns
+    cache_key = (dir_path, extension)
+
+    if not force_refresh and cache_key in _catalog and _catalog[cache_key]['mtime'] == dir_mtime:
+        return _catalog[cache_key]
+
+    records = []
+    with os.scandir(dir_path) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.endswith(extension):
+                variable, year, month, region = parse_raster_name(entry.name)
+                records.append((variable, year, month, region, os.path.join(directory, entry.name)))
+
+    records = sorted(records, key=lambda rec: rec[-1])
+
+    # year and (year, month) keyed indices for O(1) lookups
+    by_year = {}
+    by_year_month = {}
+    for rec in records:
+        by_year.setdefault(rec[1], []).append(rec)
+        by_year_month.setdefault((rec[1], rec[2]), []).append(rec)
+
+    _catalog[cache_key] = {'mtime': dir_mtime, 'records': records, 'by_year': by_year, 'by_year_month': by_year_month}
+
+    return _catalog[cache_key]
+
+
+def list_rasters(directory, variable=None, year=None, month=None, region=None, extension='.tif'):
+    """
+    List dataset filepaths of a directory matching the given (variable, year, month, region) criteria.
+
+    A criterion set to None is not used for filtering. Year and month are matched exactly, so year=2000, month=1
+    does not pick up the 2000_10, 2000_11, 2000_12 datasets like the '*2000_1*' glob pattern does.
+
+    :param directory: Directory path to search in.
+    :param variable: Variable name (filename part before year). Default set to None.
+    :param year: Year (int). Default set to None.
+    :param month: Month (int). Default set to None.
+    :param region: Region/patch tag (filename part after year/month). Default set to None.
+    :param extension: File extension to search for. Default set to '.tif'.
+
+    :return: A sorted list of filepaths.
+    """
+    catalog = build_raster_catalog(directory, extension=extension)
+
+    if year is not None and month is not None:
+        candidates = catalog['by_year_month'].get((year, month), [])
+    elif year is not None:
+        candidates = catalog['by_year'].get(year, [])
+    else:
+        candidates = catalog['records']
+
+    return [rec[-1] for rec in candidates
+            if (variable is None or rec[0] == variable) and (month is None or rec[2] == month) and
+            (region is None or rec[3] == region)]
+
+
+def find_raster(directory, year=None, month=None, variable=None, region=None, extension='.tif', required=True):
+    """
+    Find a single dataset in a directory by year and month (replacement of glob(...)[0] lookups).
+
+    :param directory: Directory path to search in.
+    :param year: Year (int). Default set to None.
+    :param month: Month (int). Default set to None.
+    :param variable: Variable name (filename part before year). Default set to None.
+    :param region: Region/patch tag (filename part after year/month). Default set to None.
+    :param extension: File extension to search for. Default set to '.tif'.
+    :param required: Set to False to return None (instead of raising FileNotFoundError) if no dataset matches.
+                     Default set to True.
+
+    :return: Filepath of the (first) matching dataset.
+    """
+    matches = list_rasters(directory, variable=variable, year=year, month=month, region=region,
+                           extension=extension)
+
+    if len(matches) > 0:
+        return matches[0]
+    elif required:
+        raise FileNotFoundError(f'{directory}: year={year} month={month}')
+    else:
+        return None
+
+
+def list_water_year_rasters(directory, year, extension='.tif'):
+    """
+    List monthly datasets of a water year (previous year's October to current year's September).
+
+    :param directory: Directory path of monthly datasets.
+    :param year: Water year (int).
+    :param extension: File extension to search for. Default set to '.tif'.
+
+    :return: A list of filepaths ordered by month (October of the previous year first).
+    """
+    water_yr_months = [(year - 1, month) for month in range(10, 13)] + [(year, month) for month in range(1, 10)]
+
+    water_yr_datasets = []
+    for yr, month in water_yr_months:
+        water_yr_datasets.extend(list_rasters(directory, year=yr, month=month, extension=extension))
+
+    return water_yr_datasets
+
+
+def clear_raster_catalog():
+    """
+    Clear the in-memory raster catalog of all indexed directories.
+
+    :return: None.
+    """
+    _catalog.clear()
@@ -1,5 +1,7 @@
 import os
 import subprocess
+from functools import lru_cache
+from collections import namedtuple
 import numpy as np
 from glob import glob
 import rasterio as rio
@@ -8,6 +10,9 @@ import geopandas as gpd
 from rasterio.mask import mask
 from rasterio.merge import merge
 from rasterio.enums import Resampling
+from rasterio.windows import Window
+from rasterio.transform import Affine
+from rasterio.shutil import copy as rio_copy
 from shapely.geometry import box, mapping
 
 from Codes.utils.system_ops import make_gdal_sys_call
@@ -19,6 +24,38 @@ WestUS_shape = '../../Data_main/shapefiles/Western_US_ref_shapes/WestUS_states.s
 WestUS_raster = '../../Data_main/reference_rasters/Western_US_refraster_2km.tif'
 GEE_merging_refraster_large_grids = '../../Data_main/reference_rasters/GEE_merging_refraster_larger_grids.tif'
 
+# output profile used by all raster writers. Can be changed with set_raster_output_profile() or with the
+# 'RASTER_OUTPUT_PROFILE' environment variable.
+# 'striped' - uncompressed, striped GTiff (old behaviour)
+# 'deflate' - 512x512 tiled, DEFLATE compressed GTiff with (floating point) predictor
+# 'zstd' - 512x512 tiled, ZSTD compressed GTiff with (floating point) predictor
+# 'cog' - Cloud-Optimized GeoTIFF, 512x512 tiled, DEFLATE compressed with (floating point) predictor and overviews
+raster_output_profiles = ('striped', 'deflate', 'zstd', 'cog')
+raster_output_setting = {'profile': os.environ.get('RASTER_OUTPUT_PROFILE', 'deflate'), 'block_size': 512}
+
+if raster_output_setting['profile'] not in raster_output_profiles:
+    raise ValueError(f"RASTER_OUTPUT_PROFILE must be one of {raster_output_profiles}, "
+                     f"got '{raster_output_setting['profile']}'")
+
+# statistics and nan policies of accumulate_rasters()
+raster_stats = ('sum', 'mean', 'min', 'max', 'count', 'std')
+nan_policies = ('skip', 'propagate', 'zero')
+
+# compact storage data types of categorical, mask and month rasters {variable (filename keyword): (dtype, nodata)}.
+# 0 can be a valid value in these rasters, so the largest value of the data type is used as nodata.
+# uint16 (nodata 65535) can be used for scaled integer quantities that fit losslessly (e.g. day of year)
+compact_raster_dtypes = {'Irrigated_cropland': ('uint8', 255),  # class 1
+                         'Rainfed_cropland': ('uint8', 255),  # class 1
+                         'Excess_ET_filter': ('uint8', 255),  # mask 1
+                         'canal_coverage': ('uint8', 255),  # mask 1
+                         'Lakes': ('uint8', 255),  # mask 1
+                         'USDA_CDL': ('uint8', 255),  # CDL class codes 1-254
+                         'GrowSeason_months': ('uint8', 255),  # growing season start and end months 1-12
+                         'GrowSeason_DOY': ('uint16', 65535)}  # growing season start and end day of year 1-366
+
+# reference grid information. Can be passed as raster_file in write_array_to_raster()
+Grid = namedtuple('Grid', ['path', 'arr', 'valid_mask', 'transform', 'crs', 'shape', 'bounds', 'nodata', 'count'])
+
 
 def read_raster_arr_object(raster_file, rasterio_obj=False, band=1, get_file=True, change_dtype=True):
     """
@@ -47,6 +84,250 @@ def read_raster_arr_object(raster_file, rasterio_obj=False, band=1, get_file=Tru
         return raster_arr
 
 
+def read_gdal_dataset_arr(gdal_dataset, band=1, change_dtype=True):
+    """
+    Get raster array from a gdal dataset (e.g. an in-memory dataset returned by clip_resample_reproject_raster()).
+
+    :param gdal_dataset: Input gdal dataset.
+    :param band: Selected band to read. Default set to 1.
+    :param change_dtype: Set to True if want to change raster data type to float (nodata set to nan).
+                         Default set to True.
+
+    :return: Raster numpy array.
+    """
+    raster_band = gdal_dataset.GetRasterBand(band)
+    raster_arr = raster_band.ReadAsArray()
+    if change_dtype:
+        raster_arr = raster_arr.astype(np.float32)
+        nodata = raster_band.GetNoDataValue()
+        if nodata:
+            raster_arr[np.isclose(raster_arr, nodata)] = np.nan
+
+    return raster_arr
+
+
+def get_compact_dtype(variable):
+    """
+    Get the compact storage data type and nodata value of a categorical, mask or month raster.
+
+    :param variable: Variable name or raster filepath (matched with the keywords of compact_raster_dtypes).
+
+    :return: A tuple of (numpy data type, nodata value).
+    """
+    name = os.path.basename(variable).lower()
+
+    for keyword, (dtype, nodata) in compact_raster_dtypes.items():
+        if keyword.lower() in name:
+            return np.dtype(dtype), nodata
+
+    raise ValueError(f'{variable} is not a registered compact raster variable {tuple(compact_raster_dtypes.keys())}')
+
+
+def to_compact_arr(raster_arr, dtype, nodata):
+    """
+    Convert a raster array to a compact integer data type. nan and no_data_value (-9999) pixels are set to nodata.
+
+    :param raster_arr: Raster array (float or integer).
+    :param dtype: Compact (unsigned integer) data type, e.g. np.uint8.
+    :param nodata: Nodata value of the compact data type, e.g. 255.
+
+    :return: Compact raster array.
+    """
+    raster_arr = np.asarray(raster_arr)
+    invalid = raster_arr == no_data_value
+    if _is_float_dtype(raster_arr.dtype):
+        invalid |= np.isnan(raster_arr)
+
+    valid_values = raster_arr[~invalid]
+    if valid_values.size > 0 and ((valid_values.min() < 0) or (valid_values.max() >= nodata) or
+                                  (_is_float_dtype(raster_arr.dtype) and np.any(valid_values % 1 != 0))):
+        raise ValueError(f'values of the array can not be stored losslessly as {np.dtype(dtype).name} '
+                         f'(nodata {nodata})')
+
+    compact_arr = np.where(invalid, nodata, raster_arr).astype(dtype)
+
+    return compact_arr
+
+
+def read_compact_raster_arr(raster_file, band=1, as_float=False):
+    """
+    Read a categorical, mask or month raster (registered in compact_raster_dtypes) in its compact data type.
+    Rasters written before in float32/int32 (with -9999 nodata) are converted to the compact data type.
+
+    :param raster_file: Input raster filepath.
+    :param band: Selected band to read. Default set to 1.
+    :param as_float: Set to True to read as float32 (nodata set to nan) for float math. Default set to False.
+
+    :return: Raster numpy array (nodata as the compact data type's nodata value, e.g. 255 for uint8).
+    """
+    if as_float:
+        return read_raster_arr_object(raster_file, band=band, get_file=False)
+
+    dtype, nodata = get_compact_dtype(raster_file)
+
+    with rio.open(raster_file) as src:
+        raster_arr = src.read(band)
+        src_nodata = src.nodata
+
+    if raster_arr.dtype == dtype and src_nodata == nodata:
+        return raster_arr
+
+    if src_nodata is not None:
+        raster_arr = np.where(np.isclose(raster_arr, src_nodata), no_data_value, raster_arr)
+
+    return to_compact_arr(raster_arr, dtype, nodata)
+
+
+def write_compact_raster(raster_arr, raster_file, transform, output_path, variable=None):
+    """
+    Write a categorical, mask or month raster in its compact data type (see compact_raster_dtypes).
+
+    :param raster_arr: Raster array data to be written. nan and -9999 are written as nodata.
+    :param raster_file: Original rasterio raster file containing geo-coordinates.
+    :param transform: Affine transformation matrix.
+    :param output_path: Output filepath.
+    :param variable: Variable name in compact_raster_dtypes. Default set to None to match it from output_path.
+
+    :return: Output filepath.
+    """
+    dtype, nodata = get_compact_dtype(output_path if variable is None else variable)
+
+    return write_array_to_raster(raster_arr=to_compact_arr(raster_arr, dtype, nodata), raster_file=raster_file,
+                                 transform=transform, output_path=output_path, dtype=dtype, nodata=nodata)
+
+
+def set_raster_output_profile(profile, block_size=512):
+    """
+    Set the output profile used by all raster writers.
+
+    :param profile: Output profile. Can be 'striped', 'deflate', 'zstd', or 'cog'.
+    :param block_size: Internal tile size (pixels) of tiled profiles. Default set to 512.
+
+    :return: None.
+    """
+    if profile not in raster_output_profiles:
+        raise ValueError(f'profile must be one of {raster_output_profiles}')
+
+    raster_output_setting['profile'] = profile
+    raster_output_setting['block_size'] = block_size
+
+
+def _is_float_dtype(dtype):
+    """
+    Check if a numpy/rasterio (or gdal) data type is a floating point type.
+
+    :param dtype: Numpy/rasterio data type or gdal data type (e.g., gdal.GDT_Float32).
+
+    :return: True if floating point data type.
+    """
+    if isinstance(dtype, int):  # gdal data type
+        return dtype in (gdal.GDT_Float32, gdal.GDT_Float64)
+    else:
+        return np.issubdtype(np.dtype(dtype), np.floating)
+
+
+def get_raster_creation_options(dtype=np.float32):
+    """
+    Get GTiff creation options (rasterio keyword arguments) of the current raster output profile.
+
+    :param dtype: Data type of the raster to write. Sets floating point (3) or horizontal (2) predictor.
+
+    :return: A dictionary of creation options. Empty dictionary for the 'striped' profile.
+    """
+    profile = raster_output_setting['profile']
+
+    if profile == 'striped':
+        return {}
+
+    block_size = raster_output_setting['block_size']
+    creation_options = {'tiled': True, 'blockxsize': block_size, 'blockysize': block_size,
+                        'predictor': 3 if _is_float_dtype(dtype) else 2}
+
+    if profile == 'zstd':
+        creation_options.update({'compress': 'zstd', 'zstd_level': 9})
+    else:  # 'deflate' and 'cog'
+        creation_options.update({'compress': 'deflate', 'zlevel': 6})
+
+    return creation_options
+
+
+def get_gdal_creation_options(dtype=gdal.GDT_Float32):
+    """
+    Get GTiff creation options of the current raster output profile in gdal format (for gdal.Warp(),
+    gdal.Translate(), gdal.Rasterize() and gdal command line tools).
+
+    :param dtype: Data type of the raster to write. Can be gdal data type or numpy data type.
+
+    :return: A list of creation options (e.g., ['TILED=YES', 'COMPRESS=DEFLATE', ...]).
+    """
+    creation_options = get_raster_creation_options(dtype)
+
+    return [f'{key.upper()}={"YES" if value is True else str(value).upper()}'
+            for key, value in creation_options.items()]
+
+
+def finalize_raster_output(raster_path):
+    """
+    Rewrite a written GTiff as Cloud-Optimized GeoTIFF (with overviews) when the 'cog' output profile is set. Does
+    nothing for other profiles. Writers create tiled GTiffs first as the COG driver can't write directly.
+
+    :param raster_path: Filepath of the written raster.
+
+    :return: Filepath of the raster.
+    """
+    if raster_output_setting['profile'] == 'cog':
+        cog_path = raster_path + '.cog_tmp'
+
+        with rio.open(raster_path) as src:
+            predictor = 'FLOATING_POINT' if _is_float_dtype(src.dtypes[0]) else 'STANDARD'
+            rio_copy(src, cog_path, driver='COG', compress='DEFLATE', predictor=predictor,
+                     blocksize=raster_output_setting['block_size'], overviews='AUTO', overview_resampling='NEAREST')
+
+        os.replace(cog_path, raster_path)
+
+    return raster_path
+
+
+@lru_cache(maxsize=4)
+def _load_ref_grid(raster_path, modified_time):
+    """
+    Read a reference raster into a Grid. Cached by filepath and modification time (so that an updated raster is
+    re-read).
+
+    :param raster_path: Absolute filepath of reference raster.
+    :param modified_time: Modification time (ns) of the reference raster.
+
+    :return: A Grid namedtuple.
+    """
+    ref_arr, ref_file = read_raster_arr_object(raster_path)
+    valid_mask = ~np.isnan(ref_arr)  # valid land pixels
+
+    # shared by all functions, so made read-only
+    ref_arr.setflags(write=False)
+    valid_mask.setflags(write=False)
+
+    grid = Grid(path=raster_path, arr=ref_arr, valid_mask=valid_mask, transform=ref_file.transform,
+                crs=ref_file.crs, shape=ref_arr.shape, bounds=ref_file.bounds, nodata=ref_file.nodata,
+                count=ref_file.count)
+    ref_file.close()
+
+    return grid
+
+
+def get_ref_grid(ref_raster=WestUS_raster):
+    """
+    Get the reference grid (array, valid land mask, transform, crs, shape, bounds, nodata) of a reference raster.
+    The reference raster is read once per process and the (read-only) Grid is shared by all functions.
+
+    :param ref_raster: Reference raster filepath. Default set to WestUS_raster.
+
+    :return: A Grid namedtuple. Grid.arr and Grid.valid_mask are read-only arrays.
+    """
+    raster_path = os.path.abspath(ref_raster)
+
+    return _load_ref_grid(raster_path, os.stat(raster_path).st_mtime_ns)
+
+
 def write_array_to_raster(raster_arr, raster_file, transform, output_path, dtype=None,
                           ref_file=None, nodata=no_data_value):
     """
@@ -79,13 +360,180 @@ def write_array_to_raster(raster_arr, raster_file, transform, output_path, dtype
             count=raster_file.count,
             crs=raster_file.crs,
             transform=transform,
-            nodata=nodata
+            nodata=nodata,
+            **get_raster_creation_options(dtype)
     ) as dst:
         dst.write(raster_arr, raster_file.count)
 
+    finalize_raster_output(output_path)
+
     return output_path
 
 
+def _get_block_rows(raster_file, block_rows):
+    """
+    Round the number of rows per block to a multiple of the raster's internal (GTiff strip/tile) block height so that
+    each block read touches whole internal blocks only.
+
+    :param raster_file: rasterio raster file object.
+    :param block_rows: Requested number of rows per block.
+
+    :return: Number of rows per block.
+    """
+    internal_block_height = raster_file.block_shapes[0][0]
+
+    return max(internal_block_height, (block_rows // internal_block_height) * internal_block_height)
+
+
+def read_raster_source(raster_source, window=None):
+    """
+    Read a raster source as a float array (nodata set to nan), in full or only within a window.
+
+    :param raster_source: A raster filepath (band 1 is read), a (raster filepath, band) tuple or a reader function
+                          that takes a window (None for full extent) and returns a float array with nodata as nan
+                          (e.g. a datacube monthly slice from Codes.utils.datacube_ops.get_monthly_raster_source()).
+    :param window: rasterio window to read. Default set to None to read full extent.
+
+    :return: Raster (block) numpy array.
+    """
+    if callable(raster_source):
+        return raster_source(window=window)
+
+    raster, band = raster_source if isinstance(raster_source, tuple) else (raster_source, 1)
+    with rio.open(raster) as raster_file:
+        raster_arr = raster_file.read(band, window=window, out_dtype=np.float32)
+        if raster_file.nodata:
+            raster_arr[np.isclose(raster_arr, raster_file.nodata)] = np.nan
+
+    return raster_arr
+
+
+def _first_raster_filepath(input_rasters):
+    """
+    Get the filepath of the first raster file (not a reader function) among raster sources.
+
+    :param input_rasters: List of raster sources (see read_raster_source()).
+
+    :return: Raster filepath.
+    """
+    for raster in input_rasters:
+        if not callable(raster):
+            return raster[0] if isinstance(raster, tuple) else raster
+
+    raise ValueError('at least one of the input rasters must be a raster file to take grid info from')
+
+
+def iter_raster_blocks(input_rasters, block_rows=512, change_dtype=True, align_to_internal_blocks=True):
+    """
+    Iterate over matching row-block windows of multiple aligned rasters (same grid) at once. Only one block of each
+    raster is kept in memory at a time.
+
+    :param input_rasters: List of input rasters. Each item can be a raster filepath (band 1 is read), a
+                          (raster filepath, band) tuple or a reader function (see read_raster_source()), e.g. a
+                          monthly slice of a datacube. At least one item must be a raster file.
+    :param block_rows: Number of rows (full raster width) per block. Rounded to the internal block height of the first
+                       raster file (if align_to_internal_blocks=True). Default set to 512.
+    :param change_dtype: Set to True if want to change block arrays' data type to float and set nodata to nan
+                         (same as read_raster_arr_object()). Reader functions always return float arrays.
+                         Default set to True.
+    :param align_to_internal_blocks: Set to False to use block_rows as it is (not rounded to the internal block
+                                     height of the first raster file). Default set to True.
+
+    :return: A generator of (rasterio window, list of block arrays in input_rasters order).
+    """
+    first_raster = _first_raster_filepath(input_rasters)
+
+    # raster files are opened once, reader functions are called as they are
+    raster_bands = [raster if (callable(raster) or isinstance(raster, tuple)) else (raster, 1)
+                    for raster in input_rasters]
+    raster_files = [None if callable(raster) else rio.open(raster[0]) for raster in raster_bands]
+
+    try:
+        with rio.open(first_raster) as ref_file:
+            height, width = ref_file.height, ref_file.width
+            rows = _get_block_rows(ref_file, block_rows) if align_to_internal_blocks else block_rows
+
+        for raster_file in raster_files:
+            if raster_file is not None and (raster_file.height, raster_file.width) != (height, width):
+                raise ValueError(f'{raster_file.name} is not aligned with {first_raster}')
+
+        for row_off in range(0, height, rows):
+            window = Window(col_off=0, row_off=row_off, width=width, height=min(rows, height - row_off))
+
+            block_arrs = []
+            for raster_file, raster in zip(raster_files, raster_bands):
+                if raster_file is None:
+                    block_arrs.append(raster(window=window))
+                    continue
+
+                block_arr = raster_file.read(raster[1], window=window)
+                if change_dtype:
+                    block_arr = block_arr.astype(np.float32)
+                    if raster_file.nodata:
+                        block_arr[np.isclose(block_arr, raster_file.nodata)] = np.nan
+                block_arrs.append(block_arr)
+
+            yield window, block_arrs
+    finally:
+        for raster_file in raster_files:
+            if raster_file is not None:
+                raster_file.close()
+
+
+def write_raster_by_blocks(input_rasters, output_rasters, block_function, block_rows=512, dtype=np.float32,
+                           nodata=no_data_value):
+    """
+    Apply a function block by block over multiple aligned rasters and write the result(s) block by block. Peak memory
+    depends on block_rows, not on the raster size or the number of input rasters.
+
+    :param input_rasters: List of input rasters. Each item can be a raster filepath (band 1 is read), a
+                          (raster filepath, band) tuple or a reader function (see read_raster_source()). Output
+                          rasters take grid info from the first input raster file.
+    :param output_rasters: Filepath of output raster or a list of output raster filepaths.
+    :param block_function: Function that takes the list of block arrays (in input_rasters order) and returns a block
+                           array (or a list of block arrays, one for each output raster).
+    :param block_rows: Number of rows (full raster width) per block. Default set to 512.
+    :param dtype: Output raster data type. Default set to np.float32.
+    :param nodata: no_data_value set as -9999.
+
+    :return: Filepath of output raster or a list of output raster filepaths.
+    """
+    single_output = isinstance(output_rasters, str)
+    output_raster_list = [output_rasters] if single_output else output_rasters
+
+    first_raster = _first_raster_filepath(input_rasters)
+    with rio.open(first_raster) as src:
+        profile = {'driver': 'GTiff', 'height': src.height, 'width': src.width, 'count': 1, 'dtype': dtype,
+                   'crs': src.crs, 'transform': src.transform, 'nodata': nodata}
+    profile.update(get_raster_creation_options(dtype))
+
+    # for tiled outputs, blocks are aligned with the output tiles so that each tile is written (compressed) once
+    align_to_input_blocks = True
+    if profile.get('tiled'):
+        tile_size = profile['blockysize']
+        block_rows = max(tile_size, (block_rows // tile_size) * tile_size)
+        align_to_input_blocks = False
+
+    dst_files = [rio.open(output_raster, 'w', **profile) for output_raster in output_raster_list]
+    try:
+        for window, block_arrs in iter_raster_blocks(input_rasters, block_rows=block_rows,
+                                                     align_to_internal_blocks=align_to_input_blocks):
+            block_results = block_function(block_arrs)
+            if single_output:
+                block_results = [block_results]
+
+            for dst, block_result in zip(dst_files, block_results):
+                dst.write(block_result.astype(dtype), 1, window=window)
+    finally:
+        for dst in dst_files:
+            dst.close()
+
+    for output_raster in output_raster_list:
+        finalize_raster_output(output_raster)
+
+    return output_rasters
+
+
 def mask_raster_by_extent(input_raster, ref_file, output_dir, raster_name, invert=False, crop=True,
                            nodata=no_data_value):
     """
@@ -133,9 +581,109 @@ def mask_raster_by_extent(input_raster, ref_file, output_dir, raster_name, inver
     return output_raster
 
 
+def _mosaic_rasters_with_vrt(input_raster_list, out_raster, ref_raster=WestUS_raster, dtype=None,
+                             resampling_method='nearest', mosaicing_method='first', resolution=None,
+                             nodata=no_data_value, mask_by_ref=True, block_rows=512):
+    """
+    Mosaics rasters lazily through GDAL VRTs. The input rasters are combined in a (in-memory) VRT, which is warped to
+    the reference raster extent as another VRT. Only the final output is materialized, block by block, so neither the
+    input rasters nor a full-extent merged raster are ever read fully into memory.
+
+    :param input_raster_list: A list of input rasters to merge/mosaic.
+    :param out_raster: Filepath of output raster.
+    :param ref_raster: Reference raster filepath. Set default to WestUS_raster.
+    :param dtype: Output raster data type. Default set to None to use the first input raster's data type.
+    :param resampling_method: Resampling method. Can take 'nearest' or 'bilinear'. Default set to 'nearest'.
+    :param mosaicing_method: Mosaicing method. Can be 'first' (value of the first raster in the list where rasters
+                             overlap) or 'max' or 'min'. Default set to 'first'.
+    :param resolution: Resolution of the output raster. Default set to None to use the first input raster's resolution.
+    :param nodata: no_data_value set as -9999.
+    :param mask_by_ref: Set to True to set pixels outside reference raster's valid pixels to nodata.
+    :param block_rows: Number of rows (full raster width) read and written per block. Default set to 512.
+
+    :return: Filepath of mosaiced raster.
+    """
+    if mosaicing_method not in ('first', 'max', 'min'):
+        raise ValueError("mosaicing_method must be 'first' or 'max' or 'min'")
+
+    ref_grid = get_ref_grid(ref_raster)
+
+    with rio.open(input_raster_list[0]) as first_raster:
+        if dtype is None:
+            dtype = first_raster.dtypes[0]
+        if resolution is None:
+            resolution = first_raster.res[0]
+
+    vrt_name = os.path.splitext(os.path.basename(out_raster))[0]
+    mosaic_vrt = f'/vsimem/{vrt_name}_mosaic.vrt'
+    warped_vrt = f'/vsimem/{vrt_name}_warped.vrt'
+
+    # 'first' - a VRT draws its sources in order (later sources on top), so the list is reversed to keep the first
+    # raster's value where rasters overlap.
+    # 'max'/'min' - each raster becomes a separate band, reduced block by block after warping.
+    if mosaicing_method == 'first':
+        vrt_ds = gdal.BuildVRT(mosaic_vrt, list(reversed(input_raster_list)))
+    else:
+        vrt_ds = gdal.BuildVRT(mosaic_vrt, list(input_raster_list), separate=True)
+
+    gdal_resampling = {'nearest': 'near', 'bilinear': 'bilinear'}[resampling_method]
+    left, bottom, right, top = ref_grid.bounds
+    warped_ds = gdal.Warp(destNameOrDestDS=warped_vrt, srcDSOrSrcDSTab=vrt_ds, format='VRT',
+                          dstSRS=ref_grid.crs.to_wkt(), outputBounds=(left, bottom, right, top),
+                          xRes=resolution, yRes=resolution, resampleAlg=gdal_resampling,
+                          dstNodata=nodata, outputType=gdal.GDT_Float32)
+
+    height, width = warped_ds.RasterYSize, warped_ds.RasterXSize
+    mask_by_ref = mask_by_ref and (height, width) == ref_grid.shape
+
+    profile = {'driver': 'GTiff', 'height': height, 'width': width, 'count': 1, 'dtype': dtype,
+               'crs': ref_grid.crs, 'transform': Affine.from_gdal(*warped_ds.GetGeoTransform()), 'nodata': nodata}
+    profile.update(get_raster_creation_options(dtype))
+
+    # for tiled outputs, blocks are aligned with the output tiles so that each tile is written (compressed) once
+    if profile.get('tiled'):
+        tile_size = profile['blockysize']
+        block_rows = max(tile_size, (block_rows // tile_size) * tile_size)
+
+    bands = [warped_ds.GetRasterBand(band) for band in range(1, warped_ds.RasterCount + 1)]
+
+    try:
+        with rio.open(out_raster, 'w', **profile) as dst:
+            for row_off in range(0, height, block_rows):
+                rows = min(block_rows, height - row_off)
+
+                block_arrs = []
+                for band in bands:
+                    block_arr = band.ReadAsArray(0, row_off, width, rows).astype(np.float32)
+                    block_arr[block_arr == nodata] = np.nan
+                    block_arrs.append(block_arr)
+
+                if mosaicing_method == 'first':
+                    mosaic_arr = block_arrs[0]
+                elif mosaicing_method == 'max':
+                    mosaic_arr = np.fmax.reduce(block_arrs)
+                else:
+                    mosaic_arr = np.fmin.reduce(block_arrs)
+
+                mosaic_arr[np.isnan(mosaic_arr)] = nodata
+                if mask_by_ref:
+                    mosaic_arr[~ref_grid.valid_mask[row_off: row_off + rows]] = nodata
+
+                dst.write(mosaic_arr.astype(dtype), 1,
+                          window=Window(col_off=0, row_off=row_off, width=width, height=rows))
+    finally:
+        del bands, warped_ds, vrt_ds
+        gdal.Unlink(warped_vrt)
+        gdal.Unlink(mosaic_vrt)
+
+    finalize_raster_output(out_raster)
+
+    return out_raster
+
+
 def mosaic_rasters_from_directory(input_dir, output_dir, raster_name, ref_raster=WestUS_raster, search_by="*.tif",
                                   dtype=None, resampling_method='nearest',mosaicing_method='first',
-                                  resolution=None, nodata=no_data_value):
+                                  resolution=None, nodata=no_data_value, use_vrt=False):
     """
     Mosaics multiple rasters into a single raster from a directory (rasters have to be in the same directory).
 
@@ -150,10 +698,21 @@ def mosaic_rasters_from_directory(input_dir, output_dir, raster_name, ref_raster
     :param mosaicing_method: Mosaicing method. Can be 'first' or 'max' or 'min'. Default set to 'first'.
     :param resolution: Resolution of the output raster. Default set to None to use first input raster's resolution.
     :param nodata: no_data_value set as -9999.
+    :param use_vrt: Set to True to mosaic lazily through GDAL VRTs (see _mosaic_rasters_with_vrt()). Only the output
+                    raster is materialized and the mosaiced array isn't returned (None). Default set to False.
 
     :return: Mosaiced raster array and filepath of mosaiced raster.
     """
     input_rasters = glob(os.path.join(input_dir, search_by))
+
+    if use_vrt:
+        makedirs([output_dir])
+        out_raster = _mosaic_rasters_with_vrt(input_rasters, os.path.join(output_dir, raster_name),
+                                              ref_raster=ref_raster, dtype=dtype, resampling_method=resampling_method,
+                                              mosaicing_method=mosaicing_method, resolution=resolution,
+                                              nodata=nodata, mask_by_ref=False)
+        return None, out_raster
+
     raster_list = []
     for raster in input_rasters:
         arr, file = read_raster_arr_object(raster)
@@ -166,7 +725,7 @@ def mosaic_rasters_from_directory(input_dir, output_dir, raster_name, ref_raster
         resampling_method = Resampling.bilinear
 
     # reference raster
-    ref_arr, ref_file = read_raster_arr_object(ref_raster)
+    ref_file = get_ref_grid(ref_raster)
 
     # merging
     if resolution is None:  # will use first input raster's resolution
@@ -192,7 +751,7 @@ def mosaic_rasters_from_directory(input_dir, output_dir, raster_name, ref_raster
 
 def mosaic_rasters_list(input_raster_list, output_dir, raster_name, ref_raster=WestUS_raster, dtype=None,
                         resampling_method='nearest', mosaicing_method='first', resolution=None,
-                        nodata=no_data_value):
+                        nodata=no_data_value, use_vrt=False):
     """
     Mosaics a list of input rasters.
 
@@ -207,9 +766,19 @@ def mosaic_rasters_list(input_raster_list, output_dir, raster_name, ref_raster=W
     :param mosaicing_method: Mosaicing method. Can be 'first' or 'max' or 'min'. Default set to 'first'.
     :param resolution: Resolution of the output raster. Default set to None to use the first input raster's resolution.
     :param nodata: no_data_value set as -9999.
+    :param use_vrt: Set to True to mosaic lazily through GDAL VRTs (see _mosaic_rasters_with_vrt()). Only the output
+                    raster is materialized and the mosaiced array isn't returned (None). Default set to False.
 
     :return: Mosaiced raster array and filepath of mosaiced raster.
     """
+    if use_vrt:
+        makedirs([output_dir])
+        out_raster = _mosaic_rasters_with_vrt(input_raster_list, os.path.join(output_dir, raster_name),
+                                              ref_raster=ref_raster, dtype=dtype, resampling_method=resampling_method,
+                                              mosaicing_method=mosaicing_method, resolution=resolution,
+                                              nodata=nodata, mask_by_ref=True)
+        return None, out_raster
+
     raster_file_list = []  # a list to store raster file information
     for raster in input_raster_list:
         arr, file = read_raster_arr_object(raster)
@@ -222,7 +791,8 @@ def mosaic_rasters_list(input_raster_list, output_dir, raster_name, ref_raster=W
         resampling_method = Resampling.bilinear
 
     # reference raster
-    ref_arr, ref_file = read_raster_arr_object(ref_raster)
+    ref_grid = get_ref_grid(ref_raster)
+    ref_arr, ref_file = ref_grid.arr, ref_grid
 
     # merging
     if resolution is None:  # will use first input raster's resolution
@@ -247,24 +817,104 @@ def mosaic_rasters_list(input_raster_list, output_dir, raster_name, ref_raster=W
     return merged_arr, out_raster
 
 
+def _warp_raster(src_ds, dest, input_shape, clip, resample, clip_and_resample, targetaligned, resample_algorithm,
+                 resolution, crs, output_datatype, use_ref_width_height, ref_raster, multithread=False,
+                 warp_memory_limit=None):
+    """
+    Run a single clip/resample/reproject gdal.Warp step (see clip_resample_reproject_raster() for the parameters).
+
+    :param src_ds: Input gdal dataset.
+    :param dest: Output filepath. Set to None to warp into an in-memory (MEM driver) dataset.
+
+    :return: Output gdal dataset.
+    """
+    warp_kwargs = {'dstSRS': crs, 'dstNodata': no_data_value, 'outputType': output_datatype}
+
+    if dest is None:  # in-memory dataset
+        dest = ''
+        warp_kwargs['format'] = 'MEM'
+    else:
+        warp_kwargs['creationOptions'] = get_gdal_creation_options(output_datatype)
+
+    if multithread:
+        warp_kwargs['multithread'] = True
+        warp_kwargs['warpOptions'] = ['NUM_THREADS=ALL_CPUS']
+    if warp_memory_limit is not None:
+        warp_kwargs['warpMemoryLimit'] = warp_memory_limit
+
+    if clip:  # set resample, clip_and_resample = False
+        # resolution argument can be None in clip operation
+        if use_ref_width_height:
+            # have to provide a reference raster
+            # resolution can be set to None
+            height, width = get_ref_grid(ref_raster).shape
+            processed_data = gdal.Warp(destNameOrDestDS=dest, srcDSOrSrcDSTab=src_ds,
+                                       targetAlignedPixels=False, width=width, height=height,
+                                       cutlineDSName=input_shape, cropToCutline=True, **warp_kwargs)
+        else:
+            _, xres, _, _, _, yres = src_ds.GetGeoTransform()
+            processed_data = gdal.Warp(destNameOrDestDS=dest, srcDSOrSrcDSTab=src_ds,
+                                       targetAlignedPixels=targetaligned, xRes=xres, yRes=yres,
+                                       cutlineDSName=input_shape, cropToCutline=True, **warp_kwargs)
+
+    elif resample:  # set clip, clip_and_resample = False
+        if use_ref_width_height:
+            # have to provide a reference raster
+            # resolution can be set to None
+            # input_shape can be set to None
+            height, width = get_ref_grid(ref_raster).shape
+            processed_data = gdal.Warp(destNameOrDestDS=dest, srcDSOrSrcDSTab=src_ds,
+                                       targetAlignedPixels=False, width=width, height=height,
+                                       resampleAlg=resample_algorithm, **warp_kwargs)
+        else:
+            # have to provide a resolution value in argument
+            # input_shape can be set to None
+            processed_data = gdal.Warp(destNameOrDestDS=dest, srcDSOrSrcDSTab=src_ds,
+                                       targetAlignedPixels=targetaligned, xRes=resolution, yRes=resolution,
+                                       resampleAlg=resample_algorithm, **warp_kwargs)
+
+    elif clip_and_resample:  # set clip=False, resample = False
+        if use_ref_width_height:
+            # have to provide a reference raster
+            # resolution can be set to None
+            height, width = get_ref_grid(ref_raster).shape
+            processed_data = gdal.Warp(destNameOrDestDS=dest, srcDSOrSrcDSTab=src_ds,
+                                       targetAlignedPixels=False, width=width, height=height,
+                                       cutlineDSName=input_shape, cropToCutline=True,
+                                       resampleAlg=resample_algorithm, **warp_kwargs)
+        else:
+            # argument must have input_shape and resolution value
+            processed_data = gdal.Warp(destNameOrDestDS=dest, srcDSOrSrcDSTab=src_ds,
+                                       targetAlignedPixels=targetaligned, xRes=resolution, yRes=resolution,
+                                       cutlineDSName=input_shape, cropToCutline=True,
+                                       resampleAlg=resample_algorithm, **warp_kwargs)
+    else:
+        raise ValueError('one of clip, resample, clip_and_resample must be True')
+
+    return processed_data
+
+
 def clip_resample_reproject_raster(input_raster, input_shape, output_raster_dir,
                                    keyword=' ', raster_name=None,
                                    clip=False, resample=False, clip_and_resample=True,
                                    targetaligned=True, resample_algorithm='near',
                                    resolution=None,
                                    crs='EPSG:4269', output_datatype=gdal.GDT_Float32,
-                                   use_ref_width_height=False, ref_raster=WestUS_raster):
+                                   use_ref_width_height=False, ref_raster=WestUS_raster,
+                                   warp_steps=None, multithread=False, warp_memory_limit=None):
     """
     Clips, resamples, reprojects a given raster using input shapefile, resolution, and crs.
 
     ** If resolution is None, must provide a left_zone_ref_raster. One of resolution and left_zone_ref_raster must be available.
 
-    :param input_raster: Input raster filepath.
+    :param input_raster: Input raster filepath. Can also be a gdal dataset (e.g. an in-memory dataset returned by
+                         this function).
     :param input_shape: Input shape filepath. Set to None when resample=True.
     :param keyword: 'str' keyword to attach in front of processed raster. Default set to ' '.
                     ** Only works when raster_name = None.
     :param raster_name: Output raster name. Default set to None to set raster name from the input raster.
-    :param output_raster_dir: Output directory filepath.
+    :param output_raster_dir: Output directory filepath. Set to None to keep the output in memory (MEM driver gdal
+                              dataset is returned instead of a filepath).
     :param clip: Set to True to clip only. When True, resample and clip_and_resample should be False. resolution can be
                  used as None (Default) in this case.
     :param resample: Set to True to resample only. When True, clip and clip_and_resample should be False. Need to set
@@ -282,81 +932,73 @@ def clip_resample_reproject_raster(input_raster, input_shape, output_raster_dir,
     :param use_ref_width_height: Set to True to use reference raster's widht+height for resampling/clipping,
                                  instead of a particular assigned resolution. 'resolution' can be set to None.
     :param ref_raster: Filepath of reference raster to be used for assigning processed raster's width+height.
-
-    :return: Processed raster filepath.
+    :param warp_steps: A list of dictionaries to run multiple warp steps in one call. Each dictionary can have any of
+                       the input_shape, clip, resample, clip_and_resample, targetaligned, resample_algorithm,
+                       resolution, crs, output_datatype, use_ref_width_height, ref_raster keys to override this
+                       function's arguments for that step. Interim steps are kept in memory, only the last step is
+                       written to output_raster_dir. Default set to None to run a single step with this function's
+                       arguments.
+    :param multithread: Set to True to use multithreaded warping (using all CPUs). Default set to False.
+    :param warp_memory_limit: Working memory (in MB) for gdal warping. Default set to None to use GDAL's default.
+
+    :return: Processed raster filepath (or in-memory gdal dataset if output_raster_dir is None).
     """
-    if raster_name is None:  # if raster_name is None will set raster name from the input raster.
-        raster_name = os.path.basename(input_raster)
-        output_raster_name = keyword + '_' + raster_name
-        if keyword == ' ':
+    if isinstance(input_raster, gdal.Dataset):
+        raster_file = input_raster
+        input_raster_name = os.path.basename(input_raster.GetDescription())
+    else:
+        # opening input raster
+        raster_file = gdal.Open(input_raster)
+        input_raster_name = os.path.basename(input_raster)
+
+    if output_raster_dir is not None:
+        if raster_name is None:  # if raster_name is None will set raster name from the input raster.
+            raster_name = input_raster_name
+            output_raster_name = keyword + '_' + raster_name
+            if keyword == ' ':
+                output_raster_name = raster_name
+        else:  # to assign assigned raster_name. If None, will figure out raster_name using the first conditional if.
+            if '.tif' not in raster_name:
+                raster_name = raster_name + '.tif'
             output_raster_name = raster_name
-    else:  # to assign assigned raster_name. If None, will figure out raster_name using the first conditional if.
-        if '.tif' not in raster_name:
-            raster_name = raster_name + '.tif'
-        output_raster_name = raster_name
 
-    # creating output directory
-    makedirs([output_raster_dir])
-    output_filepath = os.path.join(output_raster_dir, output_raster_name)
+        # creating output directory
+        makedirs([output_raster_dir])
+        output_filepath = os.path.join(output_raster_dir, output_raster_name)
+    else:
+        output_filepath = None
 
-    # opening input raster
-    raster_file = gdal.Open(input_raster)
+    step_args = {'input_shape': input_shape, 'clip': clip, 'resample': resample,
+                 'clip_and_resample': clip_and_resample, 'targetaligned': targetaligned,
+                 'resample_algorithm': resample_algorithm, 'resolution': resolution, 'crs': crs,
+                 'output_datatype': output_datatype, 'use_ref_width_height': use_ref_width_height,
+                 'ref_raster': ref_raster}
 
-    if clip:  # set resample, clip_and_resample = False
-        # resolution argument can be None in clip operation
-        if use_ref_width_height:
-            # have to provide a reference raster
-            # resolution can be set to None
-            ref_arr = read_raster_arr_object(ref_raster, get_file=False)
-            height, width = ref_arr.shape
-            processed_data = gdal.Warp(destNameOrDestDS=output_filepath, srcDSOrSrcDSTab=raster_file, dstSRS=crs,
-                                       targetAlignedPixels=False, width=width, height=height,
-                                       cutlineDSName=input_shape,
-                                       cropToCutline=True, dstNodata=no_data_value, outputType=output_datatype)
-        else:
-            _, xres, _, _, _, yres = raster_file.GetGeoTransform()
-            processed_data = gdal.Warp(destNameOrDestDS=output_filepath, srcDSOrSrcDSTab=raster_file, dstSRS=crs,
-                                       targetAlignedPixels=targetaligned, xRes=xres, yRes=yres,
-                                       cutlineDSName=input_shape, cropToCutline=True, dstNodata=no_data_value,
-                                       outputType=output_datatype)
+    if warp_steps is None:
+        warp_steps = [{}]
 
-    elif resample:  # set clip, clip_and_resample = False
-        if use_ref_width_height:
-            # have to provide a reference raster
-            # resolution can be set to None
-            # input_shape can be set to None
-            ref_arr = read_raster_arr_object(ref_raster, get_file=False)
-            height, width = ref_arr.shape
-            processed_data = gdal.Warp(destNameOrDestDS=output_filepath, srcDSOrSrcDSTab=raster_file, dstSRS=crs,
-                                       targetAlignedPixels=False, width=width, height=height,
-                                       dstNodata=no_data_value, resampleAlg=resample_algorithm,
-                                       outputType=output_datatype)
-        else:
-            # have to provide a resolution value in argument
-            # input_shape can be set to None
-            processed_data = gdal.Warp(destNameOrDestDS=output_filepath, srcDSOrSrcDSTab=raster_file, dstSRS=crs,
-                                       targetAlignedPixels=targetaligned, xRes=resolution, yRes=resolution,
-                                       dstNodata=no_data_value, resampleAlg=resample_algorithm,
-                                       outputType=output_datatype)
+    processed_data = raster_file
+    for step_num, warp_step in enumerate(warp_steps):
+        # interim steps are warped into memory, the last one into output_filepath
+        is_last_step = step_num == len(warp_steps) - 1
+        dest = output_filepath if is_last_step else None
+
+        # a step's own clip/resample/clip_and_resample flags replace the function's ones
+        args = dict(step_args)
+        if any(key in warp_step for key in ('clip', 'resample', 'clip_and_resample')):
+            args.update({'clip': False, 'resample': False, 'clip_and_resample': False})
+        args.update(warp_step)
+
+        processed_data = _warp_raster(processed_data, dest, multithread=multithread,
+                                      warp_memory_limit=warp_memory_limit, **args)
+
+    if output_filepath is None:
+        return processed_data
 
-    elif clip_and_resample:  # set clip=False, resample = False
-        if use_ref_width_height:
-            # have to provide a reference raster
-            # resolution can be set to None
-            ref_arr = read_raster_arr_object(ref_raster, get_file=False)
-            height, width = ref_arr.shape
-            processed_data = gdal.Warp(destNameOrDestDS=output_filepath, srcDSOrSrcDSTab=raster_file, dstSRS=crs,
-                                       targetAlignedPixels=False, width=width, height=height,
-                                       cutlineDSName=input_shape, cropToCutline=True, dstNodata=no_data_value,
-                                       resampleAlg=resample_algorithm, outputType=output_datatype)
-        else:
-            # argument must have input_shape and resolution value
-            processed_data = gdal.Warp(destNameOrDestDS=output_filepath, srcDSOrSrcDSTab=raster_file, dstSRS=crs,
-                                       targetAlignedPixels=targetaligned, xRes=resolution, yRes=resolution,
-                                       cutlineDSName=input_shape, cropToCutline=True, dstNodata=no_data_value,
-                                       resampleAlg=resample_algorithm, outputType=output_datatype)
     del processed_data
 
+    finalize_raster_output(output_filepath)
+
     return output_filepath
 
 
@@ -379,8 +1021,7 @@ def shapefile_to_raster(input_shape, output_dir, raster_name, burnvalue=None, us
 
     :return: Filepath of created raster.
     """
-    ref_arr, ref_file = read_raster_arr_object(ref_raster)
-    total_bounds = ref_file.bounds
+    total_bounds = get_ref_grid(ref_raster).bounds
 
     makedirs([output_dir])
     output_raster = os.path.join(output_dir, raster_name)
@@ -391,14 +1032,18 @@ def shapefile_to_raster(input_shape, output_dir, raster_name, burnvalue=None, us
             layer_name = os.path.basename(input_shape).split('.')[0]
             args = ['-l', layer_name, '-a', attribute, '-tr', str(resolution), str(resolution), '-te', str(minx),
                     str(miny), str(maxx), str(maxy), '-init', str(0.0), '-add', '-ot', 'Float32', '-of', 'GTiff',
-                    '-a_nodata', str(no_data_value), input_shape, output_raster]
+                    '-a_nodata', str(no_data_value)]
+            for creation_option in get_gdal_creation_options(gdal.GDT_Float32):
+                args.extend(['-co', creation_option])
+            args.extend([input_shape, output_raster])
             sys_call = make_gdal_sys_call(gdal_command='gdal_rasterize', args=args)
             subprocess.call(sys_call)
 
         else:
             raster_options = gdal.RasterizeOptions(format='Gtiff', outputBounds=list(total_bounds),
                                                    outputType=gdal.GDT_Float32, xRes=resolution, yRes=resolution,
-                                                   noData=no_data_value, attribute=attribute, allTouched=alltouched)
+                                                   noData=no_data_value, attribute=attribute, allTouched=alltouched,
+                                                   creationOptions=get_gdal_creation_options(gdal.GDT_Float32))
             gdal.Rasterize(destNameOrDestDS=output_raster, srcDS=input_shape, options=raster_options,
                            resolution=resolution)
 
@@ -406,25 +1051,148 @@ def shapefile_to_raster(input_shape, output_dir, raster_name, burnvalue=None, us
         raster_options = gdal.RasterizeOptions(format='Gtiff', outputBounds=list(total_bounds),
                                                outputType=gdal.GDT_Float32, xRes=resolution, yRes=resolution,
                                                noData=no_data_value, burnValues=burnvalue,
-                                               allTouched=alltouched)
+                                               allTouched=alltouched,
+                                               creationOptions=get_gdal_creation_options(gdal.GDT_Float32))
         gdal.Rasterize(destNameOrDestDS=output_raster, srcDS=input_shape, options=raster_options,
                        resolution=resolution)
 
+    finalize_raster_output(output_raster)
+
     return output_raster
 
 
+def accumulate_rasters(input_rasters, stats=('sum',), nan_policy='skip', propagate_stats=()):
+    """
+    Reduce multiple aligned rasters to statistic arrays in a single streaming pass. Each raster is read once and
+    accumulated in place into preallocated buffers, so memory use does not grow with the number of rasters.
+
+    nan_policy options -
+    'skip' - nan values are left out. count is the number of valid (not nan) values of a pixel and mean is
+             sum / count. A pixel with no valid value is nan in sum, mean, min, max and std.
+    'propagate' - a pixel is nan in sum, mean, min, max and std if it is nan in any raster (same as numpy sum/mean).
+                  count is the number of rasters.
+    'zero' - nan values are treated as 0. count is the number of rasters.
+
+    :param input_rasters: List of input rasters. Each item can be a raster filepath (band 1 is read), a
+                          (raster filepath, band) tuple or a reader function (see read_raster_source()).
+    :param stats: Tuple/list of statistics to compute. Can take 'sum', 'mean', 'min', 'max', 'count', 'std'
+                  (population standard deviation). Default set to ('sum',).
+    :param nan_policy: How to handle nan values. Can take 'skip', 'propagate', 'zero'. Default set to 'skip'.
+    :param propagate_stats: Tuple/list of statistics (from stats) that are set to nan at pixels that are nan in any
+                            raster, whatever the nan_policy. E.g. ('sum',) with the 'skip' nan_policy to keep
+                            partial sums out while mean and count skip nan. Default set to () for none.
+
+    :return: A dictionary with statistics as keys and arrays as values. sum, mean, min, max, std are float32 arrays,
+             count is an uint16 array.
+    """
+    if nan_policy not in nan_policies:
+        raise ValueError(f'nan_policy must be one of {nan_policies}')
+
+    for stat in stats:
+        if stat not in raster_stats:
+            raise ValueError(f'{stat} is not a valid statistic. Must be one of {raster_stats}')
+
+    need_sum = ('sum' in stats) or ('mean' in stats) or ('std' in stats)
+    need_sumsq = 'std' in stats
+
+    # 'skip' ignores nan in min/max (np.fmin/np.fmax), 'propagate' keeps it (np.minimum/np.maximum)
+    min_func, max_func = (np.minimum, np.maximum) if nan_policy == 'propagate' else (np.fmin, np.fmax)
+
+    sum_arr, sumsq_arr, count_arr, min_arr, max_arr, nan_mask, any_nan_mask = None, None, None, None, None, None, None
+    for raster in input_rasters:
+        arr = read_raster_source(raster)
+
+        # buffers are allocated once, with the first raster
+        if count_arr is None:
+            count_arr = np.zeros(arr.shape, dtype=np.uint16)
+            nan_mask = np.empty(arr.shape, dtype=bool)
+            if len(propagate_stats) > 0:
+                any_nan_mask = np.zeros(arr.shape, dtype=bool)
+            if need_sum:
+                sum_arr = np.zeros(arr.shape, dtype=np.float64)
+            if need_sumsq:
+                sumsq_arr = np.zeros(arr.shape, dtype=np.float64)
+
+        np.isnan(arr, out=nan_mask)
+        if any_nan_mask is not None:
+            any_nan_mask |= nan_mask
+        if nan_policy == 'zero':
+            np.copyto(arr, 0, where=nan_mask)
+
+        if 'min' in stats:
+            if min_arr is None:
+                min_arr = arr.copy()
+            else:
+                min_func(min_arr, arr, out=min_arr)
+
+        if 'max' in stats:
+            if max_arr is None:
+                max_arr = arr.copy()
+            else:
+                max_func(max_arr, arr, out=max_arr)
+
+        count_arr += 1
+        if nan_policy == 'skip':
+            np.subtract(count_arr, nan_mask, out=count_arr, casting='unsafe')
+            np.copyto(arr, 0, where=nan_mask)
+
+        if need_sum:
+            sum_arr += arr
+        if need_sumsq:
+            sumsq_arr += np.square(arr, dtype=np.float64)
+
+    if count_arr is None:
+        raise ValueError('no input rasters to accumulate')
+
+    stat_arrs = {}
+    for stat in stats:
+        if stat == 'sum':
+            stat_arrs[stat] = sum_arr.astype(np.float32)
+        elif stat == 'mean':
+            stat_arrs[stat] = (sum_arr / np.maximum(count_arr, 1)).astype(np.float32)
+        elif stat == 'min':
+            stat_arrs[stat] = min_arr
+        elif stat == 'max':
+            stat_arrs[stat] = max_arr
+        elif stat == 'count':
+            stat_arrs[stat] = count_arr
+        elif stat == 'std':
+            # population variance from the sums (clipped at 0 for floating point round-off)
+            mean_arr = sum_arr / np.maximum(count_arr, 1)
+            var_arr = np.maximum(sumsq_arr / np.maximum(count_arr, 1) - np.square(mean_arr), 0)
+            stat_arrs[stat] = np.sqrt(var_arr).astype(np.float32)
+
+    # pixels without any valid value
+    if nan_policy == 'skip':
+        no_valid_mask = count_arr == 0
+        for stat in ('sum', 'mean', 'std'):
+            if stat in stat_arrs:
+                stat_arrs[stat][no_valid_mask] = np.nan
+
+    # statistics with nan propagated
+    for stat in propagate_stats:
+        if stat == 'count':
+            raise ValueError('nan can not be propagated to count')
+        stat_arrs[stat][any_nan_mask] = np.nan
+
+    return stat_arrs
+
+
 def sum_rasters(raster_dir, output_raster, raster_list=None, search_by='*.tif', ref_raster=WestUS_raster,
-                nodata=no_data_value):
+                nodata=no_data_value, nan_policy='propagate'):
     """
     Sum multiple rasters together. Can take raster directory or list of rasters as input.
 
     :param raster_dir: Filepath of input rasters' directory. When not using (using raster_list param) set to None.
     :param raster_list: A list of rasters to sum. Can alternatively used with raster_dir. Default set to None. While
-                        using set raster_dir=None.
+                        using set raster_dir=None. Items can also be (raster filepath, band) tuples or reader functions
+                        (see read_raster_source()).
     :param output_raster: Filepath of output raster.
     :param search_by: search by criteria to select raster from a directory.
     :param ref_raster: Reference raster filepath. Set default to WestUS_raster.
     :param nodata: no_data_value set as -9999.
+    :param nan_policy: How to handle nan (nodata) values while summing. Can take 'propagate', 'skip', 'zero' (see
+                       accumulate_rasters()). Default set to 'propagate'.
 
     :return: Summed array and output raster.
     """
@@ -435,17 +1203,10 @@ def sum_rasters(raster_dir, output_raster, raster_list=None, search_by='*.tif',
     else:
         input_rasters = raster_list
 
-    sum_arr = None
-    for raster in input_rasters:
-        if raster == input_rasters[0]:
-            arr = read_raster_arr_object(raster, get_file=False)
-            sum_arr = arr
-        else:
-            arr = read_raster_arr_object(raster, get_file=False)
-            sum_arr = np.sum(np.dstack((sum_arr, arr)), axis=2)
+    sum_arr = accumulate_rasters(input_rasters, stats=('sum',), nan_policy=nan_policy)['sum']
 
-    ref_arr, ref_file = read_raster_arr_object(ref_raster)
-    sum_arr[np.isnan(ref_arr)] = nodata  # setting nodata using reference raster
+    ref_file = get_ref_grid(ref_raster)
+    sum_arr[~ref_file.valid_mask] = nodata  # setting nodata using reference raster
 
     write_array_to_raster(raster_arr=sum_arr, raster_file=ref_file, transform=ref_file.transform,
                           output_path=output_raster)
@@ -454,17 +1215,21 @@ def sum_rasters(raster_dir, output_raster, raster_list=None, search_by='*.tif',
 
 
 def mean_rasters(raster_dir, output_raster, raster_list=None, search_by='*.tif', ref_raster=WestUS_raster,
-                 nodata=no_data_value):
+                 nodata=no_data_value, nan_policy='skip'):
     """
     Calculate mean of multiple rasters. Can take raster directory or list of rasters as input.
 
     :param raster_dir: Filepath of input rasters' directory. When not using (using raster_list param) set to None.
     :param raster_list: A list of rasters to sum. Can alternatively used with raster_dir. Default set to None. While
-                        using set raster_dir=None.
+                        using set raster_dir=None. Items can also be (raster filepath, band) tuples or reader functions
+                        (see read_raster_source()).
     :param output_raster: Filepath of output raster.
     :param search_by: search by criteria to select raster from a directory.
     :param ref_raster: Reference raster filepath. Set default to WestUS_raster.
     :param nodata: no_data_value set as -9999.
+    :param nan_policy: How to handle nan (nodata) values while averaging. Can take 'skip', 'propagate', 'zero' (see
+                       accumulate_rasters()). Default set to 'skip' to average over the valid (not nan) values of each
+                       pixel.
 
     :return: Mean raster.
     """
@@ -475,25 +1240,50 @@ def mean_rasters(raster_dir, output_raster, raster_list=None, search_by='*.tif',
     else:
         input_rasters = raster_list
 
-    mean_arr, file = None, None
-    val = 1
-    for raster in input_rasters:
-        if raster == input_rasters[0]:
-            arr = read_raster_arr_object(raster, get_file=False)
-            mean_arr = arr
-        else:
-            arr = read_raster_arr_object(raster, get_file=False)
-            mean_arr += arr
-            val += 1
-
-    mean_arr = mean_arr / val
-    ref_arr, ref_file = read_raster_arr_object(ref_raster)
-    mean_arr[np.isnan(ref_arr)] = nodata  # setting nodata using reference raster
+    mean_arr = accumulate_rasters(input_rasters, stats=('mean',), nan_policy=nan_policy)['mean']
+    ref_file = get_ref_grid(ref_raster)
+    mean_arr[~ref_file.valid_mask] = nodata  # setting nodata using reference raster
 
     write_array_to_raster(raster_arr=mean_arr, raster_file=ref_file, transform=ref_file.transform,
                           output_path=output_raster)
 
 
+def multi_stat_rasters(input_rasters, output_raster_dict, ref_raster=WestUS_raster, nodata=no_data_value,
+                       nan_policy='skip', propagate_stats=()):
+    """
+    Compute multiple statistics (e.g. sum, mean, count, std) of multiple rasters in a single pass (each input raster is
+    read once) and save each statistic as a raster.
+
+    :param input_rasters: List of input rasters. Each item can be a raster filepath (band 1 is read), a
+                          (raster filepath, band) tuple or a reader function (see read_raster_source()).
+    :param output_raster_dict: A dictionary with statistics as keys and output raster filepaths as values. Statistics
+                               can be 'sum', 'mean', 'min', 'max', 'count', 'std'. With the 'skip' nan_policy,
+                               'count' is the number of valid values of each pixel, which the mean is based on.
+    :param ref_raster: Reference raster filepath. Set default to WestUS_raster.
+    :param nodata: no_data_value set as -9999.
+    :param nan_policy: How to handle nan (nodata) values. Can take 'skip', 'propagate', 'zero' (see
+                       accumulate_rasters()). Default set to 'skip'.
+    :param propagate_stats: Tuple/list of statistics that are set to nodata at pixels that are nan in any raster,
+                            whatever the nan_policy (see accumulate_rasters()). Default set to () for none.
+
+    :return: A dictionary with statistics as keys and output raster filepaths as values.
+    """
+    stat_arrs = accumulate_rasters(input_rasters, stats=tuple(output_raster_dict.keys()), nan_policy=nan_policy,
+                                   propagate_stats=[stat for stat in propagate_stats if stat in output_raster_dict])
+    ref_file = get_ref_grid(ref_raster)
+
+    for stat, output_raster in output_raster_dict.items():
+        makedirs([os.path.dirname(output_raster)])
+
+        stat_arr = stat_arrs[stat].astype(np.float32)
+        stat_arr[~ref_file.valid_mask] = nodata  # setting nodata using reference raster
+
+        write_array_to_raster(raster_arr=stat_arr, raster_file=ref_file, transform=ref_file.transform,
+                              output_path=output_raster)
+
+    return output_raster_dict
+
+
 def filter_raster_on_threshold(input_raster, output_raster, threshold_value1, threshold_value2=None, assign_value=None,
                                nodata=no_data_value, refraster=WestUS_raster):
     """
@@ -511,7 +1301,8 @@ def filter_raster_on_threshold(input_raster, output_raster, threshold_value1, th
 
     :return: Output raster filepath.
     """
-    ref_arr, ref_file = read_raster_arr_object(refraster)
+    ref_file = get_ref_grid(refraster)
+    ref_arr = ref_file.arr
     input_arr = read_raster_arr_object(input_raster, get_file=False)
 
     mod_arr = None  # new array where the filtered array will be stored
@@ -533,6 +1324,59 @@ def filter_raster_on_threshold(input_raster, output_raster, threshold_value1, th
     return output_raster
 
 
+@lru_cache(maxsize=8)
+def get_lon_lat_vectors(transform, shape):
+    """
+    Get 1-D longitude (pixel center of each column) and latitude (pixel center of each row) vectors of a grid from its
+    affine transform. Cached per grid (transform and shape).
+
+    :param transform: Affine transformation matrix of the grid (north-up, no rotation).
+    :param shape: Shape (height, width) of the grid.
+
+    :return: Longitude vector (width,) and latitude vector (height,). Both are read-only float64 arrays.
+    """
+    height, width = shape
+    lon_vec = transform.c + (np.arange(width) + 0.5) * transform.a
+    lat_vec = transform.f + (np.arange(height) + 0.5) * transform.e
+
+    # shared by all functions, so made read-only
+    lon_vec.setflags(write=False)
+    lat_vec.setflags(write=False)
+
+    return lon_vec, lat_vec
+
+
+def get_lon_lat_grid(transform, shape):
+    """
+    Get 2-D longitude and latitude arrays of a grid. The arrays are broadcast (read-only) views of the cached 1-D
+    vectors, so no full-size array is created until they are used in a computation.
+
+    :param transform: Affine transformation matrix of the grid (north-up, no rotation).
+    :param shape: Shape (height, width) of the grid.
+
+    :return: Longitude and latitude arrays (views) of the grid shape.
+    """
+    lon_vec, lat_vec = get_lon_lat_vectors(transform, tuple(shape))
+
+    return np.broadcast_to(lon_vec[np.newaxis, :], shape), np.broadcast_to(lat_vec[:, np.newaxis], shape)
+
+
+def get_lon_lat_at_pixels(transform, shape, pixel_idx):
+    """
+    Get longitude and latitude of a subset of pixels (e.g. valid pixels) of a grid.
+
+    :param transform: Affine transformation matrix of the grid (north-up, no rotation).
+    :param shape: Shape (height, width) of the grid.
+    :param pixel_idx: Flat (row-major) indices of the pixels.
+
+    :return: Longitude and latitude arrays of the pixels.
+    """
+    lon_vec, lat_vec = get_lon_lat_vectors(transform, tuple(shape))
+    rows, cols = np.divmod(np.asarray(pixel_idx), shape[1])
+
+    return lon_vec[cols], lat_vec[rows]
+
+
 def make_lat_lon_array_from_raster(input_raster, nodata=-9999):
     """
     Make lat, lon array for each pixel using the input raster.
@@ -543,24 +1387,17 @@ def make_lat_lon_array_from_raster(input_raster, nodata=-9999):
 
     returns: Lat, lon array with nan value (-9999) applied.
     """
-    raster_file = rio.open(input_raster)
-    raster_arr = raster_file.read(1)
-
-    # calculating lat, lon of each cells centroid
-    height, width = raster_arr.shape
-    cols, rows = np.meshgrid(np.arange(width), np.arange(height))
-    xs, ys = rio.transform.xy(rows=rows, cols=cols, transform=raster_file.transform)
-
-    # flattening and reshaping to the input_raster's array size
-    xs = np.array(xs).flatten()
-    ys = np.array(ys).flatten()
+    with rio.open(input_raster) as raster_file:
+        raster_arr = raster_file.read(1)
+        transform = raster_file.transform
 
-    lon_arr = xs.reshape(raster_arr.shape)
-    lat_arr = ys.reshape(raster_arr.shape)
+    # lat, lon of each cells centroid from the (cached) 1-D lon, lat vectors of the grid
+    lon_grid, lat_grid = get_lon_lat_grid(transform, raster_arr.shape)
 
     # assigning no_data_value
-    lon_arr[raster_arr == nodata] = nodata
-    lat_arr[raster_arr == nodata] = nodata
+    nodata_mask = raster_arr == nodata
+    lon_arr = np.where(nodata_mask, nodata, lon_grid)
+    lat_arr = np.where(nodata_mask, nodata, lat_grid)
 
     return lon_arr, lat_arr
 
@@ -606,7 +1443,8 @@ def create_multiband_raster(input_files_list, output_file, nodata=no_data_value)
             count=len(input_files_list),
             crs=raster_file.crs,
             transform=raster_file.transform,
-            nodata=nodata
+            nodata=nodata,
+            **get_raster_creation_options(raster_arr.dtype)
     ) as dst:
         for id, layer in enumerate(input_files_list, start=1):
             with rio.open(layer) as src:
@@ -617,3 +1455,5 @@ def create_multiband_raster(input_files_list, output_file, nodata=no_data_value)
                 dst.write_band(id, src.read(1))
                 dst.set_band_description(id, band_name)
 
+    finalize_raster_output(output_file)
+
@@ -0,0 +1,256 @@
+import os
+import json
+import numpy as np
+from collections import namedtuple
+
+from Codes.utils.system_ops import makedirs
+from Codes.utils.raster_ops import read_raster_arr_object
+
+no_data_value = -9999
+
+# valid-pixel (sparse) representation of gridded data -
+# pixel_idx: sorted int32 flat (row-major) indices of the active pixels of a grid
+# vectors: 1-D arrays of values of the active pixels, in pixel_idx order
+# Computations on the vectors scale with the number of active pixels (e.g. irrigated pixels), not the grid size.
+
+# mask store - boolean grid masks (e.g. nan positions of monthly irrigated cropET) of many years/months packed as
+# bits (np.packbits) in a single binary file, one fixed-size row per mask, with a json index {key: row}.
+# The binary file is memory-mapped, so reading a mask only touches its own row.
+mask_store_bin = 'masks.bin'
+mask_store_index = 'masks_index.json'
+
+MaskStore = namedtuple('MaskStore', ['bits', 'index', 'shape'])
+
+# opened mask stores {(absolute store path, index modification time): MaskStore}
+_mask_stores = {}
+
+
+def get_valid_pixel_index(*input_arrs, mask=None):
+    """
+    Get the sorted flat indices of the pixels that are valid (not nan) in all input arrays.
+
+    :param input_arrs: Input numpy arrays (same shape).
+    :param mask: Boolean array (same shape) to further restrict the active pixels (e.g. irrigated fraction > 0).
+                 Default set to None.
+
+    :return: Sorted int32 array of flat (row-major) pixel indices.
+    """
+    valid_mask = np.ones(input_arrs[0].shape, dtype=bool) if mask is None else mask.copy()
+    for arr in input_arrs:
+        valid_mask &= ~np.isnan(arr)
+
+    return np.flatnonzero(valid_mask).astype(np.int32)
+
+
+def gather_pixels(input_arr, pixel_idx):
+    """
+    Gather the values of active pixels from a full grid array.
+
+    :param input_arr: Full grid numpy array.
+    :param pixel_idx: Sorted flat pixel indices (from get_valid_pixel_index()).
+
+    :return: 1-D array of active pixel values.
+    """
+    return input_arr.ravel()[pixel_idx]
+
+
+def scatter_pixels(pixel_values, pixel_idx, shape, fill_value=np.nan, dtype=np.float32, out=None):
+    """
+    Scatter the values of active pixels to a full grid array.
+
+    :param pixel_values: 1-D array of active pixel values.
+    :param pixel_idx: Sorted flat pixel indices (from get_valid_pixel_index()).
+    :param shape: Shape (height, width) of the full grid.
+    :param fill_value: Value of the inactive pixels. Default set to nan.
+    :param dtype: Data type of the full grid array. Default set to np.float32.
+    :param out: A full grid array to scatter into (inactive pixels are kept as they are). Default set to None to
+                create a new array filled with fill_value.
+
+    :return: Full grid numpy array.
+    """
+    if out is None:
+        out = np.full(shape, fill_value, dtype=dtype)
+
+    out.ravel()[pixel_idx] = pixel_values
+
+    return out
+
+
+def read_raster_pixels(input_raster, pixel_idx):
+    """
+    Read a raster and gather the values of its active pixels.
+
+    :param input_raster: Input raster filepath.
+    :param pixel_idx: Sorted flat pixel indices (from get_valid_pixel_index()).
+
+    :return: 1-D float32 array of active pixel values (nodata as nan).
+    """
+    return gather_pixels(read_raster_arr_object(input_raster, get_file=False), pixel_idx)
+
+
+def save_pixel_vectors(output_npz, pixel_idx, shape, **vectors):
+    """
+    Save active pixel indices and value vectors as a compressed .npz file.
+
+    :param output_npz: Filepath of output .npz file.
+    :param pixel_idx: Sorted flat pixel indices (from get_valid_pixel_index()).
+    :param shape: Shape (height, width) of the full grid.
+    :param vectors: Value vectors of the active pixels as keyword arguments (name=vector).
+
+    :return: Filepath of output .npz file.
+    """
+    makedirs([os.path.dirname(output_npz)])
+
+    np.savez_compressed(output_npz, pixel_idx=np.asarray(pixel_idx, dtype=np.int32),
+                        shape=np.asarray(shape, dtype=np.int64), **vectors)
+
+    return output_npz
+
+
+def load_pixel_vectors(input_npz):
+    """
+    Load active pixel indices and value vectors saved with save_pixel_vectors().
+
+    :param input_npz: Filepath of .npz file.
+
+    :return: Pixel indices, grid shape (tuple) and a dictionary of value vectors.
+    """
+    with np.load(input_npz) as npz:
+        pixel_idx = npz['pixel_idx']
+        shape = tuple(int(i) for i in npz['shape'])
+        vectors = {key: npz[key] for key in npz.files if key not in ('pixel_idx', 'shape')}
+
+    return pixel_idx, shape, vectors
+
+
+def get_mask_key(year, month=None):
+    """
+    Get the key of a year's (or a year-month's) mask in a mask store.
+
+    :param year: Year (int).
+    :param month: Month (int). Default set to None for annual masks.
+
+    :return: Key (str), e.g. '2000_1' or '2000'.
+    """
+    return f'{int(year)}_{int(month)}' if month is not None else f'{int(year)}'
+
+
+def get_mask_store_keys(store_dir):
+    """
+    Get the keys of the masks in a mask store.
+
+    :param store_dir: Directory path of the mask store.
+
+    :return: A set of keys (from get_mask_key()). Empty if there is no mask store in store_dir.
+    """
+    if not os.path.exists(os.path.join(store_dir, mask_store_index)):
+        return set()
+
+    return set(open_mask_store(store_dir).index.keys())
+
+
+def write_mask_store(store_dir, masks, shape, append=False):
+    """
+    Write boolean grid masks to a mask store (packed bitmask binary file with a json index).
+
+    :param store_dir: Directory path of the mask store.
+    :param masks: An iterable of (key, boolean mask array) pairs. Keys from get_mask_key().
+    :param shape: Shape (height, width) of the grid.
+    :param append: Set to True to update an existing store in store_dir - masks of new keys are appended as new rows
+                   (and added to the index), masks of existing keys are rewritten in their rows, and the other masks
+                   of the store are kept. Default set to False to overwrite an existing store.
+
+    :return: Directory path of the mask store.
+    """
+    makedirs([store_dir])
+
+    n_pixels = int(np.prod(shape))
+    row_bytes = (n_pixels + 7) // 8
+
+    bin_path = os.path.join(store_dir, mask_store_bin)
+    index_json = os.path.join(store_dir, mask_store_index)
+
+    index = {}
+    if append and os.path.exists(index_json):
+        with open(index_json) as index_file:
+            index_info = json.load(index_file)
+
+        if tuple(index_info['shape']) != tuple(int(i) for i in shape):
+            raise ValueError(f'mask store {store_dir} has grid shape {tuple(index_info["shape"])}, '
+                             f'expected {tuple(shape)}')
+        index = index_info['keys']
+
+    with open(bin_path, mode='r+b' if len(index) > 0 else 'wb') as bin_file:
+        # dropping bytes past the indexed rows (e.g. of an interrupted write)
+        bin_file.truncate(len(index) * row_bytes)
+
+        for key, mask in masks:
+            mask = np.asarray(mask, dtype=bool).ravel()
+            if mask.size != n_pixels:
+                raise ValueError(f'mask {key} has {mask.size} pixels, expected {n_pixels}')
+
+            if key not in index:
+                index[key] = len(index)
+
+            bin_file.seek(index[key] * row_bytes)
+            bin_file.write(np.packbits(mask).tobytes())
+
+    # the index is replaced atomically (after the rows are written), so readers never see keys without rows
+    temp_index_json = os.path.join(store_dir, f'_{mask_store_index}.tmp')
+    with open(temp_index_json, mode='w') as index_file:
+        json.dump({'shape': [int(i) for i in shape], 'row_bytes': row_bytes, 'keys': index}, index_file)
+    os.replace(temp_index_json, index_json)
+
+    return store_dir
+
+
+def open_mask_store(store_dir):
+    """
+    Open (memory-map) a mask store once per process. The store is reopened if it has been rewritten.
+
+    :param store_dir: Directory path of the mask store.
+
+    :return: A MaskStore namedtuple.
+    """
+    store_path = os.path.abspath(store_dir)
+    index_json = os.path.join(store_path, mask_store_index)
+    cache_key = (store_path, os.stat(index_json).st_mtime_ns)
+
+    if cache_key not in _mask_stores:
+        for key in [key for key in _mask_stores.keys() if key[0] == store_path]:
+            _mask_stores.pop(key)
+
+        with open(index_json) as index_file:
+            index_info = json.load(index_file)
+
+        n_masks = len(index_info['keys'])
+        if n_masks > 0:
+            bits = np.memmap(os.path.join(store_path, mask_store_bin), dtype=np.uint8, mode='r',
+                             shape=(n_masks, index_info['row_bytes']))
+        else:
+            bits = np.empty((0, index_info['row_bytes']), dtype=np.uint8)
+
+        _mask_stores[cache_key] = MaskStore(bits=bits, index=index_info['keys'], shape=tuple(index_info['shape']))
+
+    return _mask_stores[cache_key]
+
+
+def read_mask(store_dir, year, month=None):
+    """
+    Read a year's (or a year-month's) mask from a mask store.
+
+    :param store_dir: Directory path of the mask store.
+    :param year: Year (int).
+    :param month: Month (int). Default set to None for annual masks.
+
+    :return: 1-D (flattened grid) boolean array.
+    """
+    store = open_mask_store(store_dir)
+    key = get_mask_key(year, month)
+
+    if key not in store.index:
+        raise KeyError(f'mask {key} not found in {store_dir}')
+
+    n_pixels = int(np.prod(store.shape))
+
+    return np.unpackbits(store.bits[store.index[key]], count=n_pixels).view(bool)
@@ -8,7 +8,7 @@ from osgeo import gdal, osr, ogr
 from shapely.geometry import Polygon
 
 from Codes.utils.system_ops import makedirs
-from Codes.utils.raster_ops import read_raster_arr_object, write_array_to_raster
+from Codes.utils.raster_ops import write_array_to_raster, get_ref_grid
 
 WestUS_raster = '../../Data_main/Compiled_data/reference_rasters/Western_US_refraster_2km.tif'
 
@@ -122,8 +122,8 @@ def create_pixel_multipoly_shapefile(refraster, interim_output_raster, output_fi
     """
 
     # getting total polygons estimate
-    ref_arr, ref_file = read_raster_arr_object(refraster)
-    shape = ref_arr.shape
+    ref_file = get_ref_grid(refraster)
+    shape = ref_file.shape
     total_pol = (shape[0] * shape[1]) + 1  # number of total polygons to create based on no. members in ref raster
 
     # the new_arr will have individual pixels with unique DN values